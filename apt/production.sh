@@ -4,4 +4,5 @@ $(dirname $0)/base.sh
 
 apt-get install --fix-missing -y \
         npm \
-        nodejs
+        nodejs \
+        memcached
@@ -0,0 +1,97 @@
+from collections import OrderedDict
+from threading import Lock
+import time
+
+from django.core.cache.backends.base import BaseCache, DEFAULT_TIMEOUT
+from django.utils.six.moves import cPickle as pickle
+
+
+# Django creates a cache backend per thread, so like LocMemCache the
+# entries are held at module level and shared by name
+_caches = {}
+_locks = {}
+
+class LRULocMemCache(BaseCache):
+    """
+    Local memory cache that evicts the least recently used entry once
+    MAX_ENTRIES is reached, instead of culling a fraction of the whole
+    cache like Django's LocMemCache does. Every entry keeps its own expiry.
+    """
+
+    def __init__(self, name, params):
+        super(LRULocMemCache, self).__init__(params)
+        self._cache = _caches.setdefault(name, OrderedDict())
+        self._lock = _locks.setdefault(name, Lock())
+
+    def _get_live(self, key):
+        """
+        Returns the pickled value for key and marks it as recently used,
+        dropping it if it has expired. Must be called with the lock held.
+        """
+        try:
+            pickled, expiry = self._cache.pop(key)
+        except KeyError:
+            return None
+        if expiry is not None and expiry <= time.time():
+            return None
+        self._cache[key] = (pickled, expiry)
+        return pickled
+
+    def _set(self, key, value, timeout):
+        self._cache.pop(key, None)
+        while len(self._cache) >= self._max_entries:
+            self._cache.popitem(last=False)
+        pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self._cache[key] = (pickled, self.get_backend_timeout(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            if self._get_live(key) is not None:
+                return False
+            self._set(key, value, timeout)
+            return True
+
+    def get(self, key, default=None, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            pickled = self._get_live(key)
+        if pickled is None:
+            return default
+        return pickle.loads(pickled)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            self._set(key, value, timeout)
+
+    def incr(self, key, delta=1, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            pickled = self._get_live(key)
+            if pickled is None:
+                raise ValueError("Key '%s' not found" % key)
+            new_value = pickle.loads(pickled) + delta
+            expiry = self._cache[key][1]
+            self._cache[key] = (pickle.dumps(new_value, pickle.HIGHEST_PROTOCOL), expiry)
+        return new_value
+
+    def has_key(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            return self._get_live(key) is not None
+
+    def delete(self, key, version=None):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        with self._lock:
+            self._cache.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
@@ -0,0 +1,35 @@
+"""
+Cooperative concurrency under gevent, for uwsgi-gevent.conf.
+
+With COURTFINDER_GEVENT set, wsgi.py calls patch() before anything else is
+imported. The standard library's sockets, threads and locks are replaced by
+gevent's, and psycopg2 waits through gevent, so a request waiting on MapIt,
+S3 or the database lets the worker serve other requests meanwhile. The
+pooled MapIt session, the healthcheck's background refresh and the batch
+search's lookup threads then run as greenlets without changes.
+
+This module is imported before the settings, so it mustn't import Django.
+"""
+import os
+
+
+def enabled():
+    return os.getenv('COURTFINDER_GEVENT', 'no').lower() in ['enabled', 'yes', 'true', '1']
+
+
+def patch():
+    from gevent import monkey
+    monkey.patch_all()
+
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+    # uWSGI forks the workers from C, so gevent doesn't get to reset its
+    # event loop in them
+    try:
+        from uwsgidecorators import postfork
+    except ImportError:
+        pass
+    else:
+        import gevent
+        postfork(gevent.reinit)
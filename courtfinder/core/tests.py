@@ -0,0 +1,44 @@
+import os
+
+from django.test import TestCase
+from mock import patch
+
+from core import cooperative
+from core.cache import LRULocMemCache
+
+
+class LRULocMemCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.cache = LRULocMemCache('test-lru', {'OPTIONS': {'MAX_ENTRIES': 2}})
+        self.cache.clear()
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set('a', 1)
+        self.cache.set('b', 2)
+        self.cache.get('a')
+        self.cache.set('c', 3)
+        self.assertEqual(self.cache.get('a'), 1)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertEqual(self.cache.get('c'), 3)
+
+    def test_entry_expires(self):
+        self.cache.set('a', 1, 0)
+        self.assertIsNone(self.cache.get('a'))
+
+    def test_incr(self):
+        self.cache.add('a', 0, None)
+        self.cache.incr('a')
+        self.assertEqual(self.cache.incr('a'), 2)
+
+
+class CooperativeTestCase(TestCase):
+
+    def test_enabled(self):
+        with patch.dict(os.environ, {'COURTFINDER_GEVENT': 'yes'}):
+            self.assertTrue(cooperative.enabled())
+        with patch.dict(os.environ, {'COURTFINDER_GEVENT': 'no'}):
+            self.assertFalse(cooperative.enabled())
+        with patch.dict(os.environ):
+            os.environ.pop('COURTFINDER_GEVENT', None)
+            self.assertFalse(cooperative.enabled())
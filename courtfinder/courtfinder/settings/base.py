@@ -139,6 +139,74 @@ STATICFILES_DIRS = (
 MAPIT_BASE_URL = 'https://mapit.mysociety.org/postcode/'
 MAPTI_API_KEY = os.environ.get('MAPIT_API_KEY', None)
 
+# MapIt requests: timeouts in seconds, retries on connection errors, and the
+# circuit breaker that stops calling MapIt after consecutive failures
+MAPIT_CONNECT_TIMEOUT = 2
+MAPIT_READ_TIMEOUT = 5
+MAPIT_RETRIES = 2
+# connections kept open to MapIt: raise it with the requests a worker can
+# have in flight at once, as under uwsgi-gevent.conf
+MAPIT_POOL_SIZE = int(os.environ.get('MAPIT_POOL_SIZE', 10))
+MAPIT_BREAKER_THRESHOLD = 5
+MAPIT_BREAKER_RESET_TIMEOUT = 30
+
+# Offline postcode lookup tried before MapIt, eg 'search.gazetteer.GazetteerBackend'.
+# Build the gazetteer with: ./manage.py build-gazetteer <ONS postcode directory csv>
+POSTCODE_LOOKUP_BACKEND = os.environ.get('POSTCODE_LOOKUP_BACKEND', None)
+POSTCODE_GAZETTEER_PATH = os.environ.get('POSTCODE_GAZETTEER_PATH', join(PROJECT_ROOT, 'data', 'gazetteer.bin'))
+
+# Postcode lookups are cached in the 'postcodes' cache. Point it at a shared
+# backend (file or memcached) to share lookups between uWSGI workers.
+POSTCODE_CACHE_TTL = 24 * 60 * 60
+POSTCODE_CACHE_NEGATIVE_TTL = 5 * 60
+
+# Rendered court pages and leaflets. Cache keys include the ingested data
+# version, so a new ingest makes the old entries unreachable.
+COURT_PAGE_CACHE_TTL = 60 * 60
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'postcodes': {
+        'BACKEND': os.environ.get('POSTCODE_CACHE_BACKEND', 'core.cache.LRULocMemCache'),
+        'LOCATION': os.environ.get('POSTCODE_CACHE_LOCATION', 'postcodes'),
+        'TIMEOUT': POSTCODE_CACHE_TTL,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('POSTCODE_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+    # rendered court and leaflet pages, keyed by the data version they
+    # were rendered from, see courts.views.cached_page
+    'pages': {
+        'BACKEND': 'core.cache.LRULocMemCache',
+        'LOCATION': 'court-pages',
+        'TIMEOUT': COURT_PAGE_CACHE_TTL,
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.environ.get('COURT_PAGE_CACHE_MAX_ENTRIES', 2000)),
+        },
+    },
+}
+
+# The most searches one POST to /search/results.json/batch can make, and
+# how many of their postcodes are looked up at once
+SEARCH_BATCH_MAX_SIZE = 1000
+SEARCH_BATCH_LOOKUP_THREADS = 8
+
+# Where the /courts.json dumps are written, see courts.export
+COURTS_EXPORT_DIR = os.environ.get('COURTS_EXPORT_DIR', '/tmp/courtfinder-export')
+
+# How often, in seconds, workers check for newly ingested data to reload
+# the in-memory court catalogue
+CATALOGUE_CHECK_INTERVAL = 10
+
+# populate-db --publish loads into a new schema and swaps it in. It refuses
+# to publish fewer courts than this share of the live ones, and keeps this
+# many retired schemas to roll back to.
+PUBLISH_MIN_COURTS_RATIO = 0.9
+PUBLISH_KEEP_SCHEMAS = 3
+PUBLISH_LOCK_TIMEOUT = '5s'
+
 # Email for feedback
 FEEDBACK_EMAIL_SENDER = os.environ.get('FEEDBACK_EMAIL_SENDER', 'no-reply@courttribunalfinder.service.gov.uk')
 FEEDBACK_EMAIL_RECEIVER = os.environ.get('FEEDBACK_EMAIL_RECEIVER', None)
@@ -251,11 +319,16 @@ LOGGING = {
 AUTODISCOVER_HEALTHCHECKS = True
 COURTFINDER_ADMIN_HEALTHCHECK_URL = ''
 COURTS_DATA_S3_URL = ''
+# How long, in seconds, the healthcheck trusts the last ETag of COURTS_DATA_S3_URL
+COURTS_DATA_HEALTHCHECK_TTL = 60
 COURT_IMAGE_BASE_URL = ''
 
 RATELIMIT_CACHE_BACKEND = 'courtfinder.brake_config.ELBBrake'
 
 FEATURE_LEAFLETS_ENABLED = False
+# Answer name and address searches from the catalogue's inverted index,
+# with prefix matching, rather than PostgreSQL
+FEATURE_INVERTED_INDEX_ENABLED = True
 
 try:
     from .local import *
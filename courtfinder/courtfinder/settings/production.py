@@ -34,3 +34,10 @@ COURTS_DATA_S3_URL = os.getenv('COURTS_DATA_S3_URL', 'https://s3-eu-west-1.amazo
 COURT_IMAGE_BASE_URL = os.getenv('COURT_IMAGE_BASE_URL', 'https://courtfinder-servicegovuk-production.s3.amazonaws.com/images/')
 
 FEATURE_LEAFLETS_ENABLED = is_enabled('FEATURE_LEAFLETS_ENABLED')
+FEATURE_INVERTED_INDEX_ENABLED = is_enabled('FEATURE_INVERTED_INDEX_ENABLED', default=True)
+
+# Share postcode lookups between the uWSGI workers. memcached evicts the
+# least recently used entries once it is full, so size it with its -m
+# option, as MAX_ENTRIES doesn't apply; run.sh starts a local one.
+CACHES['postcodes']['BACKEND'] = os.getenv('POSTCODE_CACHE_BACKEND', 'django.core.cache.backends.memcached.MemcachedCache')
+CACHES['postcodes']['LOCATION'] = os.getenv('POSTCODE_CACHE_LOCATION', '127.0.0.1:11211')
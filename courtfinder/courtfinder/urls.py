@@ -3,6 +3,7 @@ from django.conf.urls import patterns, include, url
 urlpatterns = patterns('',
     url(r'^search/', include('search.urls', namespace='search')),
     url(r'^courts/', include('courts.urls', namespace='courts')),
+    url(r'^courts\.json$', 'courts.views.courts_export', name='courts-export'),
     url(r'^', include('staticpages.urls', namespace='staticpages')),
     url(r'^', include('healthcheck.urls', namespace='healthcheck')),
 )
@@ -8,7 +8,17 @@ https://docs.djangoproject.com/en/dev/howto/deployment/wsgi/
 """
 
 import os
+
+# Before anything opens a socket or takes a lock: see core.cooperative
+from core import cooperative
+if cooperative.enabled():
+    cooperative.patch()
+
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "courtfinder.settings")
 
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
+
+# Build the court catalogue before uWSGI forks the workers
+from search.catalogue import warm_up
+warm_up()
@@ -0,0 +1,135 @@
+"""
+The /courts.json dump of every court's document.
+
+The dump only changes with the data, so it is written once per ingest to
+COURTS_EXPORT_DIR, named after the DataStatus hash, together with gzip and,
+when the brotli module is installed, brotli compressed copies. Files are
+written under a temporary name and renamed into place, so a worker never
+serves a partly written dump. populate-db removes the dumps of older data.
+"""
+import gzip
+import json
+import os
+import re
+from threading import Lock
+
+from django.conf import settings
+
+from search.catalogue import get_catalogue
+from search import documents
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Content-Encoding: file suffix, best first
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'), ('identity', ''))
+
+_lock = Lock()
+
+
+def data_hash(catalogue):
+    version = catalogue.version
+    return re.sub(r'[^0-9A-Za-z]', '', version[1]) if version and version[1] else 'none'
+
+
+def path(hash, encoding='identity'):
+    return os.path.join(settings.COURTS_EXPORT_DIR,
+                        'courts-%s.json%s' % (hash, dict(ENCODINGS)[encoding]))
+
+
+def available(hash):
+    """
+    The encodings the dump of the data with this hash has been written in
+    """
+    return [encoding for encoding, suffix in ENCODINGS if os.path.exists(path(hash, encoding))]
+
+
+class Writers(object):
+    """
+    Writes the dump and its compressed copies in one pass
+    """
+
+    def __init__(self, hash):
+        self.paths = [path(hash, 'identity'), path(hash, 'gzip')]
+        if brotli is not None:
+            self.paths.append(path(hash, 'br'))
+        # named for the process, as other workers may be writing it too
+        self.suffix = '.%d.tmp' % os.getpid()
+        self.closed = False
+        self.raw = open(self.paths[0] + self.suffix, 'wb')
+        self.gzip = gzip.GzipFile(self.paths[1] + self.suffix, 'wb', 9)
+        self.brotli = None
+        if brotli is not None:
+            self.brotli = open(self.paths[2] + self.suffix, 'wb')
+            self.compressor = brotli.Compressor(quality=11)
+
+    def write(self, data):
+        self.raw.write(data)
+        self.gzip.write(data)
+        if self.brotli is not None:
+            self.brotli.write(self.compressor.process(data))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.brotli is not None:
+            self.brotli.write(self.compressor.finish())
+            self.brotli.close()
+        self.gzip.close()
+        self.raw.close()
+
+    def commit(self):
+        # the uncompressed dump last, as its presence means the dump is done
+        for final_path in reversed(self.paths):
+            os.rename(final_path + self.suffix, final_path)
+
+    def discard(self):
+        for final_path in self.paths:
+            if os.path.exists(final_path + self.suffix):
+                os.remove(final_path + self.suffix)
+
+
+def build(catalogue=None, prune=False):
+    """
+    Write the dump of the catalogue's data unless it is already there,
+    and with prune, remove every other dump. Returns the data hash.
+    """
+    catalogue = catalogue or get_catalogue()
+    hash = data_hash(catalogue)
+    with _lock:
+        if not os.path.isdir(settings.COURTS_EXPORT_DIR):
+            os.makedirs(settings.COURTS_EXPORT_DIR)
+        if not os.path.exists(path(hash)):
+            write(catalogue, hash)
+        if prune:
+            current = set(path(hash, encoding) for encoding, suffix in ENCODINGS)
+            for filename in os.listdir(settings.COURTS_EXPORT_DIR):
+                old_path = os.path.join(settings.COURTS_EXPORT_DIR, filename)
+                if filename.startswith('courts-') and old_path not in current \
+                        and not filename.endswith('.tmp'):
+                    os.remove(old_path)
+    return hash
+
+
+def write(catalogue, hash):
+    writers = Writers(hash)
+    try:
+        writers.write('[')
+        for i, slug in enumerate(sorted(catalogue.by_slug)):
+            court = catalogue.court_by_slug(slug)
+            document = catalogue.document(slug) or documents.court_document(court, catalogue)
+            writers.write((',\n' if i else '\n') + json.dumps(document))
+        writers.write('\n]\n')
+        writers.close()
+        writers.commit()
+    except Exception:
+        try:
+            writers.close()
+        finally:
+            writers.discard()
+        raise
+
@@ -1,14 +1,22 @@
+import gzip
+import io
 import json
 import pprint
 import re
 import requests
+import shutil
+import tempfile
 
 import cssselect
 from django.conf import settings
+from django.core.cache import caches
 from django.test import TestCase, Client
+from django.test.utils import override_settings
 from lxml import html as lh
 from mock import Mock, patch
 
+from courts.views import format_court
+from search.catalogue import get_catalogue
 from search.court_search import CourtSearch, CourtSearchError, CourtSearchInvalidPostcode
 from search.ingest import Ingest
 from search.models import *
@@ -22,6 +30,7 @@ class SearchTestCase(TestCase):
         imports = json.loads(courts_json_1)
         Ingest.courts(imports['courts'])
         Ingest.emergency_message(imports['emergency_message'])
+        caches['pages'].clear()
 
     def test_sample_court_page(self):
         c = Client()
@@ -85,6 +94,48 @@ class SearchTestCase(TestCase):
         self.assertIn('Blue badge parking is available on site.',
                       response.content)
 
+    @override_settings(CATALOGUE_CHECK_INTERVAL=3600)
+    def test_format_court_query_count(self):
+        courts = get_catalogue().courts.values()
+        with self.assertNumQueries(0):
+            formatted = [format_court(court) for court in courts]
+        tameside = [c for c in formatted if c['slug'] == 'tameside-magistrates-court'][0]
+        self.assertEqual([a['name'] for a in tameside['areas_of_law']],
+                         sorted(a['name'] for a in tameside['areas_of_law']))
+        self.assertEqual([o['description'] for o in tameside['opening_times']],
+                         sorted(o['description'] for o in tameside['opening_times']))
+
+    def test_court_page_cached(self):
+        c = Client()
+        first = c.get('/courts/tameside-magistrates-court')
+        with patch('courts.views.render') as render:
+            second = c.get('/courts/tameside-magistrates-court')
+            self.assertFalse(render.called)
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['ETag'], second['ETag'])
+
+    def test_court_page_cache_keyed_on_params(self):
+        c = Client()
+        plain = c.get('/courts/tameside-magistrates-court')
+        with_query = c.get('/courts/tameside-magistrates-court?q=Tameside')
+        self.assertNotEqual(plain['ETag'], with_query['ETag'])
+        ignored = c.get('/courts/tameside-magistrates-court?utm_source=email')
+        self.assertEqual(plain['ETag'], ignored['ETag'])
+
+    def test_court_page_not_modified(self):
+        c = Client()
+        etag = c.get('/courts/tameside-magistrates-court')['ETag']
+        response = c.get('/courts/tameside-magistrates-court', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_court_page_last_modified(self):
+        c = Client()
+        response = c.get('/courts/accrington-magistrates-court')
+        self.assertEqual(response['Last-Modified'], 'Wed, 16 Apr 2014 13:04:44 GMT')
+        response = c.get('/courts/accrington-magistrates-court',
+                         HTTP_IF_MODIFIED_SINCE='Wed, 16 Apr 2014 13:04:44 GMT')
+        self.assertEqual(response.status_code, 304)
+
     def test_court_404(self):
         c = Client()
         response = c.get('/courts/tameside-magistrates-c0urt')
@@ -228,3 +279,74 @@ class SearchTestCase(TestCase):
 
         self.assertIn("new", summary, "No new style facilities found")
         self.assertIn("old", summary, "No old style facilities found")
+
+
+class ExportTestCase(TestCase):
+
+    def setUp(self):
+        test_data_dir = settings.PROJECT_ROOT +  '/data/test_data/'
+        imports = json.loads(open(test_data_dir + 'courts.json').read())
+        Ingest.courts(imports['courts'])
+        DataStatus.objects.create(data_hash='abc123')
+        self.export_dir = tempfile.mkdtemp()
+        self.settings_override = override_settings(COURTS_EXPORT_DIR=self.export_dir)
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.export_dir)
+
+    def content(self, response):
+        return ''.join(response.streaming_content)
+
+    def test_every_court_is_exported(self):
+        response = Client().get('/courts.json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Content-Encoding'))
+        content = self.content(response)
+        self.assertEqual(int(response['Content-Length']), len(content))
+        exported = json.loads(content)
+        self.assertEqual([court['slug'] for court in exported],
+                         sorted(set(Court.objects.values_list('slug', flat=True))))
+        self.assertIn('abc123', response['ETag'])
+
+    def test_gzip(self):
+        plain = self.content(Client().get('/courts.json'))
+        response = Client().get('/courts.json', HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        content = gzip.GzipFile(fileobj=io.BytesIO(self.content(response))).read()
+        self.assertEqual(content, plain)
+        response = Client().get('/courts.json', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+
+    def test_conditional_get(self):
+        etag = Client().get('/courts.json')['ETag']
+        response = Client().get('/courts.json', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_ranges(self):
+        plain = self.content(Client().get('/courts.json'))
+        response = Client().get('/courts.json', HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/%d' % len(plain))
+        self.assertEqual(self.content(response), plain[10:20])
+        response = Client().get('/courts.json', HTTP_RANGE='bytes=-5')
+        self.assertEqual(self.content(response), plain[-5:])
+        response = Client().get('/courts.json', HTTP_RANGE='bytes=%d-' % len(plain))
+        self.assertEqual(response.status_code, 416)
+        # a range ending before it starts is ignored
+        response = Client().get('/courts.json', HTTP_RANGE='bytes=19-10')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.content(response), plain)
+        # a range of a different version gets the whole file
+        response = Client().get('/courts.json', HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_new_data_new_dump(self):
+        first = Client().get('/courts.json')['ETag']
+        Ingest.courts([])
+        DataStatus.objects.create(data_hash='def456')
+        response = Client().get('/courts.json')
+        self.assertNotEqual(response['ETag'], first)
+        self.assertEqual(json.loads(self.content(response)), [])
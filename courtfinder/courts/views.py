@@ -1,113 +1,77 @@
+import datetime
+import hashlib
+import os
+import re
 import string
+from functools import wraps
 from django.core.urlresolvers import reverse
 from django.conf import settings
 from django.shortcuts import render, redirect
-from django.http import HttpResponse, Http404
+from django.http import HttpResponse, Http404, StreamingHttpResponse
+from django.core.cache import caches
+from django.views.decorators.http import condition
 from django.utils.html import strip_entities, strip_tags
 from search.models import Court, AreaOfLaw
+from search.catalogue import get_catalogue
+from search import documents
+from courts import export
 
 
-def collapse(source, key, key2):
+def format_court(court):
     """
-    Groups objects's key2 by similar key1:
-
-    [{'foo': [1]}, {'bar':[2]}, {'bar':[3]}] => [{'foo': [1], {'bar': [2,3]}}]
-    [{'bailiff': [0800383727]}, {'bailiff':[018746]}, {'enquiries':[012874]}] =>
-      [{'bailiff': [0800383727, 018746]}, {'enquiries': [012874]}}]
+    create a courts object that we can send to templates: the court's
+    document stored at ingest, or one built from the catalogue if there
+    isn't one yet, with this host's image url
     """
-    result=[]
-    for item in source:
-        if len(result) > 0 and item[key] == result[-1][key]:
-            result[-1][key2].append(item[key2][0])
-        else:
-            result.append(item)
-    return result
+    catalogue = get_catalogue()
+    document = dict(catalogue.document(court.slug) or documents.court_document(court, catalogue))
+    document['image_url'] = (settings.COURT_IMAGE_BASE_URL + document['image_file']) \
+        if document['image_file'] else ''
+    return document
 
 
-def format_court(court):
+# query params the court page shows back to the user
+COURT_PAGE_PARAMS = ('q', 'aol', 'spoe', 'postcode', 'courtcode')
+
+
+def page_etag(request, slug, leaflet_type=None):
     """
-    create a courts object that we can send to templates
+    Identifies a rendering of a court page or leaflet: the court, the
+    leaflet, the query params shown on the page and the data version
     """
-    addresses = court.courtaddress_set.all().order_by('address_type__name')
-    postal_address = None
-    visiting_address = None
-    for address in addresses:
-        address_obj = {
-            'address_lines': [line for line in address.address.split('\n') if line != ''],
-            'postcode':address.postcode,
-            'town':address.town.name,
-            'county': address.town.county,
-            'type': address.address_type
-        }
-        if str(address.address_type) == 'Postal' or str(address.address_type) == 'Postal and Visiting':
-            postal_address = address_obj
-        else:
-            visiting_address = address_obj
-
-    if postal_address and str(postal_address['type']) == 'Postal and Visiting':
-        visiting_address = None
-
-    emails = [{'description':email.description, 'addresses': [email.address]} for email in court.emails.all()]
-    emails.sort(key=lambda x: x['description'])
-    contacts = [{'name':contact.name, 'numbers': [contact.number], 'explanation': contact.explanation, 'in_leaflet': contact.in_leaflet} for contact in court.contacts.all().order_by('sort_order')]
-
-    facilities = [
-        {
-            # Name is used for the css class name to set the x,y offsets on old style images
-            'name': facility.name,
-            # Description is used for the display text
-            'description': facility.description,
-            # Image class is the generated class name (empty for new style images)
-            'image_class': "" if facility.image_file_path else 'icon-' + facility.image,
-            # The relative path to the image
-            'image_src': facility.image_file_path if facility.image_file_path else 'images/facility_icons.png',
-            # This description is used for the alt text
-            'image_description': facility.image_description,
-            # The relative file path of the image
-            'image_file_path': facility.image_file_path
-        }
-        for facility in court.facilities.all()
-    ]
-
-    court_obj = { 'name': court.name,
-                  'displayed': court.displayed,
-                  'lat': court.lat,
-                  'lon': court.lon,
-                  'number': court.number,
-                  'cci_code': court.cci_code,
-                  'updated_at': court.updated_at.strftime("%d %B %Y") if court.updated_at else '',
-                  'slug': court.slug,
-                  'image_file': court.image_file,
-                  'image_url': (settings.COURT_IMAGE_BASE_URL + court.image_file) if court.image_file else '',
-                  'types': [court_type.court_type.name for court_type in court.courtcourttype_set.all()],
-                  'postal_address': postal_address,
-                  'visiting_address': visiting_address,
-                  'opening_times': court.opening_times.all().order_by("description"),
-                  'areas_of_law': court.areas_of_law.all().order_by("name"),
-                  'facilities': sorted(facilities, key=lambda x: x['name']),
-                  'emails': collapse(emails, 'description', 'addresses'),
-                  'contacts': collapse(contacts, 'name', 'numbers'),
-                  'directions': court.directions if court.directions else None,
-                  'alert': court.alert if court.alert and court.alert.strip() != '' else None,
-                  'parking': court.parking or None,
-                  'info': court.info,
-                  'hide_aols': court.hide_aols,
-                  'info_leaflet': court.info_leaflet,
-                  'juror_leaflet': court.juror_leaflet,
-                  'defence_leaflet': court.defence_leaflet,
-                  'prosecution_leaflet': court.prosecution_leaflet}
-
-    dx_contact = court.contacts.filter(courtcontact__contact__name='DX')
-    if dx_contact.count() > 0:
-        court_obj['dx_number'] = dx_contact.first().number
-
-    return court_obj
+    params = [] if leaflet_type else [(p, request.GET.get(p)) for p in COURT_PAGE_PARAMS]
+    key = repr((get_catalogue().version, slug, leaflet_type, params,
+                settings.FEATURE_LEAFLETS_ENABLED))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def page_last_modified(request, slug, leaflet_type=None):
+    the_court = get_catalogue().court_by_slug(slug)
+    return the_court.updated_at if the_court else None
 
 
+def cached_page(view):
+    """
+    Serves court pages from the 'pages' cache, keyed by page_etag, and
+    answers conditional GETs with 304 Not Modified
+    """
+    @condition(etag_func=page_etag, last_modified_func=page_last_modified)
+    @wraps(view)
+    def cached_view(request, *args, **kwargs):
+        key = 'court-page:%s' % page_etag(request, *args, **kwargs)
+        response = caches['pages'].get(key)
+        if response is None:
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200:
+                caches['pages'].set(key, response)
+        return response
+    return cached_view
+
+
+@cached_page
 def court(request, slug):
-    try:
-        the_court = Court.objects.get(slug=slug)
-    except Court.DoesNotExist:
+    the_court = get_catalogue().court_by_slug(slug)
+    if the_court is None:
         raise Http404
 
     return render(request, 'courts/court.jinja', {
@@ -120,11 +84,12 @@ def court(request, slug):
         'feature_leaflet_enabled': settings.FEATURE_LEAFLETS_ENABLED,
     })
     
+@cached_page
 def leaflet (request, slug, leaflet_type):
-    try:
-        court = format_court(Court.objects.get(slug=slug))
-    except Court.DoesNotExist:
-        raise Http404  
+    the_court = get_catalogue().court_by_slug(slug)
+    if the_court is None:
+        raise Http404
+    court = format_court(the_court)
 
     if court['displayed']:
         if leaflet_type == 'venue_information':
@@ -162,3 +127,99 @@ def list(request, first_letter='A'):
         'letters': string.ascii_uppercase,
         'courts': list_format_courts(Court.objects.filter(name__iregex=r'^'+first_letter).order_by('name')) if first_letter else None
     })
+
+
+def accepted_encodings(request):
+    """
+    The content codings the client accepts, ignoring any with q=0
+    """
+    accepted = set()
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        name, _, params = coding.partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q=') and not params[2:].strip('0.'):
+            continue
+        accepted.add(name.strip().lower())
+    return accepted
+
+
+def export_encoding(request, hash):
+    accepted = accepted_encodings(request)
+    for encoding in export.available(hash):
+        if encoding == 'identity' or encoding in accepted or '*' in accepted:
+            return encoding
+
+
+def export_etag(request):
+    hash = export.build()
+    return '%s-%s' % (hash, export_encoding(request, hash))
+
+
+def export_last_modified(request):
+    return datetime.datetime.utcfromtimestamp(os.path.getmtime(export.path(export.build())))
+
+
+def byte_range(request, size, etag):
+    """
+    (start, end) of the single byte range requested, None for the whole
+    file, or False if the range can't be satisfied. Invalid ranges, like
+    ones ending before they start, are ignored (RFC 7233, section 2.1).
+    """
+    match = re.match(r'^bytes=(\d*)-(\d*)$', request.META.get('HTTP_RANGE', '').replace(' ', ''))
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not match or (if_range and if_range.strip('"') != etag) or not any(match.groups()):
+        return None
+    first, last = match.groups()
+    if first and last and int(first) > int(last):
+        return None
+    if not first:
+        # the last `last` bytes
+        start, end = max(size - int(last), 0), size - 1
+    else:
+        start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        # starts after the end of the file, or is the last 0 bytes
+        return False
+    return start, end
+
+
+def read_range(path, start, length, block_size=64 * 1024):
+    with open(path, 'rb') as export_file:
+        export_file.seek(start)
+        while length > 0:
+            block = export_file.read(min(block_size, length))
+            if not block:
+                break
+            length -= len(block)
+            yield block
+
+
+@condition(etag_func=export_etag, last_modified_func=export_last_modified)
+def courts_export(request):
+    """
+    Every court's document as one JSON list, precompressed, with ranges
+    """
+    hash = export.build()
+    encoding = export_encoding(request, hash)
+    path = export.path(hash, encoding)
+    size = os.path.getsize(path)
+    etag = '%s-%s' % (hash, encoding)
+
+    requested = byte_range(request, size, etag)
+    if requested is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */%d' % size
+        return response
+
+    start, end = requested or (0, size - 1)
+    response = StreamingHttpResponse(read_range(path, start, end - start + 1),
+                                     status=206 if requested else 200,
+                                     content_type='application/json')
+    response['Content-Length'] = str(end - start + 1)
+    if requested:
+        response['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size)
+    response['Accept-Ranges'] = 'bytes'
+    response['Vary'] = 'Accept-Encoding'
+    if encoding != 'identity':
+        response['Content-Encoding'] = encoding
+    return response
@@ -0,0 +1,127 @@
+"""
+Whether the ingested courts data matches the courts.json on S3, cheaply.
+
+Healthchecks are polled constantly, so neither hash is worked out per
+request. The S3 hash is the ETag from a HEAD request, made at most every
+COURTS_DATA_HEALTHCHECK_TTL seconds. Once there is a hash, it is refreshed
+in a background thread while callers keep getting the last one. An ETag is
+the MD5 of the object unless it was uploaded in parts, in which case the
+object is downloaded and hashed instead, once per ETag. The local hash,
+from the latest DataStatus, is cached for CATALOGUE_CHECK_INTERVAL seconds.
+"""
+import datetime
+import hashlib
+from threading import Lock, Thread
+import time
+
+from django.conf import settings
+from django.utils import timezone
+import requests
+
+from search.models import DataStatus
+
+
+_remote = {'url': None, 'hash': None, 'error': None, 'checked_at': 0, 'refreshing': False}
+_local = {'status': None, 'checked_at': 0}
+# the MD5 of the last download, and the url and version it was of
+_download = {'url': None, 'version': None, 'hash': None}
+_lock = Lock()
+
+
+def fetch_remote_hash(url):
+    r = requests.head(url, timeout=10)
+    assert r.status_code == 200, 'S3 url for courts.json data did not return 200'
+    etag = r.headers.get('ETag', '').strip('"')
+    if etag and '-' not in etag:
+        return etag
+
+    # without an ETag, the size and date tell whether the file has changed
+    version = etag or (r.headers.get('Last-Modified'), r.headers.get('Content-Length'))
+    with _lock:
+        if _download['url'] == url and _download['version'] == version and any(version):
+            return _download['hash']
+
+    r = requests.get(url, stream=True, timeout=10)
+    assert r.status_code == 200, 'S3 url for courts.json data did not return 200'
+    digest = hashlib.md5()
+    for chunk in r.iter_content(65536):
+        digest.update(chunk)
+    value = digest.hexdigest()
+    with _lock:
+        _download.update(url=url, version=version, hash=value)
+    return value
+
+
+def _refresh(url):
+    try:
+        value, error = fetch_remote_hash(url), None
+    except (requests.RequestException, Exception) as e:
+        value, error = None, unicode(e)
+    with _lock:
+        _remote.update(url=url, hash=value, error=error, checked_at=time.time(),
+                       refreshing=False)
+
+
+def remote_hash(url):
+    """
+    Returns the hash of the file at url, the error fetching it if there
+    was one, and when it was fetched. Only the first call for a url waits
+    for it.
+    """
+    with _lock:
+        first = _remote['url'] != url
+        stale = time.time() - _remote['checked_at'] >= settings.COURTS_DATA_HEALTHCHECK_TTL
+        in_background = stale and not first and not _remote['refreshing']
+        if in_background:
+            _remote['refreshing'] = True
+    if first:
+        _refresh(url)
+    elif in_background:
+        thread = Thread(target=_refresh, args=(url,))
+        thread.daemon = True
+        thread.start()
+    with _lock:
+        return _remote['hash'], _remote['error'], _remote['checked_at']
+
+
+def local_status():
+    """
+    The hash and date of the latest ingestion, or None before the first
+    """
+    with _lock:
+        now = time.time()
+        if _local['checked_at'] != 0 and now - _local['checked_at'] < settings.CATALOGUE_CHECK_INTERVAL:
+            return _local['status']
+    # outside the lock, so a slow query doesn't hold up the S3 refresh
+    status = DataStatus.objects.order_by('-last_ingestion_date', '-pk') \
+        .values_list('data_hash', 'last_ingestion_date').first()
+    with _lock:
+        _local.update(status=status, checked_at=now)
+    return status
+
+
+def check():
+    """
+    UP if the local courts data is the same as S3's, or was ingested less
+    than 10 minutes ago
+    """
+    report = {
+        'status': 'DOWN',
+    }
+    try:
+        assert settings.COURTS_DATA_S3_URL, 'S3 url for courts.json data not known'
+        report['s3_url'] = settings.COURTS_DATA_S3_URL
+        s3_hash, error, checked_at = remote_hash(settings.COURTS_DATA_S3_URL)
+        assert error is None, error
+        report['s3_hash'] = s3_hash
+        report['s3_checked_seconds_ago'] = int(time.time() - checked_at)
+        last_ingestion = local_status()
+        assert last_ingestion is not None, 'No courts data has been ingested'
+        report['local_hash'], report['local_date'] = last_ingestion
+        assert s3_hash == report['local_hash'] \
+            or timezone.now() - report['local_date'] <= datetime.timedelta(minutes=10), \
+            'Local courts data is different from S3 and older than 10min'
+        report['status'] = 'UP'
+    except (requests.RequestException, Exception) as e:
+        report['error'] = unicode(e)
+    return report
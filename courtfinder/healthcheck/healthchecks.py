@@ -1,6 +1,18 @@
 from django.conf import settings
 
-from moj_irat.healthchecks import UrlHealthcheck, registry
+from moj_irat.healthchecks import Healthcheck, UrlHealthcheck, registry
+
+from search import postcode_cache
+
+
+class PostcodeCacheHealthcheck(Healthcheck):
+    """
+    Reports the postcode lookup cache hits and misses of the worker serving
+    the healthcheck. Always up: a cold cache only means more MapIt requests.
+    """
+
+    def __call__(self, *args, **kwargs):
+        return self.success_response(**postcode_cache.stats())
 
 
 registry.register_healthcheck(UrlHealthcheck(
@@ -12,3 +24,6 @@ registry.register_healthcheck(UrlHealthcheck(
     name='courtfinder_admin',
     url=settings.COURTFINDER_ADMIN_HEALTHCHECK_URL,
 ))
+registry.register_healthcheck(PostcodeCacheHealthcheck(
+    name='postcode_cache',
+))
@@ -0,0 +1,182 @@
+import datetime
+import hashlib
+import json
+import threading
+import time
+
+from django.test import TestCase, RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+from mock import Mock, patch
+
+from healthcheck import courts_data, views
+from search.models import DataStatus
+
+
+S3_URL = 'https://s3.example.com/courts.json'
+
+
+class ImmediateThread(object):
+    """
+    Runs the background refresh when it is started
+    """
+
+    def __init__(self, target, args):
+        self.target = target
+        self.args = args
+        self.daemon = False
+
+    def start(self):
+        self.target(*self.args)
+
+
+@override_settings(COURTS_DATA_S3_URL=S3_URL, COURTS_DATA_HEALTHCHECK_TTL=60,
+                   CATALOGUE_CHECK_INTERVAL=0)
+class CourtsDataTestCase(TestCase):
+
+    def setUp(self):
+        courts_data._remote.update(url=None, hash=None, error=None, checked_at=0, refreshing=False)
+        courts_data._local.update(status=None, checked_at=0)
+        courts_data._download.update(url=None, version=None, hash=None)
+        self.now = 1000000.0
+        self.time_patcher = patch('healthcheck.courts_data.time')
+        self.time_patcher.start().time.side_effect = lambda: self.now
+        self.head_patcher = patch('healthcheck.courts_data.requests.head')
+        self.head = self.head_patcher.start()
+        self.head.return_value = self.response(etag='"abc"')
+        self.get_patcher = patch('healthcheck.courts_data.requests.get')
+        self.get = self.get_patcher.start()
+
+    def tearDown(self):
+        self.get_patcher.stop()
+        self.head_patcher.stop()
+        self.time_patcher.stop()
+
+    def response(self, etag=None, chunks=()):
+        return Mock(status_code=200, headers={'ETag': etag} if etag else {},
+                    iter_content=Mock(return_value=iter(chunks)))
+
+    def healthcheck(self):
+        response = views.healthcheck(RequestFactory().get('/healthcheck'))
+        return response.status_code, json.loads(response.content)['s3_courts_data']
+
+    def ingest(self, data_hash, minutes_ago=0):
+        status = DataStatus.objects.create(data_hash=data_hash)
+        DataStatus.objects.filter(pk=status.pk).update(
+            last_ingestion_date=timezone.now() - datetime.timedelta(minutes=minutes_ago))
+
+    def test_remote_hash_cached_until_ttl(self):
+        self.assertEqual(courts_data.remote_hash(S3_URL)[0], 'abc')
+        self.now += 59
+        self.head.return_value = self.response(etag='"def"')
+        self.assertEqual(courts_data.remote_hash(S3_URL)[0], 'abc')
+        self.assertEqual(self.head.call_count, 1)
+
+        self.now += 1
+        with patch('healthcheck.courts_data.Thread', ImmediateThread):
+            courts_data.remote_hash(S3_URL)
+        self.assertEqual(self.head.call_count, 2)
+        self.assertEqual(courts_data.remote_hash(S3_URL)[0], 'def')
+
+    def test_refresh_does_not_block_healthcheck(self):
+        self.ingest('abc')
+        self.assertEqual(self.healthcheck()[1]['s3_hash'], 'abc')
+
+        release = threading.Event()
+        refreshed = threading.Event()
+
+        def slow_head(url, timeout):
+            release.wait(5)
+            refreshed.set()
+            return self.response(etag='"def"')
+        self.head.side_effect = slow_head
+        self.now += 60
+
+        status, report = self.healthcheck()
+        self.assertFalse(refreshed.is_set())
+        self.assertEqual((status, report['status'], report['s3_hash']), (200, 'UP', 'abc'))
+        self.assertEqual(report['s3_checked_seconds_ago'], 60)
+        # a refresh is already running, so this doesn't start another
+        self.healthcheck()
+
+        release.set()
+        self.assertTrue(refreshed.wait(5))
+        for i in range(50):
+            if not courts_data._remote['refreshing']:
+                break
+            time.sleep(0.1)
+        self.assertEqual(self.healthcheck()[1]['s3_hash'], 'def')
+        self.assertEqual(self.head.call_count, 2)
+
+    def test_multipart_etag_downloads_and_hashes(self):
+        self.head.return_value = self.response(etag='"0123456789abcdef-3"')
+        self.get.return_value = self.response(chunks=['[{"name": ', '"Accrington"}]'])
+        self.assertEqual(courts_data.remote_hash(S3_URL)[0],
+                         hashlib.md5('[{"name": "Accrington"}]').hexdigest())
+        self.assertTrue(self.get.call_args[1]['stream'])
+
+    def test_multipart_etag_downloaded_once(self):
+        self.head.return_value = self.response(etag='"0123456789abcdef-3"')
+        self.get.return_value = self.response(chunks=['courts'])
+        with patch('healthcheck.courts_data.Thread', ImmediateThread):
+            courts_data.remote_hash(S3_URL)
+            self.now += 60
+            self.get.return_value = self.response(chunks=['new courts'])
+            self.assertEqual(courts_data.remote_hash(S3_URL)[0], hashlib.md5('courts').hexdigest())
+            self.assertEqual((self.head.call_count, self.get.call_count), (2, 1))
+
+            self.head.return_value = self.response(etag='"fedcba9876543210-3"')
+            self.now += 60
+            self.assertEqual(courts_data.remote_hash(S3_URL)[0],
+                             hashlib.md5('new courts').hexdigest())
+            self.assertEqual(self.get.call_count, 2)
+
+    def test_missing_etag_downloads_and_hashes(self):
+        self.head.return_value = self.response()
+        self.get.return_value = self.response(chunks=['courts'])
+        self.assertEqual(courts_data.remote_hash(S3_URL)[0], hashlib.md5('courts').hexdigest())
+
+    def test_remote_error_reported(self):
+        self.head.return_value = Mock(status_code=403, headers={})
+        status, report = self.healthcheck()
+        self.assertEqual((status, report['status']), (503, 'DOWN'))
+        self.assertIn('did not return 200', report['error'])
+
+    def test_current_local_data(self):
+        self.ingest('abc', minutes_ago=60)
+        status, report = self.healthcheck()
+        self.assertEqual((status, report['status'], report['local_hash']), (200, 'UP', 'abc'))
+
+    def test_different_local_data_up_while_recent(self):
+        self.ingest('old', minutes_ago=5)
+        self.assertEqual(self.healthcheck()[1]['status'], 'UP')
+
+    def test_stale_local_data(self):
+        self.ingest('old', minutes_ago=11)
+        status, report = self.healthcheck()
+        self.assertEqual((status, report['status'], report['local_hash']), (503, 'DOWN', 'old'))
+        self.assertIn('older than 10min', report['error'])
+
+    def test_no_local_data(self):
+        status, report = self.healthcheck()
+        self.assertEqual((status, report['error']), (503, 'No courts data has been ingested'))
+
+    def test_local_status_cached(self):
+        self.ingest('old', minutes_ago=60)
+        with self.settings(CATALOGUE_CHECK_INTERVAL=300):
+            self.assertEqual(courts_data.local_status()[0], 'old')
+            self.ingest('abc')
+            self.now += 299
+            self.assertEqual(courts_data.local_status()[0], 'old')
+            self.now += 1
+            self.assertEqual(courts_data.local_status()[0], 'abc')
+
+    def test_local_status_query_does_not_hold_lock(self):
+        self.ingest('abc')
+
+        def query(*args):
+            self.assertTrue(courts_data._lock.acquire(False))
+            courts_data._lock.release()
+            return DataStatus.objects.values_list('data_hash', 'last_ingestion_date')
+        with patch('healthcheck.courts_data.DataStatus.objects.order_by', side_effect=query):
+            self.assertEqual(courts_data.local_status()[0], 'abc')
@@ -0,0 +1,362 @@
+"""
+In-memory snapshot of the courts data.
+
+The courts data only changes when populate-db ingests a new courts.json, so
+each worker keeps the courts and their relations in a CourtCatalogue instead
+of querying them on every request. get_catalogue() checks the latest
+DataStatus at most every CATALOGUE_CHECK_INTERVAL seconds and builds a new
+snapshot when it has changed.
+
+The snapshot is shared by every request in the worker: treat the model
+instances in it as read-only, and copy a Court before setting attributes on it.
+"""
+from collections import defaultdict, OrderedDict
+from itertools import product
+from threading import Lock
+import copy
+import json
+import logging
+import time
+
+import numpy
+
+from django.conf import settings
+from django.db import connections, DatabaseError
+
+from search.models import (Court, AreaOfLaw, CourtAreaOfLaw, CourtAddress,
+                           CourtLocalAuthorityAreaOfLaw, LocalAuthority,
+                           CourtCourtType, CourtContact, CourtEmail,
+                           CourtFacility, CourtOpeningTime, CourtDocument, CourtPostcode,
+                           DataStatus)
+from search import documents
+from search.spatial import SpatialIndex, distances_miles
+from search import textindex
+from search.textindex import TextIndex, BKTree
+from search.prefixtrie import PrefixTrie
+
+
+logger = logging.getLogger('search.error')
+
+
+class CourtCatalogue(object):
+
+    def __init__(self, version, database_name='default'):
+        self.version = version
+
+        self.courts = OrderedDict(
+            (court.id, court)
+            for court in Court.objects.using(database_name).select_related('parking').order_by('name'))
+        self.by_slug = {}
+        for court in self.courts.values():
+            self.by_slug.setdefault(court.slug, court)
+
+        # court positions in radians, NaN where unknown, indexed by position
+        # in self.courts, for ordering any set of courts by distance at once
+        self._by_position = list(self.courts.values())
+        self._positions = dict((court.id, i) for i, court in enumerate(self._by_position))
+        self._lats = numpy.radians(numpy.array(
+            [c.lat if c.lat is not None else numpy.nan for c in self._by_position], dtype=float))
+        self._lons = numpy.radians(numpy.array(
+            [c.lon if c.lon is not None else numpy.nan for c in self._by_position], dtype=float))
+
+        self.areas_of_law = dict(
+            (aol.id, aol) for aol in AreaOfLaw.objects.using(database_name))
+        self.areas_of_law_by_name = dict(
+            (aol.name, aol) for aol in self.areas_of_law.values())
+
+        court_aols = defaultdict(list)
+        spoe = defaultdict(set)
+        for court_id, aol_id, single_point_of_entry in CourtAreaOfLaw.objects.using(database_name).values_list(
+                'court_id', 'area_of_law_id', 'single_point_of_entry'):
+            court_aols[court_id].append(self.areas_of_law[aol_id])
+            if single_point_of_entry:
+                spoe[court_id].add(aol_id)
+        self.court_areas_of_law = dict(
+            (court_id, tuple(sorted(aols, key=lambda aol: aol.name)))
+            for court_id, aols in court_aols.items())
+        self.court_area_of_law_ids = dict(
+            (court_id, frozenset(aol.id for aol in aols))
+            for court_id, aols in self.court_areas_of_law.items())
+        self.spoe_area_of_law_ids = dict(
+            (court_id, frozenset(aol_ids)) for court_id, aol_ids in spoe.items())
+
+        # routing table: for each (local authority id, area of law id), the
+        # courts covering it as (court id, single point of entry) pairs, in
+        # the order they were ingested
+        local_authorities = defaultdict(list)
+        for local_authority_id, name in LocalAuthority.objects.using(database_name) \
+                .order_by('pk').values_list('pk', 'name'):
+            local_authorities[name].append(local_authority_id)
+        self.local_authorities_by_name = dict(
+            (name, tuple(ids)) for name, ids in local_authorities.items())
+        routes = defaultdict(OrderedDict)
+        for court_id, local_authority_id, aol_id in CourtLocalAuthorityAreaOfLaw.objects.using(database_name) \
+                .order_by('pk').values_list('court_id', 'local_authority_id', 'area_of_law_id'):
+            routes[(local_authority_id, aol_id)][court_id] = \
+                aol_id in self.spoe_area_of_law_ids.get(court_id, ())
+        self.routes = dict((key, tuple(courts.items())) for key, courts in routes.items())
+
+        self.addresses = documents.group_by_court(
+            CourtAddress.objects.using(database_name).select_related('address_type', 'town'))
+        self.court_types = documents.group_by_court(
+            CourtCourtType.objects.using(database_name).select_related('court_type'),
+            lambda c: c.court_type.name)
+        self.contacts = documents.group_by_court(
+            CourtContact.objects.using(database_name).select_related('contact'),
+            lambda c: c.contact)
+        self.emails = documents.group_by_court(
+            CourtEmail.objects.using(database_name).select_related('email'),
+            lambda c: c.email)
+        self.facilities = documents.group_by_court(
+            CourtFacility.objects.using(database_name).select_related('facility'),
+            lambda c: c.facility)
+        self.opening_times = documents.group_by_court(
+            CourtOpeningTime.objects.using(database_name).select_related('opening_time'),
+            lambda c: c.opening_time)
+
+        # precomputed court page documents by slug, see search.documents
+        self.documents = dict(
+            (slug, json.loads(document)) for slug, document
+            in CourtDocument.objects.using(database_name)
+                .filter(format_version=documents.FORMAT_VERSION)
+                .values_list('slug', 'document'))
+
+        # spatial indexes of displayed courts, per area of law id
+        # (None for all courts), built when first needed
+        self._spatial = {}
+
+        # inverted indexes for the name and address search: court names by
+        # court id, and addresses, towns and counties by court address id
+        addresses = [address for rows in self.addresses.values() for address in rows]
+        self._address_courts = dict((address.pk, address.court_id) for address in addresses)
+        self._text = {
+            'name': TextIndex((court.id, court.name) for court in self.courts.values()),
+            'address': TextIndex((address.pk, address.address) for address in addresses),
+            'town': TextIndex((address.pk, address.town.name) for address in addresses),
+            'county': TextIndex((address.pk, address.town.county) for address in addresses),
+        }
+        # the postcodes courts cover, by normalised postcode
+        self._postcodes = PrefixTrie(
+            (normalise_postcode(postcode), court_id) for court_id, postcode
+            in CourtPostcode.objects.using(database_name).values_list('court_id', 'postcode'))
+
+        # the words of court and town names, to correct misspelt queries
+        self._vocabulary = BKTree(
+            [word for court in self.courts.values() for word in textindex.words(court.name)] +
+            [word for address in addresses for word in textindex.words(address.town.name)])
+
+    def court(self, court_id):
+        return self.courts.get(court_id)
+
+    def court_by_slug(self, slug):
+        return self.by_slug.get(slug)
+
+    def document(self, slug):
+        """
+        The court's stored page document, or None if it hasn't been built
+        """
+        return self.documents.get(slug)
+
+    def area_of_law(self, name):
+        return self.areas_of_law_by_name.get(name)
+
+    def areas_of_law_for(self, court_id):
+        """
+        The court's areas of law, ordered by name
+        """
+        return self.court_areas_of_law.get(court_id, ())
+
+    def has_area_of_law(self, court_id, area_of_law_id):
+        return area_of_law_id in self.court_area_of_law_ids.get(court_id, ())
+
+    def text_search(self, query):
+        """
+        Courts with every word of the query starting a word of their name,
+        then of a town, an address or a county of theirs, without duplicates.
+        Name matches come with the most areas of law first, and courts are by
+        name otherwise.
+        """
+        def courts(ids):
+            return [court for court in self.courts.values() if court.id in ids]
+
+        def by_address(field):
+            return set(self._address_courts[pk] for pk in self._text[field].search(query))
+
+        name_results = sorted(courts(self._text['name'].search(query)),
+                              key=lambda c: -len(self.areas_of_law_for(c.id)))
+        results = OrderedDict((court.id, court) for court in name_results)
+        for field in ('town', 'address', 'county'):
+            for court in courts(by_address(field)):
+                results.setdefault(court.id, court)
+        return list(results.values())
+
+    def fuzzy_search(self, query, candidates=3, max_corrected_words=3, max_queries=10):
+        """
+        text_search() for the query with misspelt words corrected to court
+        and town name words a few edits away, trying up to `candidates`
+        corrections per word. Corrected queries are tried fewest edits
+        first, up to `max_queries` of them, and the first to find courts
+        wins. Queries with more than `max_corrected_words` unknown words
+        aren't corrected at all.
+        """
+        corrections = []
+        corrected_words = 0
+        for word in OrderedDict.fromkeys(textindex.words(query)):
+            if any(index.prefixed(word) for index in self._text.values()):
+                corrections.append([(0, word)])
+                continue
+            corrected_words += 1
+            if corrected_words > max_corrected_words:
+                return []
+            found = self._vocabulary.search(word, textindex.max_edit_distance(word))[:candidates]
+            if not found:
+                return []
+            corrections.append(found)
+        if not corrected_words:
+            return []
+
+        queries = sorted((sum(distance for distance, word in combination),
+                          ' '.join(word for distance, word in combination))
+                         for combination in product(*corrections))
+        for edits, corrected in queries[:max_queries]:
+            results = self.text_search(corrected)
+            if results:
+                return results
+        return []
+
+    def local_authority_ids(self, name):
+        return self.local_authorities_by_name.get(name, ())
+
+    def local_authority(self, name):
+        """
+        The local authority with the name, the first ingested where several
+        have it, or None
+        """
+        ids = self.local_authority_ids(name)
+        return LocalAuthority(id=ids[0], name=name) if ids else None
+
+    def routed_courts(self, local_authority_ids, area_of_law_id, single_point_of_entry=False):
+        """
+        The courts covering any of the local authorities for the area of
+        law, without duplicates, optionally only single points of entry
+        """
+        results = OrderedDict()
+        for local_authority_id in local_authority_ids:
+            for court_id, spoe in self.routes.get((local_authority_id, area_of_law_id), ()):
+                if (spoe or not single_point_of_entry) and court_id in self.courts:
+                    results.setdefault(court_id, self.courts[court_id])
+        return list(results.values())
+
+    def courts_covering(self, postcode, area_of_law_id):
+        """
+        Courts dealing with the area of law that cover any start of the
+        postcode, in primary key order
+        """
+        court_ids = self._postcodes.prefixes_of(normalise_postcode(postcode))
+        return [self.courts[court_id] for court_id in sorted(court_ids)
+                if court_id in self.courts and self.has_area_of_law(court_id, area_of_law_id)]
+
+    def _spatial_index(self, area_of_law_id):
+        if area_of_law_id not in self._spatial:
+            courts = [c for c in self.courts.values() if c.displayed and
+                      (area_of_law_id is None or self.has_area_of_law(c.id, area_of_law_id))]
+            unlocated = [c for c in courts if c.lat is None or c.lon is None]
+            self._spatial[area_of_law_id] = (SpatialIndex(courts), unlocated)
+        return self._spatial[area_of_law_id]
+
+    def nearest(self, lat, lon, area_of_law_id=None, k=10):
+        """
+        The k displayed courts nearest to a point, optionally only those
+        dealing with an area of law, as copies carrying their distance.
+        Courts without a position come last, by name, as they did when
+        PostgreSQL sorted their NULL distances last.
+        """
+        index, unlocated = self._spatial_index(area_of_law_id)
+        results = [with_distance(court, miles) for miles, court in index.nearest(lat, lon, k)]
+        results.extend(with_distance(court, None) for court in unlocated[:k - len(results)])
+        return results
+
+    def order_by_distance(self, lat, lon, courts):
+        """
+        The given courts, without duplicates, ordered by distance from a
+        point, as copies carrying their distance. Courts without a position
+        come last. Courts not in the catalogue are dropped.
+        """
+        positions = []
+        seen = set()
+        for court in courts:
+            position = self._positions.get(court.id)
+            if position is not None and position not in seen:
+                seen.add(position)
+                positions.append(position)
+        if not positions:
+            return []
+
+        positions = numpy.array(positions)
+        distances = distances_miles(lat, lon, self._lats[positions], self._lons[positions])
+        # NaN sorts last, and mergesort keeps equally distant courts in the given order
+        order = numpy.argsort(distances, kind='mergesort')
+        return [with_distance(self._by_position[positions[i]],
+                              None if numpy.isnan(distances[i]) else float(distances[i]))
+                for i in order]
+
+
+def normalise_postcode(postcode):
+    return postcode.lower().replace(' ', '')
+
+
+def with_distance(court, distance):
+    """
+    A copy of a catalogue court with its distance from the search location
+    """
+    court = copy.copy(court)
+    court.distance = distance
+    return court
+
+
+_state = {'catalogue': None, 'checked_at': 0}
+_lock = Lock()
+
+
+def current_version(database_name='default'):
+    """
+    Identifies the data currently in the database: the latest DataStatus
+    primary key and hash, which change with every ingest
+    """
+    return DataStatus.objects.using(database_name).order_by('-last_ingestion_date', '-pk') \
+        .values_list('pk', 'data_hash').first()
+
+
+def get_catalogue():
+    with _lock:
+        catalogue = _state['catalogue']
+        now = time.time()
+        if catalogue is None or now - _state['checked_at'] >= settings.CATALOGUE_CHECK_INTERVAL:
+            version = current_version()
+            _state['checked_at'] = now
+            if catalogue is None or catalogue.version != version:
+                catalogue = _state['catalogue'] = CourtCatalogue(version)
+        return catalogue
+
+
+def invalidate():
+    """
+    Drop the snapshot so the next get_catalogue() builds a new one
+    """
+    with _lock:
+        _state['catalogue'] = None
+
+
+def warm_up():
+    """
+    Build the catalogue before the application server forks its workers,
+    so they start with it, then close the connection used to build it:
+    database connections must not be shared with the forked workers.
+    """
+    try:
+        get_catalogue()
+    except DatabaseError as e:
+        logger.error('Could not preload the court catalogue: %s' % e)
+    finally:
+        for connection in connections.all():
+            connection.close()
@@ -4,16 +4,16 @@ import json
 import logging
 import re
 
-import requests
-
 from django.conf import settings
+from django.db.models import Q
+from django.utils.module_loading import import_string
 
-from search.models import Court, AreaOfLaw, CourtAreaOfLaw, CourtAddress, LocalAuthority, CourtLocalAuthorityAreaOfLaw, CourtPostcode
+from search.models import Court, AreaOfLaw, CourtAddress
 from search.rules import Rules
+from search import mapit, postcode_cache
+from search.catalogue import get_catalogue
 
 
-MAPIT_HEADERS = {'X-Api-Key': settings.MAPTI_API_KEY if settings.MAPTI_API_KEY else ''}
-
 loggers = {
     'error': logging.getLogger('search.error'),
     'mapit': logging.getLogger('search.mapit'),
@@ -38,6 +38,25 @@ class CourtSearchClientError(Exception):
 class CourtSearchInvalidPostcode(CourtSearchError):
     pass
 
+
+_lookup_backend = {}
+
+def lookup_backend():
+    """
+    The offline postcode lookup backend named in settings.POSTCODE_LOOKUP_BACKEND,
+    created once per worker. None if there isn't one or it can't be loaded,
+    in which case every lookup goes to MapIt.
+    """
+    if 'backend' not in _lookup_backend:
+        backend = None
+        if settings.POSTCODE_LOOKUP_BACKEND:
+            try:
+                backend = import_string(settings.POSTCODE_LOOKUP_BACKEND)()
+            except (ImportError, IOError, ValueError) as e:
+                loggers['error'].error('Postcode lookup backend unavailable: %s' % e)
+        _lookup_backend['backend'] = backend
+    return _lookup_backend['backend']
+
 class CourtSearch:
 
     def __init__( self, postcode=None, area_of_law=None, single_point_of_entry=False, query=None, courtcode_search=False ):
@@ -45,15 +64,15 @@ class CourtSearch:
         if query:
             self.query = query
         elif postcode:
-            self.postcode = Postcode(postcode)
-            try:
-                if area_of_law.lower() != 'all':
-                    self.area_of_law = AreaOfLaw.objects.get(name=area_of_law)
-                else:
-                    self.area_of_law = AreaOfLaw(name=area_of_law)
-            except AreaOfLaw.DoesNotExist:
-                loggers['aol'].error(area_of_law)
-                raise CourtSearchClientError('bad area of law')
+            # a Postcode already looked up, as the batch search shares them
+            self.postcode = postcode if isinstance(postcode, Postcode) else Postcode(postcode)
+            if area_of_law.lower() != 'all':
+                self.area_of_law = get_catalogue().area_of_law(area_of_law)
+                if self.area_of_law is None:
+                    loggers['aol'].error(area_of_law)
+                    raise CourtSearchClientError('bad area of law')
+            else:
+                self.area_of_law = AreaOfLaw(name=area_of_law)
 
             self.single_point_of_entry = single_point_of_entry
         else:
@@ -80,8 +99,10 @@ class CourtSearch:
                 if self.area_of_law.name == 'Money claims':
                     return Court.objects.filter(name__icontains='CCMCC')
                 elif self.area_of_law.name in Rules.has_spoe:
-                    results = [c.court for c in CourtLocalAuthorityAreaOfLaw.objects.filter(area_of_law=self.area_of_law, local_authority=self.postcode.local_authority)]
-                    results = [c.court for c in CourtAreaOfLaw.objects.filter(area_of_law=self.area_of_law, single_point_of_entry=True) if c.court in results]
+                    local_authority = self.postcode.local_authority
+                    results = get_catalogue().routed_courts(
+                        [local_authority.id] if local_authority is not None else [],
+                        self.area_of_law.id, single_point_of_entry=True)
 
                     if len(results) > 0:
                         loggers['method'].debug('Postcode: %-10s LA: %-30s AOL: %-20s Method: SPOE' % (self.postcode.postcode, self.postcode.local_authority, self.area_of_law))
@@ -108,59 +129,29 @@ class CourtSearch:
         if self.postcode.local_authority is None or self.area_of_law is None:
             return []
 
-        covered = CourtLocalAuthorityAreaOfLaw.objects.filter(
-            area_of_law=self.area_of_law,
-            local_authority__name=self.postcode.local_authority)
+        catalogue = get_catalogue()
+        # every local authority with the name, as the name is what MapIt gives
+        covered = catalogue.routed_courts(
+            catalogue.local_authority_ids(self.postcode.local_authority.name),
+            self.area_of_law.id)
 
-        return self.__order_by_distance([c.court for c in covered])
+        return self.__order_by_distance(covered)
 
 
     def __order_by_distance( self, courts ):
-        if len(courts) == 0:
-            return courts
-
-        lat = self.postcode.latitude
-        lon = self.postcode.longitude
-
-        court_ids = "(%s)" % ", ".join([str(c.id) for c in courts])
-
-        results = Court.objects.raw("""
-                SELECT *,
-                       (point(c.lon, c.lat) <@> point(%s, %s)) as distance
-                  FROM search_court as c
-                 WHERE id in %s
-                 ORDER BY distance
-        """ % (lon, lat, court_ids))
-
-        return [r for r in results]
+        return get_catalogue().order_by_distance(self.postcode.latitude,
+                                                 self.postcode.longitude,
+                                                 courts)
 
 
     def __postcode_search( self, area_of_law ):
-        p = self.postcode.postcode.lower().replace(' ', '')
-        results = CourtPostcode.objects \
-                .filter(court__areas_of_law=area_of_law) \
-                .extra(where=["%s LIKE lower(postcode) || '%%'"], params=[p]) \
-                .distinct('court')
-
-        return [c.court for c in results]
+        return get_catalogue().courts_covering(self.postcode.postcode, area_of_law.id)
 
 
     def __proximity_search( self ):
-        lat = self.postcode.latitude
-        lon = self.postcode.longitude
-
-        results = Court.objects.raw("""
-            SELECT *,
-                   (point(c.lon, c.lat) <@> point(%s, %s)) as distance
-              FROM search_court as c
-              WHERE c.displayed
-             ORDER BY distance, "name"
-        """, [lon, lat])
-
-        if self.area_of_law.name != 'All':
-            return [r for r in results if self.area_of_law in r.areas_of_law.all()][:10]
-        else:
-            return [r for r in results][:10]
+        area_of_law_id = self.area_of_law.id if self.area_of_law.name != 'All' else None
+        return get_catalogue().nearest(self.postcode.latitude, self.postcode.longitude,
+                                       area_of_law_id, 10)
 
 
     def __address_search( self, query ):
@@ -168,25 +159,46 @@ class CourtSearch:
         Retrieve name and address search results, order and remove duplicates
         """
 
+        if settings.FEATURE_INVERTED_INDEX_ENABLED:
+            results = get_catalogue().text_search(query)
+        else:
+            results = self.__database_address_search(query)
+        # nothing matched, so try correcting typos
+        return results or get_catalogue().fuzzy_search(query)
+
+    def __database_address_search( self, query ):
         # First we get courts whose name contains the query string
         # (for these courts sorted to show the courts with the highest number of areas of law first)
 
         word_separator = re.compile(r'[^\w]+', re.UNICODE)
-        query_regex = ''.join(map(lambda word: "(?=.*\y"+word+"\y)", re.split(word_separator, query)))
+        words = re.split(word_separator, query)
+        query_regex = ''.join(map(lambda word: "(?=.*\y"+word+"\y)", words))
 
-        name_results =  sorted(Court.objects.filter(name__iregex=query_regex), key=lambda c: -len(c.areas_of_law.all()))
+        catalogue = get_catalogue()
+        name_results =  sorted(self.__text_search('name', query_regex, words), key=lambda c: -len(catalogue.areas_of_law_for(c.id)))
         # then we get courts with the query string in their address
-        address_results = Court.objects.filter(courtaddress__address__iregex=query_regex)
+        address_results = self.__text_search('courtaddress__address', query_regex, words)
         # then in the town name
-        town_results = Court.objects.filter(courtaddress__town__name__iregex=query_regex)
+        town_results = self.__text_search('courtaddress__town__name', query_regex, words)
         # then the county name
-        county_results = Court.objects.filter(courtaddress__town__county__iregex=query_regex)
+        county_results = self.__text_search('courtaddress__town__county', query_regex, words)
 
         # put it all together and remove duplicates
         results = list(OrderedDict.fromkeys(chain(name_results, town_results, address_results, county_results)))
 
         return [result for result in results]
 
+    def __text_search( self, field, query_regex, words ):
+        """
+        Courts whose field matches every word of the query. Postgres can't
+        use an index for the regex's lookaheads, so each word is also matched
+        with icontains, which the trigram indexes on these fields can answer,
+        leaving the regex to check word boundaries on the few rows that pass.
+        """
+        contains = [Q(**{field + '__icontains': word}) for word in words if word]
+        # one filter() call, so the conditions apply to the same address
+        return Court.objects.filter(Q(**{field + '__iregex': query_regex}), *contains).order_by('name')
+
     def __court_number_search( self, query ):
         """
         Retrieve court(s) by court code, order and remove duplicates
@@ -207,15 +219,24 @@ class CourtSearch:
 
 class Postcode():
 
-    def __init__( self, postcode ):
+    def __init__( self, postcode, catalogue=None ):
+        """
+        catalogue: the court catalogue to find the local authority in, so
+        threads looking postcodes up don't need a database connection
+        """
         self.postcode = re.sub(r'[^A-Za-z0-9 ]','', postcode)
 
         self.full_postcode = self.is_full_postcode( postcode )
         self.partial_postcode = not self.full_postcode
-        self.lookup_postcode()
+        self.lookup_postcode( catalogue )
 
-    def lookup_postcode( self ):
-        response = self.mapit( self.postcode )
+    def lookup_postcode( self, catalogue=None ):
+        response = self.local_lookup( self.postcode )
+        if response is None:
+            try:
+                response = self.mapit( self.postcode )
+            except mapit.MapItUnavailable as e:
+                response = self.degraded_lookup( self.postcode, e )
 
         if 'wgs84_lat' in response:
             self.latitude = response['wgs84_lat']
@@ -231,22 +252,43 @@ class Postcode():
 
             local_authority_name = response['areas'][council_id]['name']
 
-            try:
-                self.local_authority = LocalAuthority.objects.get(name=local_authority_name)
-            except LocalAuthority.DoesNotExist:
+            self.local_authority = (catalogue or get_catalogue()).local_authority(local_authority_name)
+            if self.local_authority is None:
                 loggers['la'].error(local_authority_name)
-                self.local_authority = None
 
         else:
             self.local_authority = None
 
+    def local_lookup( self, postcode ):
+        backend = lookup_backend()
+        if backend is None:
+            return None
+        return backend.lookup(postcode, self.full_postcode)
+
     def mapit( self, postcode ):
+        cached = postcode_cache.get(postcode, self.full_postcode)
+        if cached is not None:
+            found, value = cached
+            if found:
+                return value
+            raise CourtSearchInvalidPostcode(value)
+
+        try:
+            response = self.mapit_request(postcode)
+        except CourtSearchInvalidPostcode as e:
+            postcode_cache.set_unknown(postcode, self.full_postcode, e.value)
+            raise
+
+        postcode_cache.set_found(postcode, self.full_postcode, response)
+        return response
+
+    def mapit_request( self, postcode ):
         if self.full_postcode:
             mapit_url = settings.MAPIT_BASE_URL + postcode
         else:
             mapit_url = settings.MAPIT_BASE_URL + 'partial/' + postcode
 
-        r = self._debug = requests.get(mapit_url, headers=MAPIT_HEADERS)
+        r = self._debug = mapit.get(mapit_url)
 
         if r.status_code == 200:
             try:
@@ -263,6 +305,29 @@ class Postcode():
             loggers['mapit'].error("%d - %s - %s" % (r.status_code, postcode, r.text))
             raise CourtSearchError('MapIt service error: ' + str(r.status_code))
 
+    def degraded_lookup( self, postcode, error ):
+        """
+        MapIt is unavailable. A full postcode falls back to its outward code
+        from the offline backend or the cache, which is enough for a proximity
+        search; anything else fails straight away.
+        """
+        loggers['mapit'].error(str(error))
+
+        if self.full_postcode:
+            outcode = re.sub(r'\s', '', postcode)[:-3]
+            backend = lookup_backend()
+            response = backend.lookup(outcode, False) if backend else None
+            if response is None:
+                cached = postcode_cache.get(outcode, False)
+                if cached is not None and cached[0]:
+                    response = cached[1]
+            if response is not None:
+                self.full_postcode = False
+                self.partial_postcode = True
+                return response
+
+        raise CourtSearchError('MapIt unavailable: %s' % error)
+
     def is_full_postcode( self, postcode ):
         # Regex from: https://gist.github.com/simonwhitaker/5748515
         return bool(re.match(r'[A-Z]{1,2}[0-9][0-9A-Z]?\s?[0-9][A-Z]{2}', postcode.upper().replace(' ', '')))
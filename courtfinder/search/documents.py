@@ -0,0 +1,242 @@
+"""
+Precomputed court documents.
+
+Everything the court page and its leaflets show about a court, denormalised
+into one JSON document per court and stored in CourtDocument, keyed by slug.
+Documents are built at the end of each ingest and kept between ingests: a
+court's document is only rebuilt when the court's content hash (or, for
+courts ingested without one, its updated_at) has changed, or when
+FORMAT_VERSION says the layout of the documents has.
+
+Documents are built BATCH_SIZE courts at a time, each batch loading only
+its own courts' relations, so building them takes the same memory however
+many courts there are.
+"""
+from collections import defaultdict, OrderedDict
+import json
+
+from search.models import (Court, CourtAddress, CourtAreaOfLaw, CourtContact,
+                           CourtCourtType, CourtDocument, CourtEmail,
+                           CourtFacility, CourtOpeningTime)
+
+
+# bump when the document layout changes so every document is rebuilt
+FORMAT_VERSION = 2
+
+# how many courts' documents are built at once
+BATCH_SIZE = 500
+
+
+def group_by_court(queryset, value=lambda row: row):
+    """
+    Tuples of value(row) per court id, in primary key order
+    """
+    grouped = defaultdict(list)
+    for row in queryset.order_by('pk'):
+        grouped[row.court_id].append(value(row))
+    return dict((court_id, tuple(rows)) for court_id, rows in grouped.items())
+
+
+class CourtRelations(object):
+    """
+    The relations court_document() reads from the catalogue, loaded for a
+    few courts only
+    """
+
+    def __init__(self, court_ids, database_name="default"):
+        def rows(model, *related):
+            return model.objects.using(database_name).filter(court_id__in=court_ids) \
+                .select_related(*related)
+
+        court_aols = group_by_court(rows(CourtAreaOfLaw, 'area_of_law'), lambda c: c.area_of_law)
+        self.court_areas_of_law = dict(
+            (court_id, tuple(sorted(aols, key=lambda aol: aol.name)))
+            for court_id, aols in court_aols.items())
+        self.addresses = group_by_court(rows(CourtAddress, 'address_type', 'town'))
+        self.court_types = group_by_court(rows(CourtCourtType, 'court_type'),
+                                          lambda c: c.court_type.name)
+        self.contacts = group_by_court(rows(CourtContact, 'contact'), lambda c: c.contact)
+        self.emails = group_by_court(rows(CourtEmail, 'email'), lambda c: c.email)
+        self.facilities = group_by_court(rows(CourtFacility, 'facility'), lambda c: c.facility)
+        self.opening_times = group_by_court(rows(CourtOpeningTime, 'opening_time'),
+                                            lambda c: c.opening_time)
+
+    def areas_of_law_for(self, court_id):
+        return self.court_areas_of_law.get(court_id, ())
+
+
+def collapse(source, key, key2):
+    """
+    Groups objects's key2 by similar key1:
+
+    [{'foo': [1]}, {'bar':[2]}, {'bar':[3]}] => [{'foo': [1], {'bar': [2,3]}}]
+    [{'bailiff': [0800383727]}, {'bailiff':[018746]}, {'enquiries':[012874]}] =>
+      [{'bailiff': [0800383727, 018746]}, {'enquiries': [012874]}}]
+    """
+    result=[]
+    for item in source:
+        if len(result) > 0 and item[key] == result[-1][key]:
+            result[-1][key2].append(item[key2][0])
+        else:
+            result.append(item)
+    return result
+
+
+def court_document(court, catalogue):
+    """
+    The court as the templates see it, built from the relations of a
+    catalogue or CourtRelations and made only of JSON types. Nothing in it
+    depends on settings, as stored documents outlive them.
+    """
+    addresses = sorted(catalogue.addresses.get(court.id, ()),
+                       key=lambda a: a.address_type.name)
+    postal_address = None
+    visiting_address = None
+    for address in addresses:
+        address_obj = {
+            'address_lines': [line for line in address.address.split('\n') if line != ''],
+            'postcode':address.postcode,
+            'town':address.town.name,
+            'county': address.town.county,
+            'type': {'name': address.address_type.name},
+        }
+        if address.address_type.name in ('Postal', 'Postal and Visiting'):
+            postal_address = address_obj
+        else:
+            visiting_address = address_obj
+
+    if postal_address and postal_address['type']['name'] == 'Postal and Visiting':
+        visiting_address = None
+
+    emails = [{'description':email.description, 'addresses': [email.address]}
+              for email in catalogue.emails.get(court.id, ())]
+    emails.sort(key=lambda x: x['description'])
+    contacts = [{'name':contact.name, 'numbers': [contact.number], 'explanation': contact.explanation, 'in_leaflet': contact.in_leaflet}
+                for contact in sorted(catalogue.contacts.get(court.id, ()), key=lambda c: c.sort_order)]
+
+    facilities = [
+        {
+            # Name is used for the css class name to set the x,y offsets on old style images
+            'name': facility.name,
+            # Description is used for the display text
+            'description': facility.description,
+            # Image class is the generated class name (empty for new style images)
+            'image_class': "" if facility.image_file_path else 'icon-' + facility.image,
+            # The relative path to the image
+            'image_src': facility.image_file_path if facility.image_file_path else 'images/facility_icons.png',
+            # This description is used for the alt text
+            'image_description': facility.image_description,
+            # The relative file path of the image
+            'image_file_path': facility.image_file_path
+        }
+        for facility in catalogue.facilities.get(court.id, ())
+    ]
+
+    opening_times = sorted(catalogue.opening_times.get(court.id, ()), key=lambda o: o.description)
+    areas_of_law = [
+        {
+            'name': aol.name,
+            'external_link': aol.external_link,
+            'external_link_desc': aol.external_link_desc,
+            'display_url': aol.display_url() if aol.external_link else None,
+        }
+        for aol in catalogue.areas_of_law_for(court.id)
+    ]
+    parking = None
+    if court.parking:
+        parking = {'onsite': court.parking.onsite,
+                   'offsite': court.parking.offsite,
+                   'blue_badge': court.parking.blue_badge}
+
+    document = { 'name': court.name,
+                 'displayed': court.displayed,
+                 'lat': court.lat,
+                 'lon': court.lon,
+                 'number': court.number,
+                 'cci_code': court.cci_code,
+                 'updated_at': court.updated_at.strftime("%d %B %Y") if court.updated_at else '',
+                 'slug': court.slug,
+                 'image_file': court.image_file,
+                 'types': list(catalogue.court_types.get(court.id, ())),
+                 'postal_address': postal_address,
+                 'visiting_address': visiting_address,
+                 'opening_times': [{'description': o.description} for o in opening_times],
+                 'areas_of_law': areas_of_law,
+                 'facilities': sorted(facilities, key=lambda x: x['name']),
+                 'emails': collapse(emails, 'description', 'addresses'),
+                 'contacts': collapse(contacts, 'name', 'numbers'),
+                 'directions': court.directions if court.directions else None,
+                 'alert': court.alert if court.alert and court.alert.strip() != '' else None,
+                 'parking': parking,
+                 'info': court.info,
+                 'hide_aols': court.hide_aols,
+                 'info_leaflet': court.info_leaflet,
+                 'juror_leaflet': court.juror_leaflet,
+                 'defence_leaflet': court.defence_leaflet,
+                 'prosecution_leaflet': court.prosecution_leaflet}
+
+    dx_contacts = [c for c in catalogue.contacts.get(court.id, ()) if c.name == 'DX']
+    if dx_contacts:
+        document['dx_number'] = min(dx_contacts, key=lambda c: c.pk).number
+
+    return document
+
+
+def needs_building(court, stored):
+    """
+    Whether the court's document has to be built, given its stored
+    (pk, updated_at, content_hash, format_version) or None
+    """
+    if stored is None or stored[3] != FORMAT_VERSION:
+        return True
+    if court.content_hash is not None:
+        return stored[2] != court.content_hash
+    return court.updated_at is None or stored[1] != court.updated_at
+
+
+def build(database_name="default", batch_size=BATCH_SIZE):
+    """
+    Bring the stored documents up to date with the courts in the database,
+    skipping courts that haven't changed, and drop the documents of courts
+    that have gone. Where courts share a slug, the document is the first's
+    by name, as in the catalogue. Returns how many documents were written.
+    """
+    documents = CourtDocument.objects.using(database_name)
+    courts = Court.objects.using(database_name).select_related('parking').order_by('slug', 'name')
+
+    written = 0
+    last_slug = None
+    while True:
+        page = courts.filter(slug__gt=last_slug) if last_slug is not None else courts
+        page = list(page[:batch_size])
+        if not page:
+            break
+        # the rest of a slug cut off by the page are skipped by the next one
+        last_slug = page[-1].slug
+        by_slug = OrderedDict()
+        for court in page:
+            by_slug.setdefault(court.slug, court)
+
+        stored = dict((slug, (pk, updated_at, content_hash, format_version))
+                      for pk, slug, updated_at, content_hash, format_version
+                      in documents.filter(slug__in=list(by_slug)).values_list(
+                          'pk', 'slug', 'updated_at', 'content_hash', 'format_version'))
+        changed = [court for slug, court in by_slug.items()
+                   if needs_building(court, stored.get(slug))]
+        if not changed:
+            continue
+
+        relations = CourtRelations([court.id for court in changed], database_name)
+        for court in changed:
+            fields = {'updated_at': court.updated_at,
+                      'content_hash': court.content_hash,
+                      'format_version': FORMAT_VERSION,
+                      'document': json.dumps(court_document(court, relations))}
+            if court.slug in stored:
+                documents.filter(pk=stored[court.slug][0]).update(**fields)
+            else:
+                documents.create(slug=court.slug, **fields)
+            written += 1
+
+    documents.exclude(slug__in=Court.objects.using(database_name).values('slug')).delete()
+    return written
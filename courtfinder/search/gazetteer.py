@@ -0,0 +1,197 @@
+"""
+Offline postcode gazetteer.
+
+The gazetteer is a compact binary file built by the ``build-gazetteer``
+management command from an ONS Postcode Directory (or Code-Point style) CSV.
+It holds one fixed-width record per postcode, sorted by postcode, followed by
+a table of local authority names:
+
+    header:  magic (8 bytes), record count, authority count
+    records: postcode in ONS 7-character form, latitude, longitude,
+             index into the authority table
+    names:   newline separated UTF-8 local authority names
+
+The file is memory-mapped, so every uWSGI worker shares the same pages and a
+lookup is a binary search over the records.
+"""
+import mmap
+import os
+import re
+import struct
+
+from django.conf import settings
+
+
+MAGIC = b'CFGAZ001'
+HEADER = struct.Struct('<8sII')
+RECORD = struct.Struct('<7sffH')
+KEY_LENGTH = 7
+NO_AUTHORITY = 0xFFFF
+
+
+def normalise(postcode):
+    """
+    Turn a full postcode into the ONS 7-character form, where the outward
+    code is padded to four characters: 'SE15 4UH' -> 'SE154UH',
+    'N1 9GU' -> 'N1  9GU'. Returns None for anything that is not a postcode.
+    """
+    p = re.sub(r'[^A-Z0-9]', '', postcode.upper())
+    if not 5 <= len(p) <= 7:
+        return None
+    return p[:-3].ljust(4) + p[-3:]
+
+
+def normalise_partial(postcode):
+    """
+    Turn an outward code or a postcode sector into the prefix its postcodes
+    share in the ONS 7-character form: 'SE15' -> 'SE15', 'N1 9' -> 'N1  9'.
+    """
+    parts = postcode.upper().split()
+    if not parts or len(parts) > 2 or len(parts[0]) > 4:
+        return None
+    prefix = parts[0].ljust(4)
+    if len(parts) == 2:
+        prefix += parts[1]
+    return prefix
+
+
+class Gazetteer(object):
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, authority_count = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC:
+            raise ValueError('%s is not a postcode gazetteer' % path)
+        names_start = HEADER.size + self.count * RECORD.size
+        names = self._map[names_start:].decode('utf-8')
+        self.authorities = names.split('\n')[:authority_count]
+
+    def _key(self, i):
+        offset = HEADER.size + i * RECORD.size
+        return self._map[offset:offset + KEY_LENGTH]
+
+    def _record(self, i):
+        return RECORD.unpack_from(self._map, HEADER.size + i * RECORD.size)
+
+    def _bisect(self, key):
+        """
+        Index of the first record whose postcode is not less than key
+        """
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, postcode):
+        """
+        Returns (latitude, longitude, local authority name) for a full
+        postcode, or None if the postcode is not in the gazetteer
+        """
+        key = normalise(postcode)
+        if key is None:
+            return None
+        key = key.encode('ascii')
+        i = self._bisect(key)
+        if i == self.count or self._key(i) != key:
+            return None
+        _, lat, lon, authority = self._record(i)
+        name = self.authorities[authority] if authority != NO_AUTHORITY else None
+        return lat, lon, name
+
+    def find_partial(self, postcode):
+        """
+        Returns the (latitude, longitude) centroid of all postcodes in an
+        outward code or sector, or None if there are none
+        """
+        prefix = normalise_partial(postcode)
+        if prefix is None:
+            return None
+        prefix = prefix.encode('ascii')
+        start = self._bisect(prefix)
+        # keys are ASCII, so every key with this prefix sorts below prefix + '~'
+        end = self._bisect(prefix + b'~')
+        if start == end:
+            return None
+        lat_total = lon_total = 0.0
+        for i in range(start, end):
+            _, lat, lon, _ = self._record(i)
+            lat_total += lat
+            lon_total += lon
+        return lat_total / (end - start), lon_total / (end - start)
+
+    def close(self):
+        self._map.close()
+
+
+def write(path, records):
+    """
+    Write a gazetteer file from an iterable of
+    (postcode, latitude, longitude, local authority name) tuples.
+    The file is written next to its destination and renamed into place so
+    running workers never see a partial file.
+    """
+    authorities = {}
+    rows = []
+    for postcode, lat, lon, authority in records:
+        key = normalise(postcode)
+        if key is None:
+            continue
+        if authority:
+            index = authorities.setdefault(authority, len(authorities))
+        else:
+            index = NO_AUTHORITY
+        rows.append((key.encode('ascii'), float(lat), float(lon), index))
+
+    if len(authorities) >= NO_AUTHORITY:
+        raise ValueError('Too many local authorities for the gazetteer format')
+
+    rows.sort()
+    names = sorted(authorities, key=authorities.get)
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(rows), len(names)))
+        for row in rows:
+            f.write(RECORD.pack(*row))
+        f.write('\n'.join(names).encode('utf-8'))
+    os.rename(tmp_path, path)
+    return len(rows)
+
+
+class GazetteerBackend(object):
+    """
+    Postcode lookup backend answering from the offline gazetteer. Responses
+    are shaped like the MapIt ones so Postcode can treat both the same way;
+    None means the postcode is not in the gazetteer.
+    """
+
+    def __init__(self, path=None):
+        self.gazetteer = Gazetteer(path or settings.POSTCODE_GAZETTEER_PATH)
+
+    def lookup(self, postcode, full_postcode):
+        if full_postcode:
+            found = self.gazetteer.find(postcode)
+            # without a local authority the postcode is no use for
+            # local authority searches, so let MapIt answer instead
+            if found is None or found[2] is None:
+                return None
+            lat, lon, authority = found
+            return {
+                'postcode': postcode,
+                'wgs84_lat': lat,
+                'wgs84_lon': lon,
+                'shortcuts': {'council': 'gazetteer'},
+                'areas': {'gazetteer': {'name': authority}},
+            }
+        else:
+            found = self.gazetteer.find_partial(postcode)
+            if found is None:
+                return None
+            lat, lon = found
+            return {'postcode': postcode, 'wgs84_lat': lat, 'wgs84_lon': lon}
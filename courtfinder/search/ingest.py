@@ -1,13 +1,365 @@
-from django.db import IntegrityError
-from django.utils.text import slugify
+from collections import defaultdict, deque, namedtuple, OrderedDict
+from multiprocessing import Pool
+import hashlib
+import json
+
+from django.db import connections, transaction
 
 from search.models import *
+from search import catalogue, documents
 
 from dateutil import parser
 
+
+# Lookup entities shared between courts, with the fields that identify them.
+# They are deduplicated in memory, as get_or_create on these fields did.
+LOOKUP_FIELDS = OrderedDict([
+    (AreaOfLaw, ('name', 'external_link', 'external_link_desc')),
+    (LocalAuthority, ('name',)),
+    (Facility, ('name', 'description', 'image', 'image_description', 'image_file_path')),
+    (OpeningTime, ('description',)),
+    (Email, ('description', 'address')),
+    (CourtType, ('name',)),
+    (AddressType, ('name',)),
+    (Town, ('name', 'county')),
+    (Contact, ('name', 'number', 'sort_order', 'explanation', 'in_leaflet')),
+])
+
+# Rows belonging to a court, in the order they are inserted
+CHILD_MODELS = (CourtAreaOfLaw, CourtLocalAuthorityAreaOfLaw, CourtFacility,
+                CourtOpeningTime, CourtEmail, CourtCourtType, CourtAddress,
+                CourtContact, CourtPostcode)
+
+# Where lookup entities are referenced from, to find the ones no court uses
+LOOKUP_REFERENCES = {
+    AreaOfLaw: ((CourtAreaOfLaw, 'area_of_law'), (CourtLocalAuthorityAreaOfLaw, 'area_of_law')),
+    LocalAuthority: ((CourtLocalAuthorityAreaOfLaw, 'local_authority'),),
+    Facility: ((CourtFacility, 'facility'),),
+    OpeningTime: ((CourtOpeningTime, 'opening_time'),),
+    Email: ((CourtEmail, 'email'),),
+    CourtType: ((CourtCourtType, 'court_type'),),
+    AddressType: ((CourtAddress, 'address_type'),),
+    Town: ((CourtAddress, 'town'),),
+    Contact: ((CourtContact, 'contact'),),
+}
+
+# How many courts are queued before they are written
+BATCH_SIZE = 500
+
+
+Ref = namedtuple('Ref', 'model key')
+
+
+def content_hash(court_obj):
+    """
+    Hash of a court's entry in courts.json, independent of key order
+    """
+    return hashlib.sha1(json.dumps(court_obj, sort_keys=True)).hexdigest()
+
+
+def court_identity(admin_id, slug):
+    """
+    What identifies a court between ingests. Admin ids aren't unique in
+    courts.json, so the slug is part of it: a renamed court is removed and
+    added, which costs the same as changing it.
+    """
+    return (int(admin_id) if admin_id is not None else None, slug)
+
+
+def allocate_ids(model, count, database_name="default"):
+    """
+    Reserve `count` primary keys from the model's PostgreSQL sequence in one
+    query, so rows can point at each other before any of them is inserted
+    """
+    cursor = connections[database_name].cursor()
+    cursor.execute("SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+                   [model._meta.db_table, model._meta.pk.column, count])
+    return [row[0] for row in cursor.fetchall()]
+
+
+class BulkIngest(object):
+    """
+    Writes courts from courts.json with a fixed number of queries per batch
+    rather than several per court.
+
+    add() queues a court and its child rows, referring to lookup entities by
+    their fields. flush() reserves primary keys for the new lookup entities,
+    parking info and courts, then inserts each table with one bulk_create.
+    Lookup entities are remembered between batches, so each is inserted once.
+    """
+
+    def __init__(self, database_name="default", batch_size=BATCH_SIZE):
+        self.database_name = database_name
+        self.batch_size = batch_size
+        # lookup model -> {key: id}, with None for keys not yet written
+        self.ids = dict((model, {}) for model in LOOKUP_FIELDS)
+        self.new = dict((model, []) for model in LOOKUP_FIELDS)
+        self.courts = []
+        self.rows = []
+
+    def load_lookups(self):
+        """
+        Remember the lookup entities already in the database, so courts
+        added to a database that isn't empty reuse them
+        """
+        for model, fields in LOOKUP_FIELDS.items():
+            for row in model.objects.using(self.database_name).values_list('id', *fields):
+                self.ids[model][tuple(row[1:])] = row[0]
+
+    def lookup(self, model, *key):
+        if key not in self.ids[model]:
+            self.ids[model][key] = None
+            self.new[model].append(key)
+        return Ref(model, key)
+
+    def child(self, model, position, **fields):
+        self.rows.append((model, position, fields))
+
+    def add(self, court_obj):
+        court_created_at = court_obj.get('created_at', None)
+        created_at = parser.parse(court_created_at+'UTC') if court_created_at else None
+        court_updated_at = court_obj.get('updated_at', None)
+        updated_at = parser.parse(court_updated_at+'UTC') if court_updated_at else None
+        parking = court_obj.get('parking', None)
+        if parking:
+            parking_info = ParkingInfo(onsite=parking.get('onsite', None),
+                                       offsite=parking.get('offsite', None),
+                                       blue_badge=parking.get('blue_badge', None))
+        else:
+            parking_info = None
+
+        court = Court(
+            admin_id=court_obj['admin_id'],
+            cci_code=court_obj.get('cci_code', None),
+            name=court_obj['name'],
+            slug=court_obj['slug'],
+            displayed=court_obj['display'],
+            lat=court_obj.get('lat',None),
+            lon=court_obj.get('lon',None),
+            number=court_obj['court_number'],
+            alert=court_obj.get('alert', None),
+            directions=court_obj.get('directions', None),
+            image_file=court_obj.get('image_file', None),
+            created_at=created_at,
+            updated_at=updated_at,
+            info=court_obj['info'],
+            hide_aols=court_obj['hide_aols'],
+            info_leaflet=court_obj['info_leaflet'],
+            prosecution_leaflet=court_obj['prosecution_leaflet'],
+            defence_leaflet=court_obj['defence_leaflet'],
+            juror_leaflet=court_obj['juror_leaflet'],
+            content_hash=content_hash(court_obj)
+        )
+        position = len(self.courts)
+        self.courts.append((court, parking_info))
+
+        for aol_obj in court_obj['areas_of_law']:
+            aol = self.lookup(AreaOfLaw, aol_obj['name'], aol_obj['external_link'],
+                              aol_obj['external_link_desc'])
+            self.child(CourtAreaOfLaw, position, area_of_law=aol,
+                       single_point_of_entry=aol_obj.get('single_point_of_entry', False))
+
+            for local_authority in aol_obj['local_authorities']:
+                if isinstance(local_authority, dict):
+                    local_authority = local_authority['name']
+                self.child(CourtLocalAuthorityAreaOfLaw, position, area_of_law=aol,
+                           local_authority=self.lookup(LocalAuthority, local_authority))
+
+        for facility_obj in court_obj['facilities']:
+            facility = self.lookup(Facility,
+                                   facility_obj.get('name') or "",
+                                   facility_obj.get('description') or "",
+                                   facility_obj.get('image') or "",
+                                   facility_obj.get('image_description') or "",
+                                   facility_obj.get('image_file_path') or "")
+            self.child(CourtFacility, position, facility=facility)
+
+        for opening_time in court_obj['opening_times']:
+            self.child(CourtOpeningTime, position,
+                       opening_time=self.lookup(OpeningTime, opening_time))
+
+        for email in court_obj['emails']:
+            self.child(CourtEmail, position,
+                       email=self.lookup(Email, email['description'], email['address']))
+
+        for court_type_name in court_obj['court_types']:
+            self.child(CourtCourtType, position,
+                       court_type=self.lookup(CourtType, court_type_name))
+
+        for address in court_obj['addresses']:
+            address_type = self.lookup(AddressType, address['type'])
+            if address['town'] and not(address['town'].isspace()):
+                self.child(CourtAddress, position,
+                           address_type=address_type,
+                           address=address['address'],
+                           postcode=address['postcode'] or "",
+                           town=self.lookup(Town, address['town'], address['county']))
+
+        for contact_obj in court_obj['contacts']:
+            contact = self.lookup(Contact, contact_obj['name'], contact_obj['number'],
+                                  contact_obj['sort'], contact_obj['explanation'],
+                                  contact_obj['in_leaflet'])
+            self.child(CourtContact, position, contact=contact)
+
+        for postcode in court_obj['postcodes']:
+            self.child(CourtPostcode, position, postcode=postcode)
+
+        if len(self.courts) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write everything queued since the last flush
+        """
+        for model, fields in LOOKUP_FIELDS.items():
+            keys = self.new[model]
+            if not keys:
+                continue
+            ids = allocate_ids(model, len(keys), self.database_name)
+            model.objects.using(self.database_name).bulk_create(
+                [model(id=id, **dict(zip(fields, key))) for id, key in zip(ids, keys)])
+            self.ids[model].update(zip(keys, ids))
+            self.new[model] = []
+
+        parking = [p for _, p in self.courts if p is not None]
+        if parking:
+            for p, id in zip(parking, allocate_ids(ParkingInfo, len(parking), self.database_name)):
+                p.id = id
+            ParkingInfo.objects.using(self.database_name).bulk_create(parking)
+
+        if self.courts:
+            ids = allocate_ids(Court, len(self.courts), self.database_name)
+            for (court, parking_info), id in zip(self.courts, ids):
+                court.id = id
+                court.parking = parking_info
+            Court.objects.using(self.database_name).bulk_create([c for c, _ in self.courts])
+
+        rows = dict((model, []) for model in CHILD_MODELS)
+        for model, position, fields in self.rows:
+            values = {'court_id': self.courts[position][0].id}
+            for name, value in fields.items():
+                if isinstance(value, Ref):
+                    values[name + '_id'] = self.ids[value.model][value.key]
+                else:
+                    values[name] = value
+            rows[model].append(model(**values))
+        for model in CHILD_MODELS:
+            if rows[model]:
+                model.objects.using(self.database_name).bulk_create(rows[model])
+
+        self.courts = []
+        self.rows = []
+
+
+class LookupScan(BulkIngest):
+    """
+    Only writes the lookup entities that courts refer to
+    """
+
+    def add(self, court_obj):
+        super(LookupScan, self).add(court_obj)
+        self.courts = []
+
+    def child(self, model, position, **fields):
+        pass
+
+
+def batches(iterable, size):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+_worker = {}
+
+
+def _init_worker(database_name, lookup_ids):
+    _worker['database_name'] = database_name
+    _worker['lookup_ids'] = lookup_ids
+
+
+def _load_batch(courts):
+    """
+    Write a batch of courts in a worker process, with lookup entities
+    already written by the parent
+    """
+    loader = BulkIngest(_worker['database_name'])
+    loader.ids = _worker['lookup_ids']
+    for court_obj in courts:
+        loader.add(court_obj)
+    unknown = [model.__name__ for model, keys in loader.new.items() if keys]
+    if unknown:
+        raise ValueError('Courts changed since their lookups were written: new %s'
+                         % ', '.join(unknown))
+    with transaction.atomic(using=_worker['database_name']):
+        loader.flush()
+    return len(courts)
+
+
 class Ingest:
     @classmethod
     def courts(cls, courts, database_name="default"):
+        with transaction.atomic(using=database_name):
+            cls.delete_all(database_name)
+
+            loader = BulkIngest(database_name)
+            for court_obj in courts:
+                loader.add(court_obj)
+            loader.flush()
+
+            documents.build(database_name)
+        catalogue.invalidate()
+
+    @classmethod
+    def courts_parallel(cls, courts, workers, database_name="default"):
+        """
+        Ingest.courts spread over a pool of `workers` processes. `courts` is
+        called twice and must return the same courts each time, for example
+        by reading courts.json again.
+
+        The first pass writes every lookup entity the courts refer to, so
+        the workers all use the same ids for them. The second pass hands
+        batches of courts to the workers, each writing with its own
+        database connection and transaction. Unlike Ingest.courts this isn't
+        atomic: readers can see a partly loaded database, so use it where
+        nothing is serving from the database being loaded.
+        """
+        with transaction.atomic(using=database_name):
+            cls.delete_all(database_name)
+            scan = LookupScan(database_name)
+            for court_obj in courts():
+                scan.add(court_obj)
+            scan.flush()
+
+        # the workers are forked and must not share the parent's connections
+        for connection in connections.all():
+            connection.close()
+
+        pool = Pool(workers, _init_worker, (database_name, scan.ids))
+        try:
+            pending = deque()
+            for batch in batches(courts(), BATCH_SIZE):
+                pending.append(pool.apply_async(_load_batch, (batch,)))
+                # only read ahead a little, so memory stays bounded
+                if len(pending) >= 2 * workers:
+                    pending.popleft().get()
+            while pending:
+                pending.popleft().get()
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+        documents.build(database_name)
+        catalogue.invalidate()
+
+    @classmethod
+    def delete_all(cls, database_name="default"):
         Court.objects.using(database_name).all().delete()
         CourtAttributeType.objects.using(database_name).all().delete()
         CourtAttribute.objects.using(database_name).all().delete()
@@ -32,156 +384,81 @@ class Ingest:
         ParkingInfo.objects.using(database_name).all().delete()
         Town.objects.using(database_name).all().delete()
 
-        for court_obj in courts:
-            court_created_at = court_obj.get('created_at', None)
-            created_at = parser.parse(court_created_at+'UTC') if court_created_at else None
-            court_updated_at = court_obj.get('updated_at', None)
-            updated_at = parser.parse(court_updated_at+'UTC') if court_updated_at else None
-            parking = court_obj.get('parking', None)
-            if parking:
-                parking_info = ParkingInfo.objects.db_manager(database_name).create(onsite=parking.get('onsite', None),
-                                                          offsite=parking.get(
-                                                              'offsite', None),
-                                                          blue_badge=parking.get('blue_badge', None))
-            else:
-                parking_info = None
-
-            court = Court(
-                admin_id=court_obj['admin_id'],
-                cci_code=court_obj.get('cci_code', None),
-                name=court_obj['name'],
-                slug=court_obj['slug'],
-                displayed=court_obj['display'],
-                lat=court_obj.get('lat',None),
-                lon=court_obj.get('lon',None),
-                number=court_obj['court_number'],
-                alert=court_obj.get('alert', None),
-                directions=court_obj.get('directions', None),
-                image_file=court_obj.get('image_file', None),
-                created_at=created_at,
-                updated_at=updated_at,
-                parking=parking_info if parking_info else None,
-                info=court_obj['info'],
-                hide_aols=court_obj['hide_aols'],
-                info_leaflet=court_obj['info_leaflet'],
-                prosecution_leaflet=court_obj['prosecution_leaflet'],
-                defence_leaflet=court_obj['defence_leaflet'],
-                juror_leaflet=court_obj['juror_leaflet']
-            )
-            court.save(using=database_name)
-
-            for aol_obj in court_obj['areas_of_law']:
-                aol_name = aol_obj['name']
-                aol_slug = aol_obj.get('slug', slugify(aol_name))
-                aol_las = aol_obj['local_authorities']
-                aol_spoe = aol_obj.get('single_point_of_entry',False)
-                aol_external_link = aol_obj['external_link']
-                aol_external_link_desc = aol_obj['external_link_desc']
-
-                try:
-                    aol, created = AreaOfLaw.objects.db_manager(database_name).get_or_create(name=aol_name,
-                        external_link=aol_external_link,external_link_desc=aol_external_link_desc)
-                    CourtAreaOfLaw.objects.db_manager(database_name).create(court=court,
-                                                area_of_law=aol,
-                                                single_point_of_entry=aol_spoe)
-                except IntegrityError as e:
-                    print("ingest: Duplicate entry aol=%s, slug=%s, skipping..."
-                                % (aol_name, aol_slug))
-
-                for local_authority in aol_las:
-                    if isinstance(local_authority, dict):
-                        local_authority_object, created = LocalAuthority.objects.db_manager(database_name).get_or_create(
-                            gss_code=local_authority.get('gss_code'),
-                            name=local_authority['name'],
-                        )
-                    else:
-                        local_authority_object, created = LocalAuthority.objects.db_manager(database_name).get_or_create(
-                            name=local_authority
-                        )
-
-                    CourtLocalAuthorityAreaOfLaw.objects.db_manager(database_name).create(
-                        court=court,
-                        area_of_law=aol,
-                        local_authority=local_authority_object
-                    )
-
-            for facility_obj in court_obj['facilities']:
-                facility_name = facility_obj['name'] \
-                        if "name" in facility_obj and \
-                        facility_obj["name"] else ""
-                facility_description = facility_obj['description'] \
-                        if "description" in facility_obj and \
-                        facility_obj["description"] else ""
-                facility_image = facility_obj['image'] \
-                        if "image" in facility_obj and facility_obj["image"] else ""
-                facility_image_description = facility_obj['image_description'] \
-                        if "image_description" in facility_obj and \
-                        facility_obj["image_description"] else ""
-                facility_image_file_path = facility_obj['image_file_path'] \
-                        if "image_file_path" in facility_obj and \
-                        facility_obj["image_file_path"] else ""
-                facility, created = Facility.objects.db_manager(database_name).get_or_create(
-                    name=facility_name,
-                    description=facility_description,
-                    image=facility_image,
-                    image_description=facility_image_description,
-                    image_file_path=facility_image_file_path,
-                )
-                CourtFacility.objects.db_manager(database_name).create(court=court, facility=facility)
-
-            for opening_time in court_obj['opening_times']:
-                opening_time, created = OpeningTime.objects.db_manager(database_name).get_or_create(
-                    description=opening_time)
-                CourtOpeningTime.objects.db_manager(database_name).create(
-                    court=court, opening_time=opening_time)
-
-            for email in court_obj['emails']:
-                email, created = Email.objects.db_manager(database_name).get_or_create(
-                    description=email['description'], address=email['address'])
-                CourtEmail.objects.db_manager(database_name).create(court=court, email=email)
-
-            for court_type_name in court_obj['court_types']:
-                ct, created = CourtType.objects.db_manager(database_name).get_or_create(
-                    name=court_type_name)
-
-                CourtCourtType.objects.db_manager(database_name).create(court=court, court_type=ct)
-
-
-            for address in court_obj['addresses']:
-                address_type, created = AddressType.objects.db_manager(database_name).get_or_create(
-                    name=address['type'])
-
-                if address['town'] and not(address['town'].isspace()):
-                    town, created = Town.objects.db_manager(database_name).get_or_create(
-                        name=address['town'], county=address['county'])
-                    if not address['postcode']:
-                        address['postcode'] = ""
-                    CourtAddress.objects.db_manager(database_name).create(
-                        court=court,
-                        address_type=address_type,
-                        address=address['address'],
-                        postcode=address['postcode'],
-                        town=town
-                    )
-
-            for contact_obj in court_obj['contacts']:
-                contact, created = Contact.objects.db_manager(database_name).get_or_create(name=contact_obj['name'],
-                                                                 number=contact_obj[
-                                                                     'number'],
-                                                                 sort_order=contact_obj['sort'],
-                                                                 explanation=contact_obj['explanation'],
-                                                                 in_leaflet=contact_obj['in_leaflet'])
-
-                CourtContact.objects.db_manager(database_name).create(
-                    court=court,
-                    contact=contact,
-                )
-
-            for postcode in court_obj['postcodes']:
-                CourtPostcode.objects.db_manager(database_name).create(
-                    court=court,
-                    postcode=postcode
-                )
+    @classmethod
+    def courts_diff(cls, courts, database_name="default"):
+        """
+        Bring the database in line with `courts` by only rewriting the courts
+        that were added, changed or removed since the last ingest, matched
+        by court_identity and compared by content hash. Changed courts are
+        deleted and loaded again with their child rows, then lookup entities
+        no court uses any more are removed. Returns how many courts were
+        added, changed, removed and left unchanged.
+        """
+        counts = {'added': 0, 'changed': 0, 'removed': 0, 'unchanged': 0}
+        with transaction.atomic(using=database_name):
+            # identities can repeat, so each has the (id, content hash) of
+            # all its courts, matched one to one with courts.json's
+            existing = defaultdict(list)
+            for id, admin_id, slug, court_hash in Court.objects.using(database_name) \
+                    .order_by('id').values_list('id', 'admin_id', 'slug', 'content_hash'):
+                existing[court_identity(admin_id, slug)].append((id, court_hash))
+
+            loader = BulkIngest(database_name)
+            loader.load_lookups()
+            stale = []
+            for court_obj in courts:
+                court_hash = content_hash(court_obj)
+                current = existing.get(court_identity(court_obj['admin_id'], court_obj['slug']))
+                if not current:
+                    counts['added'] += 1
+                    loader.add(court_obj)
+                    continue
+                same = [i for i, (id, existing_hash) in enumerate(current)
+                        if existing_hash == court_hash]
+                id, existing_hash = current.pop(same[0] if same else 0)
+                if existing_hash == court_hash:
+                    counts['unchanged'] += 1
+                    continue
+                counts['changed'] += 1
+                stale.append(id)
+                loader.add(court_obj)
+            surplus = [id for rows in existing.values() for id, _ in rows]
+            counts['removed'] = len(surplus)
+            stale.extend(surplus)
+
+            if stale or counts['added']:
+                cls.delete_courts(stale, database_name)
+                loader.flush()
+                cls.delete_orphans(database_name)
+                documents.build(database_name)
+
+        if stale or counts['added']:
+            catalogue.invalidate()
+        return counts
+
+    @classmethod
+    def delete_courts(cls, court_ids, database_name="default"):
+        """
+        Delete courts and their child rows, a table at a time
+        """
+        if not court_ids:
+            return
+        for model in CHILD_MODELS + (CourtAttribute,):
+            model.objects.using(database_name).filter(court_id__in=court_ids).delete()
+        Court.objects.using(database_name).filter(id__in=court_ids).delete()
+
+    @classmethod
+    def delete_orphans(cls, database_name="default"):
+        """
+        Delete lookup entities and parking info no court refers to
+        """
+        for model, references in LOOKUP_REFERENCES.items():
+            orphans = model.objects.using(database_name)
+            for child, field in references:
+                orphans = orphans.exclude(id__in=child.objects.using(database_name).values(field))
+            orphans.delete()
+        ParkingInfo.objects.using(database_name).exclude(
+            id__in=Court.objects.using(database_name).exclude(parking=None).values('parking')).delete()
 
     @classmethod
     def emergency_message(cls, emergency_message, database_name="default"):
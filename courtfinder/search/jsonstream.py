@@ -0,0 +1,109 @@
+"""
+Incremental reader for courts.json.
+
+json.load holds the whole file and everything parsed from it at once.
+JSONStream reads the file a chunk at a time and yields the members of its
+top-level object as they are read: arrays one item at a time, as
+(key, item) pairs, and everything else whole, as (key, value). Only the
+value being decoded and the unread rest of the current chunk are held, so
+memory stays flat however many courts the file has.
+"""
+import json
+import re
+
+
+CHUNK_SIZE = 64 * 1024
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+# what can follow a value inside the top-level object
+DELIMITERS = ',]} \t\n\r'
+
+
+class JSONStream(object):
+
+    def __init__(self, fileobj, chunk_size=CHUNK_SIZE):
+        self.file = fileobj
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+        # the most characters held at once, for keeping an eye on memory
+        self.peak_buffer = 0
+
+    def _fill(self, size):
+        """
+        Drop what has been consumed and read at least `size` more characters.
+        Returns False at the end of the file.
+        """
+        if self.eof:
+            return False
+        chunk = self.file.read(size)
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        self.peak_buffer = max(self.peak_buffer, len(self.buffer))
+        if not chunk:
+            self.eof = True
+        return bool(chunk)
+
+    def _peek(self):
+        """
+        The next character that isn't whitespace, without consuming it
+        """
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill(self.chunk_size):
+                raise ValueError('Unexpected end of JSON data')
+
+    def _expect(self, characters):
+        char = self._peek()
+        if char not in characters:
+            raise ValueError('Expected one of %r but found %r' % (characters, char))
+        self.pos += 1
+        return char
+
+    def _value(self):
+        """
+        Decode the next complete value, reading more of the file until it
+        fits in the buffer
+        """
+        number = self._peek() in '-0123456789'
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a number cut short by the end of the buffer still decodes,
+                # as '1.' or '1.5e' decode as 1 and 1.5, so only trust one
+                # once a delimiter follows it
+                if self.eof or end < len(self.buffer) and \
+                        (not number or self.buffer[end] in DELIMITERS):
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof:
+                    raise
+            # grow geometrically so a large value is decoded in linear time
+            self._fill(max(self.chunk_size, len(self.buffer) - self.pos))
+
+    def __iter__(self):
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if self._peek() == '[':
+                self.pos += 1
+                if self._peek() == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        yield key, self._value()
+                        if self._expect(',]') == ']':
+                            break
+            else:
+                yield key, self._value()
+            if self._expect(',}') == '}':
+                return
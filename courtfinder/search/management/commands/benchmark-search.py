@@ -0,0 +1,468 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+from contextlib import contextmanager
+import copy
+import io
+from itertools import chain
+import json
+import random
+import re
+import time
+
+from dateutil import parser
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from optparse import make_option
+
+from search.catalogue import get_catalogue
+from search.court_search import CourtSearch
+from search.ingest import Ingest, BulkIngest
+from search.models import *
+from search.rules import Rules
+
+
+# Rough bounding box of Great Britain
+LAT_RANGE = (50.0, 58.6)
+LON_RANGE = (-5.7, 1.7)
+
+
+@contextmanager
+def scratch_database():
+    """
+    Point the default connection at a new, migrated test database, so
+    timing ingests neither changes nor locks the live courts tables
+    """
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def legacy_ingest(courts, database_name="default"):
+    """
+    Ingest.courts as it was before the bulk loader, without the deletes
+    """
+    for court_obj in courts:
+        court_created_at = court_obj.get('created_at', None)
+        created_at = parser.parse(court_created_at+'UTC') if court_created_at else None
+        court_updated_at = court_obj.get('updated_at', None)
+        updated_at = parser.parse(court_updated_at+'UTC') if court_updated_at else None
+        parking = court_obj.get('parking', None)
+        if parking:
+            parking_info = ParkingInfo.objects.db_manager(database_name).create(onsite=parking.get('onsite', None),
+                                                      offsite=parking.get(
+                                                          'offsite', None),
+                                                      blue_badge=parking.get('blue_badge', None))
+        else:
+            parking_info = None
+
+        court = Court(
+            admin_id=court_obj['admin_id'],
+            cci_code=court_obj.get('cci_code', None),
+            name=court_obj['name'],
+            slug=court_obj['slug'],
+            displayed=court_obj['display'],
+            lat=court_obj.get('lat',None),
+            lon=court_obj.get('lon',None),
+            number=court_obj['court_number'],
+            alert=court_obj.get('alert', None),
+            directions=court_obj.get('directions', None),
+            image_file=court_obj.get('image_file', None),
+            created_at=created_at,
+            updated_at=updated_at,
+            parking=parking_info if parking_info else None,
+            info=court_obj['info'],
+            hide_aols=court_obj['hide_aols'],
+            info_leaflet=court_obj['info_leaflet'],
+            prosecution_leaflet=court_obj['prosecution_leaflet'],
+            defence_leaflet=court_obj['defence_leaflet'],
+            juror_leaflet=court_obj['juror_leaflet']
+        )
+        court.save(using=database_name)
+
+        for aol_obj in court_obj['areas_of_law']:
+            aol_name = aol_obj['name']
+            aol_las = aol_obj['local_authorities']
+            aol_spoe = aol_obj.get('single_point_of_entry',False)
+            aol_external_link = aol_obj['external_link']
+            aol_external_link_desc = aol_obj['external_link_desc']
+
+            aol, created = AreaOfLaw.objects.db_manager(database_name).get_or_create(name=aol_name,
+                external_link=aol_external_link,external_link_desc=aol_external_link_desc)
+            CourtAreaOfLaw.objects.db_manager(database_name).create(court=court,
+                                        area_of_law=aol,
+                                        single_point_of_entry=aol_spoe)
+
+            for local_authority in aol_las:
+                # the same as BulkIngest, which only keeps the name
+                if isinstance(local_authority, dict):
+                    local_authority = local_authority['name']
+                local_authority_object, created = LocalAuthority.objects.db_manager(database_name).get_or_create(
+                    name=local_authority
+                )
+
+                CourtLocalAuthorityAreaOfLaw.objects.db_manager(database_name).create(
+                    court=court,
+                    area_of_law=aol,
+                    local_authority=local_authority_object
+                )
+
+        for facility_obj in court_obj['facilities']:
+            facility_name = facility_obj['name'] \
+                    if "name" in facility_obj and \
+                    facility_obj["name"] else ""
+            facility_description = facility_obj['description'] \
+                    if "description" in facility_obj and \
+                    facility_obj["description"] else ""
+            facility_image = facility_obj['image'] \
+                    if "image" in facility_obj and facility_obj["image"] else ""
+            facility_image_description = facility_obj['image_description'] \
+                    if "image_description" in facility_obj and \
+                    facility_obj["image_description"] else ""
+            facility_image_file_path = facility_obj['image_file_path'] \
+                    if "image_file_path" in facility_obj and \
+                    facility_obj["image_file_path"] else ""
+            facility, created = Facility.objects.db_manager(database_name).get_or_create(
+                name=facility_name,
+                description=facility_description,
+                image=facility_image,
+                image_description=facility_image_description,
+                image_file_path=facility_image_file_path,
+            )
+            CourtFacility.objects.db_manager(database_name).create(court=court, facility=facility)
+
+        for opening_time in court_obj['opening_times']:
+            opening_time, created = OpeningTime.objects.db_manager(database_name).get_or_create(
+                description=opening_time)
+            CourtOpeningTime.objects.db_manager(database_name).create(
+                court=court, opening_time=opening_time)
+
+        for email in court_obj['emails']:
+            email, created = Email.objects.db_manager(database_name).get_or_create(
+                description=email['description'], address=email['address'])
+            CourtEmail.objects.db_manager(database_name).create(court=court, email=email)
+
+        for court_type_name in court_obj['court_types']:
+            ct, created = CourtType.objects.db_manager(database_name).get_or_create(
+                name=court_type_name)
+
+            CourtCourtType.objects.db_manager(database_name).create(court=court, court_type=ct)
+
+
+        for address in court_obj['addresses']:
+            address_type, created = AddressType.objects.db_manager(database_name).get_or_create(
+                name=address['type'])
+
+            if address['town'] and not(address['town'].isspace()):
+                town, created = Town.objects.db_manager(database_name).get_or_create(
+                    name=address['town'], county=address['county'])
+                if not address['postcode']:
+                    address['postcode'] = ""
+                CourtAddress.objects.db_manager(database_name).create(
+                    court=court,
+                    address_type=address_type,
+                    address=address['address'],
+                    postcode=address['postcode'],
+                    town=town
+                )
+
+        for contact_obj in court_obj['contacts']:
+            contact, created = Contact.objects.db_manager(database_name).get_or_create(name=contact_obj['name'],
+                                                             number=contact_obj[
+                                                                 'number'],
+                                                             sort_order=contact_obj['sort'],
+                                                             explanation=contact_obj['explanation'],
+                                                             in_leaflet=contact_obj['in_leaflet'])
+
+            CourtContact.objects.db_manager(database_name).create(
+                court=court,
+                contact=contact,
+            )
+
+        for postcode in court_obj['postcodes']:
+            CourtPostcode.objects.db_manager(database_name).create(
+                court=court,
+                postcode=postcode
+            )
+
+
+def legacy_order_by_distance(lat, lon, courts):
+    """
+    CourtSearch ordering as it was before distances were computed in-process
+    """
+    court_ids = "(%s)" % ", ".join([str(c.id) for c in courts])
+    results = Court.objects.raw("""
+            SELECT *,
+                   (point(c.lon, c.lat) <@> point(%s, %s)) as distance
+              FROM search_court as c
+             WHERE id in %s
+             ORDER BY distance
+    """ % (lon, lat, court_ids))
+    return [r for r in results]
+
+
+def legacy_proximity_search(lat, lon, area_of_law):
+    """
+    The proximity search as it was before the spatial index
+    """
+    results = Court.objects.raw("""
+        SELECT *,
+               (point(c.lon, c.lat) <@> point(%s, %s)) as distance
+          FROM search_court as c
+          WHERE c.displayed
+         ORDER BY distance, "name"
+    """, [lon, lat])
+
+    if area_of_law is not None:
+        return [r for r in results if area_of_law in r.areas_of_law.all()][:10]
+    else:
+        return [r for r in results][:10]
+
+
+def legacy_address_search(query):
+    """
+    The name and address search as it was before the trigram indexes and
+    the inverted index
+    """
+    word_separator = re.compile(r'[^\w]+', re.UNICODE)
+    query_regex = ''.join(map(lambda word: "(?=.*\y"+word+"\y)", re.split(word_separator, query)))
+
+    # ordered by name, as the search now breaks ties, so that only real
+    # differences in the results are counted
+    catalogue = get_catalogue()
+    name_results = sorted(Court.objects.filter(name__iregex=query_regex).order_by('name'), key=lambda c: -len(catalogue.areas_of_law_for(c.id)))
+    address_results = Court.objects.filter(courtaddress__address__iregex=query_regex).order_by('name')
+    town_results = Court.objects.filter(courtaddress__town__name__iregex=query_regex).order_by('name')
+    county_results = Court.objects.filter(courtaddress__town__county__iregex=query_regex).order_by('name')
+    return list(OrderedDict.fromkeys(chain(name_results, town_results, address_results, county_results)))
+
+
+def legacy_postcode_search(postcode, area_of_law):
+    """
+    The postcode coverage search as it was before the prefix trie
+    """
+    p = postcode.lower().replace(' ', '')
+    results = CourtPostcode.objects \
+            .filter(court__areas_of_law=area_of_law) \
+            .extra(where=["%s LIKE lower(postcode) || '%%'"], params=[p]) \
+            .distinct('court')
+    return [c.court for c in results]
+
+
+class Command(BaseCommand):
+
+    help = 'Time search strategies against the courts data in the database'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--suite',
+            action='store',
+            type='string',
+            dest='suite',
+            default='proximity',
+            help='Which benchmark to run: proximity, distance, ingest, text, postcode'),
+        make_option('--iterations',
+            action='store',
+            type='int',
+            dest='iterations',
+            default=200,
+            help='How many searches to time per strategy, or for ingest '
+                 'how many copies of the test courts to load into a scratch '
+                 'test database'),
+        make_option('--queries',
+            action='store',
+            type='string',
+            dest='queries',
+            default=None,
+            help='For the text suite, a file of queries to replay, one per '
+                 'line, instead of generated ones'),
+        make_option('--seed',
+            action='store',
+            type='int',
+            dest='seed',
+            default=1,
+            help='Random seed for the generated searches'),
+    )
+
+    def handle(self, *args, **options):
+        suite = getattr(self, 'suite_%s' % options['suite'], None)
+        if suite is None:
+            raise CommandError('Unknown benchmark suite: %s' % options['suite'])
+        random.seed(options['seed'])
+        if options['suite'] == 'text':
+            suite(options['iterations'], options['queries'])
+        else:
+            suite(options['iterations'])
+
+    def report(self, name, timings):
+        timings = sorted(timings)
+        mean = sum(timings) / len(timings)
+        self.stdout.write('%-30s mean %8.3fms  p50 %8.3fms  p95 %8.3fms' % (
+            name, mean * 1000, timings[len(timings) // 2] * 1000,
+            timings[int(len(timings) * 0.95)] * 1000))
+        return mean
+
+    def time(self, function, searches):
+        timings = []
+        results = []
+        for search in searches:
+            start = time.time()
+            results.append(function(*search))
+            timings.append(time.time() - start)
+        return timings, results
+
+    def suite_proximity(self, iterations):
+        catalogue = get_catalogue()
+        areas_of_law = [None] + [catalogue.area_of_law(name) for name in Rules.by_proximity
+                                 if catalogue.area_of_law(name) is not None]
+        searches = [(random.uniform(*LAT_RANGE), random.uniform(*LON_RANGE),
+                     random.choice(areas_of_law))
+                    for i in range(iterations)]
+
+        # build the per area of law indexes before timing
+        for area_of_law in areas_of_law:
+            catalogue.nearest(0, 0, area_of_law.id if area_of_law else None, 10)
+
+        legacy_timings, legacy_results = self.time(legacy_proximity_search, searches)
+        index_timings, index_results = self.time(
+            lambda lat, lon, aol: catalogue.nearest(lat, lon, aol.id if aol else None, 10),
+            searches)
+
+        mismatches = 0
+        for legacy, indexed in zip(legacy_results, index_results):
+            same_courts = [c.id for c in legacy] == [c.id for c in indexed]
+            same_distances = all(
+                (a.distance is None and b.distance is None) or
+                abs(a.distance - b.distance) < 1e-6
+                for a, b in zip(legacy, indexed))
+            if not (same_courts and same_distances):
+                mismatches += 1
+
+        legacy_mean = self.report('SQL <@> full scan', legacy_timings)
+        index_mean = self.report('k-d tree per area of law', index_timings)
+        self.stdout.write('speedup x%.1f, %d of %d searches differ' % (
+            legacy_mean / index_mean if index_mean else float('inf'),
+            mismatches, len(searches)))
+
+    def suite_distance(self, iterations):
+        catalogue = get_catalogue()
+        courts = list(catalogue.courts.values())
+        searches = [(random.uniform(*LAT_RANGE), random.uniform(*LON_RANGE),
+                     random.sample(courts, min(len(courts), random.randint(1, 20))))
+                    for i in range(iterations)]
+
+        legacy_timings, legacy_results = self.time(legacy_order_by_distance, searches)
+        vector_timings, vector_results = self.time(catalogue.order_by_distance, searches)
+
+        worst = 0.0
+        for legacy, vectorised in zip(legacy_results, vector_results):
+            for a, b in zip(legacy, vectorised):
+                if a.distance is not None and b.distance is not None:
+                    worst = max(worst, abs(a.distance - b.distance))
+
+        legacy_mean = self.report('SQL <@> round trip', legacy_timings)
+        vector_mean = self.report('numpy haversine', vector_timings)
+        self.stdout.write('speedup x%.1f, largest distance difference %.2e miles' % (
+            legacy_mean / vector_mean if vector_mean else float('inf'), worst))
+
+    def suite_ingest(self, iterations):
+        test_data = settings.PROJECT_ROOT + '/data/test_data/courts.json'
+        test_courts = json.load(open(test_data))['courts']
+        courts = []
+        for i in range(iterations):
+            for court_obj in test_courts:
+                court_obj = copy.deepcopy(court_obj)
+                court_obj['slug'] = '%s-%d' % (court_obj['slug'], i)
+                court_obj['name'] = '%s %d' % (court_obj['name'], i)
+                courts.append(court_obj)
+
+        def bulk_ingest(courts):
+            loader = BulkIngest()
+            for court_obj in courts:
+                loader.add(court_obj)
+            loader.flush()
+
+        timings = {}
+        with scratch_database():
+            for name, function in (('legacy', legacy_ingest), ('bulk', bulk_ingest)):
+                Ingest.courts([])
+                with CaptureQueriesContext(connection) as queries:
+                    start = time.time()
+                    function(courts)
+                    timings[name] = (time.time() - start, len(queries))
+
+        self.stdout.write('%d courts' % len(courts))
+        for name, label in (('legacy', 'row at a time'), ('bulk', 'bulk_create batches')):
+            seconds, queries = timings[name]
+            self.stdout.write('%-30s %8.3fs  %6d queries' % (label, seconds, queries))
+        self.stdout.write('speedup x%.1f' % (timings['legacy'][0] / timings['bulk'][0]
+                                             if timings['bulk'][0] else float('inf')))
+
+    def suite_text(self, iterations, queries_file=None):
+        catalogue = get_catalogue()
+        words = set()
+        for court in catalogue.courts.values():
+            words.update(court.name.split())
+            for address in catalogue.addresses.get(court.id, ()):
+                words.update(address.address.split())
+                words.update(address.town.name.split())
+                words.update(address.town.county.split())
+        words = sorted(word for word in (re.sub(r'[^\w]+', '', w, flags=re.UNICODE) for w in words)
+                       if len(word) > 2)
+        if not words:
+            raise CommandError('There are no courts to search for')
+        if queries_file:
+            with io.open(queries_file, encoding='utf-8') as queries:
+                searches = [(line.strip(),) for line in queries if line.strip()]
+        else:
+            # one and two word queries, as people type them
+            searches = [(' '.join(random.sample(words, random.randint(1, min(2, len(words))))),)
+                        for i in range(iterations)]
+
+        def database_search(query):
+            with override_settings(FEATURE_INVERTED_INDEX_ENABLED=False):
+                return CourtSearch(query=query).get_courts()
+
+        legacy_timings, legacy_results = self.time(legacy_address_search, searches)
+        indexed_timings, indexed_results = self.time(database_search, searches)
+        inverted_timings, inverted_results = self.time(catalogue.text_search, searches)
+
+        def differences(results):
+            return sum(1 for legacy, other in zip(legacy_results, results)
+                       if [c.id for c in legacy] != [c.id for c in other])
+
+        legacy_mean = self.report('iregex lookaheads', legacy_timings)
+        for name, timings, results in (('trigram prefilter', indexed_timings, indexed_results),
+                                       ('inverted index', inverted_timings, inverted_results)):
+            mean = self.report(name, timings)
+            self.stdout.write('speedup x%.1f, %d of %d searches differ' % (
+                legacy_mean / mean if mean else float('inf'),
+                differences(results), len(searches)))
+
+    def suite_postcode(self, iterations):
+        catalogue = get_catalogue()
+        areas_of_law = [catalogue.area_of_law(name) for name in Rules.by_postcode
+                        if catalogue.area_of_law(name) is not None]
+        covered = list(CourtPostcode.objects.values_list('postcode', flat=True).distinct())
+        if not covered or not areas_of_law:
+            raise CommandError('There are no court postcodes to search for')
+        # covered postcodes, filled out to full ones
+        searches = [(random.choice(covered).upper() + ' 1AA'[:random.randint(0, 4)],
+                     random.choice(areas_of_law))
+                    for i in range(iterations)]
+
+        legacy_timings, legacy_results = self.time(legacy_postcode_search, searches)
+        trie_timings, trie_results = self.time(
+            lambda postcode, aol: catalogue.courts_covering(postcode, aol.id), searches)
+
+        mismatches = sum(1 for legacy, trie in zip(legacy_results, trie_results)
+                         if sorted(c.id for c in legacy) != [c.id for c in trie])
+
+        legacy_mean = self.report('SQL LIKE full scan', legacy_timings)
+        trie_mean = self.report('prefix trie', trie_timings)
+        self.stdout.write('speedup x%.1f, %d of %d searches differ' % (
+            legacy_mean / trie_mean if trie_mean else float('inf'),
+            mismatches, len(searches)))
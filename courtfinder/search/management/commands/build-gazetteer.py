@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+import csv
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from optparse import make_option
+
+from search import gazetteer
+
+
+# The ONS Postcode Directory uses this for postcodes without a grid reference
+NO_LOCATION = 99.999999
+
+# and county codes like E99999999 for postcodes outside a two-tier area
+NO_COUNTY_SUFFIX = '99999999'
+
+
+def text(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+
+class Command(BaseCommand):
+
+    args = '<postcodes csv>'
+    help = 'Build the offline postcode gazetteer from an ONS Postcode Directory style CSV'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--output',
+            action='store',
+            type='string',
+            dest='output',
+            default=None,
+            help='Where to write the gazetteer, defaults to POSTCODE_GAZETTEER_PATH'),
+        make_option('--postcode-column',
+            action='store',
+            type='string',
+            dest='postcode_column',
+            default='pcd',
+            help='Column holding the postcode'),
+        make_option('--lat-column',
+            action='store',
+            type='string',
+            dest='lat_column',
+            default='lat',
+            help='Column holding the WGS84 latitude'),
+        make_option('--lon-column',
+            action='store',
+            type='string',
+            dest='lon_column',
+            default='long',
+            help='Column holding the WGS84 longitude'),
+        make_option('--authority-column',
+            action='store',
+            type='string',
+            dest='authority_column',
+            default='oslaua',
+            help='Column holding the local authority (district) code or name'),
+        make_option('--county-column',
+            action='store',
+            type='string',
+            dest='county_column',
+            default='oscty',
+            help='Column holding the county code or name, used instead of '
+                 'the district in two-tier areas as MapIt lookups do'),
+        make_option('--authority-names',
+            action='store',
+            type='string',
+            dest='authority_names',
+            default=None,
+            help='CSV of "code,name" rows translating local authority codes '
+                 'into the names used by the courts data'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Usage: build-gazetteer %s' % self.args)
+
+        logger = logging.getLogger('courtfinder-search::build-gazetteer.py:')
+        output = options['output'] or settings.POSTCODE_GAZETTEER_PATH
+
+        names = {}
+        if options['authority_names']:
+            with open(options['authority_names'], 'rb') as names_file:
+                for row in csv.reader(names_file):
+                    if len(row) >= 2:
+                        names[text(row[0])] = text(row[1])
+
+        with open(args[0], 'rb') as postcodes_file:
+            count = gazetteer.write(output, self.records(postcodes_file, names, options))
+
+        logger.info('build-gazetteer: Wrote %d postcodes to %s' % (count, output))
+
+    def records(self, postcodes_file, names, options):
+        for row in csv.DictReader(postcodes_file):
+            # skip terminated postcodes
+            if row.get('doterm'):
+                continue
+            try:
+                lat = float(row[options['lat_column']])
+                lon = float(row[options['lon_column']])
+            except (KeyError, ValueError):
+                continue
+            if lat == NO_LOCATION:
+                continue
+            authority = text(row.get(options['authority_column']) or '')
+            county = text(row.get(options['county_column']) or '')
+            if county and not county.endswith(NO_COUNTY_SUFFIX):
+                authority = county
+            yield (text(row[options['postcode_column']]),
+                   lat, lon,
+                   names.get(authority, authority))
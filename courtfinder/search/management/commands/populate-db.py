@@ -1,21 +1,46 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
+import io
 import os
-import json
 import hashlib
+import json
 import logging
 import sys
 
 import boto3
 from boto3.s3.transfer import S3Transfer
 import botocore
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
 from django.db.utils import IntegrityError, ProgrammingError
 from optparse import make_option
 
 from search.models import DataStatus
 from search.ingest import Ingest
+from search.jsonstream import JSONStream
+from search import publish as publishing
+from courts import export
+
+
+HASH_BLOCK_SIZE = 65536
+
+# Where the ETag, size and hash of each file downloaded from s3 are kept
+S3_STATE_FILE = '.s3-state.json'
+
+
+def read_s3_state(local_dir):
+    try:
+        with open(os.path.join(local_dir, S3_STATE_FILE)) as state_file:
+            return json.load(state_file)
+    except (IOError, ValueError):
+        return {}
+
+
+def write_s3_state(local_dir, state):
+    path = os.path.join(local_dir, S3_STATE_FILE)
+    with open(path + '.part', 'w') as state_file:
+        json.dump(state, state_file)
+    os.rename(path + '.part', path)
 
 
 class Command(BaseCommand):
@@ -46,6 +71,29 @@ class Command(BaseCommand):
             dest='ingest',
             default=False,
             help='Ingest the local court files'),
+        make_option('--diff',
+            action='store_true',
+            dest='diff',
+            default=False,
+            help='Only rewrite the courts that were added, changed or removed'),
+        make_option('--workers',
+            action='store',
+            type='int',
+            dest='workers',
+            default=1,
+            help='Load the courts with this many processes. Not atomic: '
+                 'for databases nothing is serving from'),
+        make_option('--publish',
+            action='store_true',
+            dest='publish',
+            default=False,
+            help='Load into a new schema, validate it and swap it live'),
+        make_option('--rollback',
+            action='store',
+            type='string',
+            dest='rollback',
+            default=None,
+            help='Swap the data in a schema retired by --publish back live'),
         make_option('--sys-exit',
             action='store_true',
             dest='sys-exit',
@@ -80,9 +128,6 @@ class Command(BaseCommand):
         local_dir = options['datadir']
         remote_dir = ""
         
-        # Store the current hash
-        old_hash = self.hashes(local_dir, courts_files)
-
         do_load_remote = False
         do_ingest = False
         ingest_if_unchanged = False
@@ -102,6 +147,20 @@ class Command(BaseCommand):
                 do_ingest = True
                 ingest_if_unchanged = True
 
+        if options['diff'] and options['workers'] > 1:
+            raise CommandError('--workers only applies to full ingests, not --diff')
+        if options['diff'] and options['publish']:
+            raise CommandError('--publish loads a new schema from scratch, it can\'t be used with --diff')
+
+        if options['rollback']:
+            try:
+                retired = publishing.rollback(options['rollback'], options['database'])
+            except publishing.PublishError as e:
+                raise CommandError(str(e))
+            self.logger.info('handle: {} is live, the data it replaced is kept in schema {}'
+                             .format(options['rollback'], retired))
+            return
+
         if do_load_remote:
             self.logger.info("handle: Loading remote files...")
             load_remote_files_success = self.load_remote_files(local_dir,
@@ -111,7 +170,7 @@ class Command(BaseCommand):
                 self.logger.critical("handle: Failed to load remote files, exiting")
                 sys.exit(1)
 
-        files_changed = self.hashes(local_dir, courts_files) != old_hash
+        files_changed = do_load_remote and bool(self.changed_files)
 
         # If the files have not changed, and we have not specifically
         # asked for the files to be ingested,then exit
@@ -125,7 +184,10 @@ class Command(BaseCommand):
         if do_ingest:
             if files_changed or ingest_if_unchanged:
                 self.logger.info("handle: Ingesting files...")
-                success = self.import_files(local_dir, courts_files, options['database'])
+                success = self.import_files(local_dir, courts_files, options['database'],
+                                            diff=options['diff'],
+                                            workers=options['workers'],
+                                            publish=options['publish'])
                 if not success:
                     self.logger.critical('handle: Importing the courts data was unsuccessful')
                     if (options['sys-exit']):
@@ -178,7 +240,10 @@ class Command(BaseCommand):
     def import_files(self,
                      local_dir,
                      filenames,
-                     database_name="default"):
+                     database_name="default",
+                     diff=False,
+                     workers=1,
+                     publish=False):
         """
         Imports the set of files from the specified directory into
         the application
@@ -187,34 +252,85 @@ class Command(BaseCommand):
             local_dir(string): The directory containing the files
             filenames(list): List of files to import
             database_name(string): The database to import the data into
+            diff(bool): Only rewrite the courts that have changed
+            workers(int): How many processes to load the courts with
+            publish(bool): Load into a new schema and swap it live
 
         Returns:
             (bool): True if ingestion was successful, False otherwise
         """
+        data_hash = ''.join(self.hashes(local_dir, filenames))
+
+        def load():
+            self.load_files(local_dir, filenames, database_name, diff, workers)
+            # Set the ingestion status
+            DataStatus.objects.db_manager(database_name).create(data_hash=data_hash)
+
+        try:
+            if publish:
+                retired = publishing.publish(load, data_hash, database_name)
+                self.logger.info('import_files: Published the new data, the previous data '
+                                 'is kept in schema {}'.format(retired))
+            else:
+                load()
+        except (IntegrityError, ProgrammingError) as e:
+            error_name = e.__class__.__name__
+            self.logger.critical("import_files: There was a django '{}' error ingesting the courts data, '{}'"
+                                 .format(error_name, e.message))
+            return False
+        except publishing.PublishError as e:
+            self.logger.critical("import_files: The new data was not published, '{}'".format(e))
+            return False
+
+        if database_name == 'default':
+            # the /courts.json dump, which the site would otherwise write on first request
+            try:
+                export.build(prune=True)
+            except (IOError, OSError) as e:
+                self.logger.error("import_files: Failed to write the courts.json dump, '{}'".format(e))
+        return True
+
+    def load_files(self,
+                   local_dir,
+                   filenames,
+                   database_name="default",
+                   diff=False,
+                   workers=1):
+        """
+        Ingests the courts files, see import_files
+        """
         for filename in filenames:
             courts_data_path = os.path.join(local_dir, filename)
-            with open(courts_data_path, 'r') as courtsfile:
-                self.logger.info('import_files: Importing file {}/{}'.format(local_dir, filename))
-                courts = json.load(courtsfile)
-                courtsfile.close()
-                # Import the data into the application
-                try:
-                    Ingest.courts(courts['courts'], database_name=database_name)
-                    Ingest.emergency_message(courts['emergency_message'], database_name=database_name)
-                except (IntegrityError, ProgrammingError) as e:
-                    error_name = e.__class__.__name__
-                    self.logger.critical("import_files: There was a django '{}' error ingesting the courts data, '{}'"
-                                         .format(error_name, e.message))
-                    return False
-        # Set the ingestion status
-        DataStatus.objects.db_manager(database_name).create(data_hash=''.join(self.hashes(local_dir, filenames)))
-        return True
+            self.logger.info('import_files: Importing file {}/{}'.format(local_dir, filename))
+            # The courts are read from the file one at a time as they are
+            # ingested, rather than loading the whole file first
+            others = {}
+            def courts():
+                with io.open(courts_data_path, 'r', encoding='utf-8') as courtsfile:
+                    for key, value in JSONStream(courtsfile):
+                        if key == 'courts':
+                            yield value
+                        else:
+                            others[key] = value
+            # Import the data into the application
+            if diff:
+                counts = Ingest.courts_diff(courts(), database_name=database_name)
+                self.logger.info('import_files: {added} added, {changed} changed, '
+                                 '{removed} removed, {unchanged} unchanged courts'
+                                 .format(**counts))
+            elif workers > 1:
+                Ingest.courts_parallel(courts, workers, database_name=database_name)
+            else:
+                Ingest.courts(courts(), database_name=database_name)
+            Ingest.emergency_message(others['emergency_message'], database_name=database_name)
 
     @classmethod
     def hashes(cls, dir_path, filenames):
         """
         Generate a list of hashes of the specified
-        list of files in the directory
+        list of files in the directory. Files downloaded
+        from s3 and not touched since aren't read again,
+        they were hashed as they were downloaded.
 
         Args:
             data_dir(string): The directory containing the files
@@ -223,16 +339,21 @@ class Command(BaseCommand):
         Returns:
             (list): List of hashes of the files
         """ 
-        block_size = 65536
-        hasher = hashlib.md5()
+        state = read_s3_state(dir_path)
         hashes = []
         for filename in filenames:
+            path = dir_path + '/' + filename
+            recorded = state.get(filename)
+            if recorded and cls.is_recorded(path, recorded):
+                hashes.append(recorded['md5'])
+                continue
+            hasher = hashlib.md5()
             try:
-                with open(dir_path + '/' + filename, 'rb') as afile:
-                    buf = afile.read(block_size)
+                with open(path, 'rb') as afile:
+                    buf = afile.read(HASH_BLOCK_SIZE)
                     while len(buf) > 0:
                         hasher.update(buf)
-                        buf = afile.read(block_size)
+                        buf = afile.read(HASH_BLOCK_SIZE)
                 hashes.append(hasher.hexdigest())
             except (IOError, Exception):
                 hashes.append(None)
@@ -245,7 +366,10 @@ class Command(BaseCommand):
                   remote_dir,
                   files):
         """
-        Handle the importing of s3 files
+        Handle the importing of s3 files. A file is only downloaded if its
+        ETag has changed since the last download, and is hashed as it is
+        written, so an unchanged file costs one request and no reads. The
+        files whose contents changed are left in self.changed_files.
 
         Args:
             bucket_name: The name of the s3 bucket to import from
@@ -256,27 +380,81 @@ class Command(BaseCommand):
         Return:
             (bool): True if files downloaded successfully, false otherwise
         """
-        old_hashes = self.hashes(local_dir, files)
         s3 = boto3.resource('s3')
-        found_files = []
+        state = read_s3_state(local_dir)
+        self.changed_files = []
         for file in files:
             local_path = os.path.join(local_dir, file)
             remote_path = os.path.join(remote_dir, file)
+            known = state.get(file)
+            conditions = {}
+            # Only trust the last ETag while the local copy is the one it came with
+            if known and self.is_recorded(local_path, known):
+                conditions['IfNoneMatch'] = known['etag']
             self.logger.info("handle_s3: Attempting download of {} to {} "
                         "from bucket {}, ".format(remote_path, local_path, bucket_name))
 
             try:
-                s3.meta.client.download_file(bucket_name, remote_path, local_path)
+                s3_object = s3.meta.client.get_object(Bucket=bucket_name,
+                                                      Key=remote_path,
+                                                      **conditions)
             except botocore.exceptions.ClientError as e:
-                # Only catch the non-existing error
-                error_code = int(e.response['Error']['Code'])
-                if error_code == 404:
+                error_code = e.response['Error']['Code']
+                if error_code in ('304', 'NotModified'):
+                    self.logger.info("handle_s3: File {} is unchanged, ETag {}"
+                                     .format(file, known['etag']))
+                    continue
+                if error_code in ('404', 'NoSuchKey'):
                     self.logger.critical("handle_s3: File {} not found in bucket {}"
                                          .format(file, bucket_name))
                     return False
+                self.logger.critical("handle_s3: Failed to download file {} from bucket {}, '{}'"
+                                     .format(file, bucket_name, e))
+                return False
+
+            digest = self.download(s3_object['Body'], local_path)
+            previous = known['md5'] if known else self.hashes(local_dir, [file])[0]
+            if digest != previous:
+                self.changed_files.append(file)
+            state[file] = {
+                'etag': s3_object['ETag'],
+                'size': os.path.getsize(local_path),
+                'mtime': os.path.getmtime(local_path),
+                'md5': digest,
+            }
+            write_s3_state(local_dir, state)
 
         return True
 
+    @classmethod
+    def download(cls, body, local_path):
+        """
+        Stream an s3 object's body to local_path, replacing it only once the
+        download is complete
+
+        Returns:
+            (string): The MD5 of the downloaded file
+        """
+        digest = hashlib.md5()
+        partial_path = local_path + '.part'
+        with open(partial_path, 'wb') as afile:
+            for chunk in iter(lambda: body.read(HASH_BLOCK_SIZE), b''):
+                digest.update(chunk)
+                afile.write(chunk)
+        os.rename(partial_path, local_path)
+        return digest.hexdigest()
+
+    @classmethod
+    def is_recorded(cls, path, recorded):
+        """
+        Whether the file at path is still the one recorded in the s3 state
+        """
+        try:
+            return os.path.getsize(path) == recorded['size'] \
+                and os.path.getmtime(path) == recorded['mtime']
+        except OSError:
+            return False
+
 
     def setup_logging(self,
                       log_level='INFO',
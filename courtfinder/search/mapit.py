@@ -0,0 +1,108 @@
+"""
+HTTP client for MapIt.
+
+All MapIt requests go through one pooled keep-alive session per worker, with
+connect and read timeouts and a few retries on connection errors. A circuit
+breaker stops calling MapIt for a while after repeated 5xx, 429 or timeout
+failures, so a struggling MapIt can't tie up every worker.
+"""
+from threading import Lock
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+
+from django.conf import settings
+
+
+MAPIT_HEADERS = {'X-Api-Key': settings.MAPTI_API_KEY if settings.MAPTI_API_KEY else ''}
+
+
+class MapItUnavailable(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return self.value
+
+
+class CircuitBreaker(object):
+    """
+    Opens after `threshold` consecutive failures. Once `reset_timeout`
+    seconds have passed a single trial request is let through: if it
+    succeeds the breaker closes again, otherwise it stays open.
+    """
+
+    def __init__(self, threshold, reset_timeout):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.time() - self.opened_at >= self.reset_timeout:
+                # let this request through as the trial, and hold back
+                # everyone else until it has finished
+                self.opened_at = time.time()
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                self.opened_at = time.time()
+
+    def reset(self):
+        self.record_success()
+
+
+def _session():
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=settings.MAPIT_POOL_SIZE,
+                          max_retries=Retry(total=settings.MAPIT_RETRIES,
+                                            backoff_factor=0.1))
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+    s.headers.update(MAPIT_HEADERS)
+    return s
+
+
+session = _session()
+breaker = CircuitBreaker(settings.MAPIT_BREAKER_THRESHOLD,
+                         settings.MAPIT_BREAKER_RESET_TIMEOUT)
+
+
+def get(url):
+    """
+    GET a MapIt url. Raises MapItUnavailable without making a request while
+    the breaker is open, and when the request fails or times out.
+    """
+    if not breaker.allow():
+        raise MapItUnavailable('MapIt circuit breaker is open')
+
+    try:
+        r = session.get(url, timeout=(settings.MAPIT_CONNECT_TIMEOUT,
+                                      settings.MAPIT_READ_TIMEOUT))
+    except requests.RequestException as e:
+        breaker.record_failure()
+        raise MapItUnavailable('MapIt request failed: %s' % e)
+
+    if r.status_code >= 500 or r.status_code == 429:
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+    return r
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0015_facility_image_file_path'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourtDocument',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('slug', models.SlugField(unique=True, max_length=255)),
+                ('updated_at', models.DateTimeField(default=None, null=True)),
+                ('format_version', models.IntegerField(default=0)),
+                ('document', models.TextField()),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0016_courtdocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='court',
+            name='content_hash',
+            field=models.CharField(default=None, max_length=40, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='courtdocument',
+            name='content_hash',
+            field=models.CharField(default=None, max_length=40, null=True),
+            preserve_default=True,
+        ),
+    ]
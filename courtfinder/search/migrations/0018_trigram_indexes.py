@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+# The name and address search filters on UPPER(column::text) LIKE, as
+# Django's icontains does, so the indexes are on that expression
+TRIGRAM_INDEXES = (
+    ('search_court_name_trgm', 'search_court', 'name'),
+    ('search_courtaddress_address_trgm', 'search_courtaddress', 'address'),
+    ('search_town_name_trgm', 'search_town', 'name'),
+    ('search_town_county_trgm', 'search_town', 'county'),
+)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute('CREATE INDEX %s ON %s USING gin (UPPER(%s::text) gin_trgm_ops)'
+                              % (name, table, column))
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    for name, table, column in TRIGRAM_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS %s' % name)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('search', '0017_court_content_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
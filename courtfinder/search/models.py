@@ -31,6 +31,8 @@ class Court(models.Model):
     defence_leaflet = models.CharField(max_length=2500, null=True, default=None)
     prosecution_leaflet = models.CharField(max_length=2500, null=True, default=None)
     juror_leaflet = models.CharField(max_length=2500, null=True, default=None)
+    # hash of the court's entry in courts.json, to spot changed courts
+    content_hash = models.CharField(max_length=40, null=True, default=None)
 
 
     def postcodes_covered(self):
@@ -247,3 +249,17 @@ class EmergencyMessage(models.Model):
     def __unicode__(self):
         return self.message
 
+
+
+class CourtDocument(models.Model):
+    """
+    Denormalised JSON for a court's page, see search.documents
+    """
+    slug = models.SlugField(max_length=255, unique=True)
+    updated_at = models.DateTimeField(null=True, default=None)
+    content_hash = models.CharField(max_length=40, null=True, default=None)
+    format_version = models.IntegerField(default=0)
+    document = models.TextField()
+
+    def __unicode__(self):
+        return "Document for %s" % self.slug
@@ -0,0 +1,81 @@
+"""
+Cache of postcode lookups, in front of MapIt.
+
+Successful lookups are kept for POSTCODE_CACHE_TTL seconds and postcodes
+MapIt doesn't know for POSTCODE_CACHE_NEGATIVE_TTL seconds. The 'postcodes'
+entry in settings.CACHES picks the backend, so workers can share one cache.
+
+Hits and misses are counted in memory by each worker rather than in the
+cache, as counting there would mean two more cache writes per lookup, and
+only memcached increments atomically across processes.
+"""
+import re
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+_counts = {'hits': 0, 'misses': 0}
+_lock = Lock()
+
+
+def cache():
+    return caches['postcodes']
+
+
+def cache_key(postcode, full_postcode):
+    """
+    A full postcode without its spaces. Partial postcodes keep the split
+    between the outward code and the sector, as 'N1 9' and 'N19' differ,
+    as an underscore: memcached keys can't have spaces.
+    """
+    if full_postcode:
+        key = re.sub(r'[^A-Z0-9]', '', postcode.upper())
+    else:
+        key = '_'.join(re.sub(r'[^A-Z0-9 ]', '', postcode.upper()).split())
+    return 'postcode:%s:%s' % ('full' if full_postcode else 'partial', key)
+
+
+def _count(key):
+    with _lock:
+        _counts[key] += 1
+
+
+def get(postcode, full_postcode):
+    """
+    Returns (True, MapIt response) for a known postcode, (False, error message)
+    for one MapIt doesn't know, or None if the postcode isn't cached
+    """
+    entry = cache().get(cache_key(postcode, full_postcode))
+    _count('hits' if entry is not None else 'misses')
+    return entry
+
+
+def set_found(postcode, full_postcode, response):
+    cache().set(cache_key(postcode, full_postcode), (True, response),
+                settings.POSTCODE_CACHE_TTL)
+
+
+def set_unknown(postcode, full_postcode, message):
+    cache().set(cache_key(postcode, full_postcode), (False, message),
+                settings.POSTCODE_CACHE_NEGATIVE_TTL)
+
+
+def reset_stats():
+    with _lock:
+        _counts.update(hits=0, misses=0)
+
+
+def stats():
+    """
+    This worker's hits and misses since it started
+    """
+    with _lock:
+        hits, misses = _counts['hits'], _counts['misses']
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': round(float(hits) / total, 3) if total else None,
+    }
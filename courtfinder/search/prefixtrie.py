@@ -0,0 +1,42 @@
+"""
+Prefix trie for finding which keys are prefixes of a string.
+
+Each node is a dict of the next character to the child node, and holds the
+values of the keys ending there under END. Looking a string up walks it a
+character at a time, collecting the values on the way, so it takes
+O(len(string)) however many keys there are.
+"""
+
+
+END = ''
+
+
+class PrefixTrie(object):
+
+    def __init__(self, entries=()):
+        """
+        entries: (key, value) pairs
+        """
+        self._root = {}
+        for key, value in entries:
+            self.add(key, value)
+
+    def add(self, key, value):
+        node = self._root
+        for char in key:
+            node = node.setdefault(char, {})
+        node.setdefault(END, set()).add(value)
+
+    def prefixes_of(self, string):
+        """
+        The values of every key that string starts with, including an
+        empty key
+        """
+        values = set(self._root.get(END, ()))
+        node = self._root
+        for char in string:
+            node = node.get(char)
+            if node is None:
+                break
+            values.update(node.get(END, ()))
+        return values
@@ -0,0 +1,199 @@
+"""
+Publishing courts data by swapping PostgreSQL schemas.
+
+publish() loads new data into a schema of its own, courts_v<hash>_<time>,
+whose tables are copies of the search tables in public. Once the load has
+been validated, one transaction moves the live tables out of public into a
+retired schema and the new ones in. Queries running meanwhile wait for the
+swap rather than fail, and never see partly loaded data. Connections don't
+need to be dropped, as the table names they use don't change.
+
+Retired schemas are kept, newest first, for rollback(), which swaps one of
+them back in the same way. They aren't migrated, so don't roll back past a
+migration of the search app.
+"""
+from contextlib import contextmanager
+import time
+
+from django.apps import apps
+from django.conf import settings
+from django.db import connections, transaction
+
+from search.models import Court, CourtDocument, DataStatus
+
+
+SCHEMA_PREFIX = 'courts_v'
+
+
+class PublishError(Exception):
+    def __init__(self, value):
+        self.value = value
+    def __str__(self):
+        return self.value
+
+
+def tables():
+    return [model._meta.db_table for model in apps.get_app_config('search').get_models()]
+
+
+def schema_name(data_hash, timestamp):
+    return '%s%s_%s' % (SCHEMA_PREFIX, (data_hash or 'none')[:12], timestamp)
+
+
+def schemas(database_name="default"):
+    """
+    The retired and loading schemas, newest first
+    """
+    cursor = connections[database_name].cursor()
+    cursor.execute("SELECT nspname FROM pg_namespace WHERE nspname LIKE %s",
+                   [SCHEMA_PREFIX + '%'])
+    names = [row[0] for row in cursor.fetchall()]
+    return sorted(names, key=lambda name: name.rsplit('_', 1)[-1], reverse=True)
+
+
+def create_schema(schema, database_name="default"):
+    """
+    Create a schema with empty copies of the search tables, their indexes,
+    foreign keys and sequences, and the court documents, so they are only
+    rebuilt for courts that change
+    """
+    connection = connections[database_name]
+    qn = connection.ops.quote_name
+    with transaction.atomic(using=database_name):
+        cursor = connection.cursor()
+        cursor.execute("CREATE SCHEMA %s" % qn(schema))
+        foreign_keys = []
+        for table in tables():
+            new_table = '%s.%s' % (qn(schema), qn(table))
+            sequence = '%s.%s' % (qn(schema), qn(table + '_id_seq'))
+            cursor.execute("CREATE TABLE %s (LIKE public.%s INCLUDING ALL)" % (new_table, qn(table)))
+            # copied columns still default to the live tables' sequences
+            cursor.execute("CREATE SEQUENCE %s OWNED BY %s.id" % (sequence, new_table))
+            cursor.execute("SELECT setval(%s, nextval(pg_get_serial_sequence(%s, 'id')))",
+                           [sequence, 'public.' + table])
+            cursor.execute("ALTER TABLE %s ALTER COLUMN id SET DEFAULT nextval(%%s)" % new_table,
+                           [sequence])
+            cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                           "WHERE contype = 'f' AND conrelid = %s::regclass",
+                           ['public.' + table])
+            foreign_keys.extend((table, name, definition) for name, definition in cursor.fetchall())
+
+        # the definitions name tables without a schema, so point them at the new ones
+        cursor.execute("SET LOCAL search_path TO %s" % qn(schema))
+        for table, name, definition in foreign_keys:
+            cursor.execute("ALTER TABLE %s ADD CONSTRAINT %s %s" % (qn(table), qn(name), definition))
+        cursor.execute("SET LOCAL search_path TO public")
+
+        documents = qn(CourtDocument._meta.db_table)
+        cursor.execute("INSERT INTO %s.%s SELECT * FROM public.%s" % (qn(schema), documents, documents))
+
+
+def drop_schema(schema, database_name="default"):
+    cursor = connections[database_name].cursor()
+    cursor.execute("DROP SCHEMA IF EXISTS %s CASCADE" % connections[database_name].ops.quote_name(schema))
+
+
+@contextmanager
+def search_path(schema, database_name="default"):
+    """
+    Point the database's connections, including ones opened by forked
+    workers, at the schema's tables while loading it
+    """
+    connection = connections[database_name]
+    options = connection.settings_dict.get('OPTIONS', {})
+    connection.close()
+    connection.settings_dict['OPTIONS'] = dict(options, options='-c search_path=%s,public' % schema)
+    try:
+        yield
+    finally:
+        connection.close()
+        connection.settings_dict['OPTIONS'] = options
+
+
+def validate(database_name="default"):
+    """
+    Check the loaded schema before it goes live. Call inside search_path().
+    """
+    courts = Court.objects.using(database_name).count()
+    if not courts:
+        raise PublishError('No courts were loaded')
+
+    cursor = connections[database_name].cursor()
+    cursor.execute("SELECT count(*) FROM public.%s" % connections[database_name].ops.quote_name(
+        Court._meta.db_table))
+    live = cursor.fetchone()[0]
+    if courts < live * settings.PUBLISH_MIN_COURTS_RATIO:
+        raise PublishError('Only %d courts were loaded, against %d live' % (courts, live))
+
+    if not DataStatus.objects.using(database_name).exists():
+        raise PublishError('No data status was recorded')
+
+    slugs = Court.objects.using(database_name).values('slug').distinct().count()
+    if CourtDocument.objects.using(database_name).count() != slugs:
+        raise PublishError('Court documents are missing')
+
+
+def swap(schema, database_name="default"):
+    """
+    In one transaction, retire the live tables to a schema named after
+    their data and move the schema's tables into public. Returns the name
+    of the retired schema.
+    """
+    connection = connections[database_name]
+    qn = connection.ops.quote_name
+    live = DataStatus.objects.using(database_name) \
+        .order_by('-last_ingestion_date', '-pk').first()
+    if live is not None:
+        retired = schema_name(live.data_hash, live.last_ingestion_date.strftime('%Y%m%d%H%M%S'))
+    else:
+        retired = schema_name(None, time.strftime('%Y%m%d%H%M%S'))
+    if retired == schema:
+        raise PublishError('%s is already live' % schema)
+
+    with transaction.atomic(using=database_name):
+        cursor = connection.cursor()
+        # give up rather than hold up every query behind a long-running one
+        cursor.execute("SET LOCAL lock_timeout = %s", [settings.PUBLISH_LOCK_TIMEOUT])
+        cursor.execute("CREATE SCHEMA %s" % qn(retired))
+        for table in tables():
+            cursor.execute("ALTER TABLE public.%s SET SCHEMA %s" % (qn(table), qn(retired)))
+            cursor.execute("ALTER TABLE %s.%s SET SCHEMA public" % (qn(schema), qn(table)))
+        cursor.execute("DROP SCHEMA %s" % qn(schema))
+    return retired
+
+
+def prune(database_name="default"):
+    """
+    Drop all but the newest PUBLISH_KEEP_SCHEMAS schemas
+    """
+    for schema in schemas(database_name)[settings.PUBLISH_KEEP_SCHEMAS:]:
+        drop_schema(schema, database_name)
+
+
+def publish(load, data_hash, database_name="default"):
+    """
+    Run load() against a new schema, validate what it loaded and swap it
+    live. Returns the name of the schema the previous data was retired to.
+    """
+    schema = schema_name(data_hash, time.strftime('%Y%m%d%H%M%S'))
+    create_schema(schema, database_name)
+    try:
+        with search_path(schema, database_name):
+            load()
+            validate(database_name)
+        retired = swap(schema, database_name)
+    except Exception:
+        drop_schema(schema, database_name)
+        raise
+    prune(database_name)
+    return retired
+
+
+def rollback(schema, database_name="default"):
+    """
+    Put a retired schema's data back live, retiring the current data
+    """
+    available = schemas(database_name)
+    if schema not in available:
+        raise PublishError('There is no schema %s, there are: %s' % (schema, ', '.join(available)))
+    return swap(schema, database_name)
@@ -0,0 +1,110 @@
+"""
+Nearest court lookups.
+
+Courts are placed on the unit sphere and held in a k-d tree. Straight-line
+(chord) distance between points on the sphere grows with great-circle
+distance, so the nearest courts in the tree are the nearest on the ground.
+Distances are reported in miles, computed the same way as PostgreSQL's
+earthdistance `<@>` operator that the searches used before.
+"""
+from bisect import insort
+from math import asin, cos, radians, sin, sqrt
+
+import numpy
+
+
+EARTH_RADIUS_MILES = 3958.747716
+
+
+def distance_miles(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in miles, as `point(lon1, lat1) <@> point(lon2, lat2)`
+    """
+    lat1, lon1, lat2, lon2 = radians(lat1), radians(lon1), radians(lat2), radians(lon2)
+    sin_lat = sin(abs(lat1 - lat2) / 2)
+    sin_lon = sin(abs(lon1 - lon2) / 2)
+    sino = sqrt(sin_lat * sin_lat + cos(lat1) * cos(lat2) * sin_lon * sin_lon)
+    return 2 * EARTH_RADIUS_MILES * asin(min(sino, 1.0))
+
+
+def distances_miles(lat, lon, lats, lons):
+    """
+    distance_miles from one point to arrays of latitudes and longitudes,
+    in radians, at once. NaN coordinates give NaN distances.
+    """
+    lat, lon = radians(lat), radians(lon)
+    sin_lat = numpy.sin(numpy.abs(lats - lat) / 2)
+    sin_lon = numpy.sin(numpy.abs(lons - lon) / 2)
+    sino = numpy.sqrt(sin_lat * sin_lat + cos(lat) * numpy.cos(lats) * sin_lon * sin_lon)
+    return 2 * EARTH_RADIUS_MILES * numpy.arcsin(numpy.minimum(sino, 1.0))
+
+
+def to_xyz(lat, lon):
+    lat, lon = radians(lat), radians(lon)
+    return (cos(lat) * cos(lon), cos(lat) * sin(lon), sin(lat))
+
+
+def chord(miles):
+    """
+    Straight-line distance on the unit sphere for a great-circle distance
+    """
+    return 2 * sin(miles / (2 * EARTH_RADIUS_MILES))
+
+
+class SpatialIndex(object):
+    """
+    k-d tree over courts that have a position. Nodes are
+    (point, court, axis, left, right) tuples.
+    """
+
+    def __init__(self, courts):
+        points = [(to_xyz(c.lat, c.lon), c) for c in courts
+                  if c.lat is not None and c.lon is not None]
+        self.size = len(points)
+        self.root = self._build(points, 0)
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda p: p[0][axis])
+        median = len(points) // 2
+        point, court = points[median]
+        return (point, court, axis,
+                self._build(points[:median], depth + 1),
+                self._build(points[median + 1:], depth + 1))
+
+    def nearest(self, lat, lon, k):
+        """
+        The k nearest courts as (distance in miles, court) pairs, ordered by
+        distance and then name like the SQL proximity search
+        """
+        if self.root is None or k <= 0:
+            return []
+
+        target = to_xyz(lat, lon)
+        # entries are (miles, name, id, court), kept sorted and at most k long
+        best = []
+
+        def visit(node):
+            if node is None:
+                return
+            point, court, axis, left, right = node
+
+            miles = distance_miles(lat, lon, court.lat, court.lon)
+            entry = (miles, court.name, court.id, court)
+            if len(best) < k or entry < best[-1]:
+                insort(best, entry)
+                if len(best) > k:
+                    best.pop()
+
+            diff = target[axis] - point[axis]
+            near, far = (left, right) if diff < 0 else (right, left)
+            visit(near)
+            # courts at exactly the same distance as the worst kept one can
+            # still win on name, so the far side is searched on equality too
+            if len(best) < k or diff * diff <= chord(best[-1][0]) ** 2 + 1e-12:
+                visit(far)
+
+        visit(self.root)
+        return [(miles, court) for miles, _, _, court in best]
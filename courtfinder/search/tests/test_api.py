@@ -43,6 +43,12 @@ class SearchTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         self.assertIn('"name": "Accrington Magistrates\' Court"', response.content)
 
+    def test_misspelt_address_search(self):
+        c = Client()
+        response = c.get('/search/results.json?q=Acrington+magistrats')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('"name": "Accrington Magistrates\' Court"', response.content)
+
     def test_no_aol(self):
         c = Client()
         response = c.get('/search/results.json?postcode=SE15')
@@ -0,0 +1,152 @@
+from collections import OrderedDict
+import json
+
+from django.conf import settings
+from django.test import TestCase
+from django.test.utils import override_settings
+from mock import patch
+
+from search import catalogue
+from search.court_search import CourtSearch
+from search.ingest import Ingest
+from search.models import (Court, AreaOfLaw, CourtAreaOfLaw, CourtLocalAuthorityAreaOfLaw,
+                           CourtPostcode, DataStatus, LocalAuthority)
+
+
+class CatalogueTestCase(TestCase):
+
+    def setUp(self):
+        test_data_dir = settings.PROJECT_ROOT + '/data/test_data/'
+        courts_json_1 = open(test_data_dir + 'courts.json').read()
+        imports = json.loads(courts_json_1)
+        Ingest.courts(imports['courts'])
+        Ingest.emergency_message(imports['emergency_message'])
+        DataStatus.objects.create(data_hash='415d49233b8592cf5195b33f0eddbdc86cebc72f2d575d392e941a53c085281a')
+
+    def test_loads_all_courts(self):
+        c = catalogue.get_catalogue()
+        self.assertEqual(len(c.courts), Court.objects.count())
+
+    def test_court_by_slug(self):
+        court = catalogue.get_catalogue().court_by_slug('accrington-magistrates-court')
+        self.assertEqual(court.name, "Accrington Magistrates' Court")
+        self.assertIsNone(catalogue.get_catalogue().court_by_slug('no-such-court'))
+
+    def test_relations_match_database(self):
+        c = catalogue.get_catalogue()
+        court = Court.objects.get(slug='accrington-magistrates-court')
+        self.assertEqual(list(c.areas_of_law_for(court.id)),
+                         list(court.areas_of_law.all().order_by('name')))
+        self.assertEqual(list(c.court_types[court.id]),
+                         [ct.court_type.name for ct in court.courtcourttype_set.all().order_by('pk')])
+        self.assertEqual(len(c.addresses[court.id]), court.courtaddress_set.count())
+
+    def test_snapshot_reused_without_queries(self):
+        catalogue.get_catalogue()
+        with self.assertNumQueries(0):
+            catalogue.get_catalogue()
+
+    @override_settings(CATALOGUE_CHECK_INTERVAL=0)
+    def test_reloaded_when_data_changes(self):
+        first = catalogue.get_catalogue()
+        self.assertIs(catalogue.get_catalogue(), first)
+        DataStatus.objects.create(data_hash='new-data')
+        self.assertIsNot(catalogue.get_catalogue(), first)
+
+    def test_invalidated_by_ingest(self):
+        first = catalogue.get_catalogue()
+        Ingest.courts([])
+        self.assertEqual(len(catalogue.get_catalogue().courts), 0)
+        self.assertIsNot(catalogue.get_catalogue(), first)
+
+    def test_nearest_only_courts_with_area_of_law(self):
+        c = catalogue.get_catalogue()
+        money_claims = c.area_of_law('Money claims')
+        results = c.nearest(1.0, 1.0, money_claims.id)
+        self.assertTrue(all(c.has_area_of_law(r.id, money_claims.id) for r in results))
+        self.assertTrue(all(r.displayed for r in results))
+        self.assertNotIn('Some old closed court', [r.name for r in results])
+
+    def test_nearest_breaks_ties_on_name(self):
+        results = catalogue.get_catalogue().nearest(1.0, 1.0)
+        at_same_place = [r.name for r in results if r.distance == 0]
+        self.assertEqual(at_same_place, sorted(at_same_place))
+        self.assertEqual([r.distance for r in results], sorted(r.distance for r in results))
+
+    def test_nearest_returns_copies(self):
+        c = catalogue.get_catalogue()
+        result = c.nearest(1.0, 1.0)[0]
+        self.assertFalse(hasattr(c.court(result.id), 'distance'))
+
+    def test_order_by_distance(self):
+        c = catalogue.get_catalogue()
+        tameside = c.court_by_slug('tameside-magistrates-court')
+        accrington = c.court_by_slug('accrington-magistrates-court')
+        # Manchester
+        results = c.order_by_distance(53.48, -2.24, [accrington, tameside, accrington])
+        self.assertEqual([r.id for r in results], [tameside.id, accrington.id])
+        self.assertAlmostEqual(results[0].distance, 5.68, places=2)
+
+    def test_text_search_by_prefix(self):
+        results = catalogue.get_catalogue().text_search('accr magis')
+        self.assertEqual(results[0].slug, 'accrington-magistrates-court')
+
+    @override_settings(FEATURE_INVERTED_INDEX_ENABLED=False)
+    def test_text_search_matches_database_search(self):
+        c = catalogue.get_catalogue()
+        for query in ('Accrington', 'magistrates court', 'Road', 'Some old', 'ample2'):
+            self.assertEqual([court.id for court in c.text_search(query)],
+                             [court.id for court in CourtSearch(query=query).get_courts()])
+
+    def test_fuzzy_search_corrects_typos(self):
+        c = catalogue.get_catalogue()
+        results = c.fuzzy_search('Acrington magistrats')
+        self.assertEqual(results[0].slug, 'accrington-magistrates-court')
+        # known words and prefixes are left alone
+        self.assertEqual(c.fuzzy_search('Tameside magistrats')[0].slug, 'tameside-magistrates-court')
+        self.assertEqual(c.fuzzy_search('Xyzzy'), [])
+        self.assertEqual(c.fuzzy_search(''), [])
+
+    def test_fuzzy_search_is_bounded(self):
+        c = catalogue.get_catalogue()
+        with patch.object(c, 'text_search', wraps=c.text_search) as text_search:
+            # repeated words are only corrected once
+            results = c.fuzzy_search(' '.join(['acrington'] * 20))
+            self.assertEqual(results[0].slug, 'accrington-magistrates-court')
+            self.assertEqual(text_search.call_count, 1)
+            text_search.reset_mock()
+            self.assertEqual(c.fuzzy_search('acrington magistrats tamside manchestr'), [])
+            self.assertEqual(text_search.call_count, 0)
+            self.assertEqual(c.fuzzy_search('acrington tamside', max_queries=2), [])
+            self.assertLessEqual(text_search.call_count, 2)
+
+    def test_courts_covering_matches_database(self):
+        court = Court.objects.get(slug='tameside-magistrates-court')
+        CourtPostcode.objects.create(court=court, postcode='SW1H')
+        CourtPostcode.objects.create(court=court, postcode='SE1')
+        catalogue.invalidate()
+        c = catalogue.get_catalogue()
+        for postcode in ('SW1H 9AJ', 'sw1h9aj', 'SW1H', 'SE15 4UH', 'N1 1AA'):
+            for area_of_law in c.areas_of_law.values():
+                expected = CourtPostcode.objects \
+                    .filter(court__areas_of_law=area_of_law) \
+                    .extra(where=["%s LIKE lower(postcode) || '%%'"],
+                           params=[postcode.lower().replace(' ', '')]) \
+                    .distinct('court')
+                self.assertEqual([court.id for court in c.courts_covering(postcode, area_of_law.id)],
+                                 sorted(p.court_id for p in expected))
+
+    def test_routed_courts_match_database(self):
+        c = catalogue.get_catalogue()
+        self.assertTrue(c.routes)
+        for local_authority in LocalAuthority.objects.all():
+            for area_of_law in AreaOfLaw.objects.all():
+                covering = [row.court for row in CourtLocalAuthorityAreaOfLaw.objects.filter(
+                    area_of_law=area_of_law, local_authority=local_authority).order_by('pk')]
+                self.assertEqual(c.routed_courts([local_authority.id], area_of_law.id),
+                                 list(OrderedDict.fromkeys(covering)))
+                spoe = [row.court for row in CourtAreaOfLaw.objects.filter(
+                    area_of_law=area_of_law, single_point_of_entry=True)]
+                self.assertEqual(
+                    set(c.routed_courts([local_authority.id], area_of_law.id, single_point_of_entry=True)),
+                    set(court for court in covering if court in spoe))
@@ -0,0 +1,74 @@
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.test import TestCase, Client
+
+from search import catalogue, documents
+from search.ingest import Ingest
+from search.models import Court, CourtDocument
+
+
+class DocumentsTestCase(TestCase):
+
+    def setUp(self):
+        test_data_dir = settings.PROJECT_ROOT + '/data/test_data/'
+        courts_json_1 = open(test_data_dir + 'courts.json').read()
+        self.imports = json.loads(courts_json_1)
+        Ingest.courts(self.imports['courts'])
+        caches['pages'].clear()
+
+    def tearDown(self):
+        caches['pages'].clear()
+
+    def test_document_per_court(self):
+        self.assertEqual(set(CourtDocument.objects.values_list('slug', flat=True)),
+                         set(Court.objects.values_list('slug', flat=True)))
+
+    def test_document_matches_catalogue(self):
+        c = catalogue.get_catalogue()
+        court = c.court_by_slug('accrington-magistrates-court')
+        self.assertEqual(c.document(court.slug),
+                         json.loads(json.dumps(documents.court_document(court, c))))
+        self.assertEqual(c.document(court.slug)['postal_address']['type']['name'], 'Postal')
+        self.assertNotIn('image_url', c.document(court.slug))
+
+    def test_unchanged_courts_not_rebuilt(self):
+        self.assertEqual(documents.build(), 0)
+
+    def test_courts_without_content_hash_rebuilt_by_updated_at(self):
+        Court.objects.update(content_hash=None)
+        c = catalogue.CourtCatalogue(None)
+        with_updated_at = len([court for court in c.by_slug.values() if court.updated_at])
+        self.assertTrue(with_updated_at > 0)
+        self.assertEqual(documents.build(), len(c.by_slug) - with_updated_at)
+
+    def test_old_format_rebuilt(self):
+        CourtDocument.objects.update(format_version=documents.FORMAT_VERSION - 1)
+        c = catalogue.CourtCatalogue(None)
+        self.assertEqual(c.documents, {})
+        self.assertEqual(documents.build(), len(c.by_slug))
+
+    def test_built_in_batches_like_catalogue(self):
+        stored = dict(CourtDocument.objects.values_list('slug', 'document'))
+        CourtDocument.objects.all().delete()
+        self.assertEqual(documents.build(batch_size=2), len(stored))
+        self.assertEqual(dict(CourtDocument.objects.values_list('slug', 'document')), stored)
+        c = catalogue.CourtCatalogue(None)
+        for slug, court in c.by_slug.items():
+            self.assertEqual(json.loads(stored[slug]),
+                             json.loads(json.dumps(documents.court_document(court, c))))
+
+    def test_documents_of_removed_courts_dropped(self):
+        Ingest.courts(self.imports['courts'][:1])
+        self.assertEqual(list(CourtDocument.objects.values_list('slug', flat=True)),
+                         [self.imports['courts'][0]['slug']])
+
+    def test_court_page_from_document(self):
+        CourtDocument.objects.filter(slug='tameside-magistrates-court').update(
+            document=json.dumps(dict(
+                json.loads(CourtDocument.objects.get(slug='tameside-magistrates-court').document),
+                name='Tameside from its document')))
+        catalogue.invalidate()
+        response = Client().get('/courts/tameside-magistrates-court')
+        self.assertIn('Tameside from its document', response.content)
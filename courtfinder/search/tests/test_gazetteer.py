@@ -0,0 +1,102 @@
+import os
+import shutil
+import tempfile
+
+from mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from search import catalogue, gazetteer
+from search.court_search import Postcode
+from search.models import LocalAuthority
+
+
+class GazetteerTestCase(TestCase):
+
+    records = [
+        ('SE15 4UH', 51.46894, -0.06623, u'Southwark Borough Council'),
+        ('SE15 4UG', 51.46900, -0.06700, u'Southwark Borough Council'),
+        ('SE1 7TP', 51.50100, -0.11800, u'Lambeth Borough Council'),
+        ('N1 9GU', 51.53400, -0.12300, u'Islington Borough Council'),
+        ('GY1 1AJ', 49.45500, -2.53600, None),
+    ]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'gazetteer.bin')
+        gazetteer.write(self.path, self.records)
+        self.gazetteer = gazetteer.Gazetteer(self.path)
+
+    def tearDown(self):
+        self.gazetteer.close()
+        shutil.rmtree(self.dir)
+
+    def test_normalise(self):
+        self.assertEqual(gazetteer.normalise('se15 4uh'), 'SE154UH')
+        self.assertEqual(gazetteer.normalise('N19GU'), 'N1  9GU')
+        self.assertIsNone(gazetteer.normalise('SE15'))
+
+    def test_find(self):
+        lat, lon, authority = self.gazetteer.find('SE154UH')
+        self.assertAlmostEqual(lat, 51.46894, places=4)
+        self.assertAlmostEqual(lon, -0.06623, places=4)
+        self.assertEqual(authority, 'Southwark Borough Council')
+
+    def test_find_missing(self):
+        self.assertIsNone(self.gazetteer.find('SW1A 1AA'))
+
+    def test_find_partial_is_centroid(self):
+        lat, lon = self.gazetteer.find_partial('SE15')
+        self.assertAlmostEqual(lat, 51.46897, places=4)
+        self.assertAlmostEqual(lon, -0.066615, places=4)
+
+    def test_find_partial_does_not_match_longer_outcode(self):
+        lat, lon = self.gazetteer.find_partial('SE1')
+        self.assertAlmostEqual(lat, 51.501, places=4)
+
+    def test_backend_without_local_authority(self):
+        backend = gazetteer.GazetteerBackend(self.path)
+        self.assertIsNone(backend.lookup('GY1 1AJ', True))
+
+    def test_postcode_uses_backend_before_mapit(self):
+        backend = gazetteer.GazetteerBackend(self.path)
+        with patch('search.court_search.lookup_backend', return_value=backend), \
+                patch('search.court_search.Postcode.mapit') as mapit:
+            p = Postcode('SE15 4UH')
+            self.assertFalse(mapit.called)
+            self.assertAlmostEqual(p.latitude, 51.46894, places=4)
+
+    def test_postcode_falls_back_to_mapit(self):
+        backend = gazetteer.GazetteerBackend(self.path)
+        with patch('search.court_search.lookup_backend', return_value=backend), \
+                patch('search.court_search.Postcode.mapit') as mapit:
+            mapit.return_value = {'wgs84_lat': 51.501, 'wgs84_lon': -0.141}
+            p = Postcode('SW1A')
+            self.assertTrue(mapit.called)
+            self.assertEqual(p.latitude, 51.501)
+
+    def test_two_tier_postcode_uses_county(self):
+        onspd = os.path.join(self.dir, 'onspd.csv')
+        with open(onspd, 'w') as f:
+            f.write('pcd,doterm,oscty,oslaua,lat,long\n'
+                    'GU34 1HD,,E10000014,E07000085,51.14800,-0.97500\n'
+                    'SE15 4UH,,E99999999,E09000028,51.46894,-0.06623\n')
+        names = os.path.join(self.dir, 'names.csv')
+        with open(names, 'w') as f:
+            f.write('E10000014,Hampshire County Council\n'
+                    'E07000085,East Hampshire District Council\n'
+                    'E09000028,Southwark Borough Council\n')
+        path = os.path.join(self.dir, 'onspd.bin')
+        call_command('build-gazetteer', onspd, output=path, authority_names=names)
+
+        hampshire = LocalAuthority.objects.create(name='Hampshire County Council')
+        southwark = LocalAuthority.objects.create(name='Southwark Borough Council')
+        catalogue.invalidate()
+        backend = gazetteer.GazetteerBackend(path)
+        with patch('search.court_search.lookup_backend', return_value=backend), \
+                patch('search.court_search.Postcode.mapit') as mapit:
+            self.assertEqual(Postcode('GU34 1HD').local_authority, hampshire)
+            self.assertEqual(Postcode('SE15 4UH').local_authority, southwark)
+            self.assertFalse(mapit.called)
+        backend.gazetteer.close()
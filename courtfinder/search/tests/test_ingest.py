@@ -0,0 +1,199 @@
+import copy
+import json
+from multiprocessing import Pipe, Process
+import resource
+
+from django.conf import settings
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from search.ingest import Ingest, BulkIngest
+from search.models import *
+
+
+class IngestTestCase(TestCase):
+
+    def setUp(self):
+        test_data_dir = settings.PROJECT_ROOT + '/data/test_data/'
+        self.courts = json.loads(open(test_data_dir + 'courts.json').read())['courts']
+
+    def copies(self, n):
+        courts = []
+        for i in range(n):
+            for court_obj in copy.deepcopy(self.courts):
+                court_obj['slug'] = '%s-%d' % (court_obj['slug'], i)
+                courts.append(court_obj)
+        return courts
+
+    def load(self, courts):
+        loader = BulkIngest()
+        for court_obj in courts:
+            loader.add(court_obj)
+        with CaptureQueriesContext(connection) as queries:
+            loader.flush()
+        return len(queries)
+
+    def test_queries_do_not_grow_with_courts(self):
+        one = self.load(self.copies(1))
+        Ingest.courts([])
+        three = self.load(self.copies(3))
+        self.assertEqual(one, three)
+        self.assertEqual(Court.objects.count(), 3 * len(self.courts))
+
+    def test_lookups_deduplicated(self):
+        Ingest.courts(self.copies(2))
+        names = set(aol['name'] for court in self.courts for aol in court['areas_of_law'])
+        self.assertEqual(AreaOfLaw.objects.count(), len(names))
+        self.assertEqual(OpeningTime.objects.count(),
+                         len(set(o for court in self.courts for o in court['opening_times'])))
+
+    def test_relations_loaded(self):
+        Ingest.courts(self.courts)
+        for court_obj in self.courts:
+            court = Court.objects.get(slug=court_obj['slug'])
+            self.assertEqual(court.courtcontact_set.count(), len(court_obj['contacts']))
+            self.assertEqual(court.courtpostcode_set.count(), len(court_obj['postcodes']))
+            self.assertEqual(sorted(court.courtcourttype_set.values_list('court_type__name', flat=True)),
+                             sorted(court_obj['court_types']))
+            self.assertEqual(court.parking is not None, bool(court_obj.get('parking')))
+
+    def test_lookups_reused_between_batches(self):
+        loader = BulkIngest(batch_size=2)
+        for court_obj in self.copies(2):
+            loader.add(court_obj)
+        loader.flush()
+        self.assertEqual(CourtType.objects.count(),
+                         len(set(t for court in self.courts for t in court['court_types'])))
+
+    def test_diff_leaves_unchanged_courts(self):
+        Ingest.courts(self.courts)
+        ids = set(Court.objects.values_list('id', flat=True))
+        counts = Ingest.courts_diff(self.courts)
+        self.assertEqual(counts, {'added': 0, 'changed': 0, 'removed': 0,
+                                  'unchanged': len(self.courts)})
+        self.assertEqual(set(Court.objects.values_list('id', flat=True)), ids)
+
+    def test_diff_rewrites_changed_courts(self):
+        Ingest.courts(self.courts)
+        before = dict(Court.objects.values_list('slug', 'id'))
+        courts = copy.deepcopy(self.courts)
+        courts[0]['opening_times'] = ['Open all hours']
+        removed = courts.pop()
+        counts = Ingest.courts_diff(courts)
+        self.assertEqual((counts['changed'], counts['removed'], counts['added']), (1, 1, 0))
+
+        after = dict(Court.objects.values_list('slug', 'id'))
+        self.assertNotIn(removed['slug'], after)
+        self.assertNotEqual(after[courts[0]['slug']], before[courts[0]['slug']])
+        self.assertEqual(after[courts[1]['slug']], before[courts[1]['slug']])
+        court = Court.objects.get(slug=courts[0]['slug'])
+        self.assertEqual([o.description for o in court.opening_times.all()], ['Open all hours'])
+        self.assertEqual(court.courtcontact_set.count(), len(courts[0]['contacts']))
+
+    def test_diff_with_repeated_identity_matches_full_ingest(self):
+        courts = copy.deepcopy(self.courts)
+        repeated = copy.deepcopy(courts[0])
+        repeated['name'] = 'Repeated court'
+        courts.append(repeated)
+        Ingest.courts(courts)
+        ids = set(Court.objects.values_list('id', flat=True))
+        counts = Ingest.courts_diff(courts)
+        self.assertEqual(counts, {'added': 0, 'changed': 0, 'removed': 0,
+                                  'unchanged': len(courts)})
+        self.assertEqual(set(Court.objects.values_list('id', flat=True)), ids)
+
+        counts = Ingest.courts_diff(courts[:-1])
+        self.assertEqual((counts['removed'], counts['unchanged']), (1, len(self.courts)))
+        self.assertEqual(Court.objects.filter(slug=courts[0]['slug']).count(), 1)
+        self.assertFalse(Court.objects.filter(name='Repeated court').exists())
+
+        counts = Ingest.courts_diff(courts + [repeated])
+        self.assertEqual(counts['added'], 2)
+        self.assertEqual(Court.objects.filter(name='Repeated court').count(), 2)
+
+    def test_diff_removes_unused_lookups(self):
+        Ingest.courts(self.courts)
+        courts = copy.deepcopy(self.courts)
+        courts[0]['opening_times'] = ['Open all hours']
+        Ingest.courts_diff(courts)
+        self.assertEqual(set(OpeningTime.objects.values_list('description', flat=True)),
+                         set(o for court in courts for o in court['opening_times']))
+
+
+class ParallelIngestTestCase(TransactionTestCase):
+    """
+    The workers use their own connections, so they need data that is
+    really committed
+    """
+
+    def setUp(self):
+        test_data_dir = settings.PROJECT_ROOT + '/data/test_data/'
+        self.courts = json.loads(open(test_data_dir + 'courts.json').read())['courts']
+
+    def snapshot(self):
+        return sorted(
+            (court.slug, court.content_hash,
+             sorted(court.courtcontact_set.values_list('contact__name', 'contact__number')),
+             sorted(court.areas_of_law.values_list('name', flat=True)),
+             court.courtpostcode_set.count())
+            for court in Court.objects.all())
+
+    def test_same_result_as_serial_ingest(self):
+        Ingest.courts(self.courts)
+        serial = self.snapshot()
+        Ingest.courts_parallel(lambda: iter(self.courts), 2)
+        self.assertEqual(self.snapshot(), serial)
+        self.assertEqual(AreaOfLaw.objects.count(),
+                         len(set((a['name'], a['external_link'], a['external_link_desc'])
+                                 for court in self.courts for a in court['areas_of_law'])))
+
+
+class IngestMemoryTestCase(TransactionTestCase):
+    """
+    Each ingest runs in a child process, as a process's peak memory can't
+    be reset, so it needs data that is really committed too
+    """
+
+    def setUp(self):
+        test_data_dir = settings.PROJECT_ROOT + '/data/test_data/'
+        self.courts = json.loads(open(test_data_dir + 'courts.json').read())['courts']
+
+    def copies(self, n):
+        for i in range(n):
+            for court_obj in self.courts:
+                court_obj = copy.deepcopy(court_obj)
+                court_obj['slug'] = '%s-%d' % (court_obj['slug'], i)
+                yield court_obj
+
+    def peak_growth(self, n):
+        """
+        How far the peak resident memory of a process grows, in kilobytes,
+        ingesting n copies of the test courts, generated as they are read
+        """
+        for c in connections.all():
+            c.close()
+        reader, writer = Pipe(duplex=False)
+
+        def ingest():
+            try:
+                start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                Ingest.courts(self.copies(n))
+                writer.send(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - start)
+            except Exception as e:
+                writer.send(e)
+
+        process = Process(target=ingest)
+        process.start()
+        growth = reader.recv()
+        process.join()
+        if isinstance(growth, Exception):
+            raise growth
+        self.assertEqual(Court.objects.count(), n * len(self.courts))
+        return growth
+
+    def test_peak_memory_flat_in_number_of_courts(self):
+        small = self.peak_growth(40)
+        large = self.peak_growth(400)
+        # holding every court at once would take tens of megabytes more
+        self.assertLess(large - small, 8 * 1024)
@@ -0,0 +1,54 @@
+import io
+import json
+
+from django.conf import settings
+from django.test import SimpleTestCase
+
+from search.jsonstream import JSONStream
+
+
+class JSONStreamTestCase(SimpleTestCase):
+
+    def setUp(self):
+        test_data_dir = settings.PROJECT_ROOT + '/data/test_data/'
+        self.text = io.open(test_data_dir + 'courts.json', encoding='utf-8').read()
+        self.data = json.loads(self.text)
+
+    def stream(self, text, chunk_size=1024):
+        return JSONStream(io.StringIO(text), chunk_size)
+
+    def test_yields_courts_one_at_a_time(self):
+        for chunk_size in (1, 7, 1024, len(self.text) + 1):
+            members = list(self.stream(self.text, chunk_size))
+            self.assertEqual([v for k, v in members if k == 'courts'], self.data['courts'])
+            self.assertEqual([v for k, v in members if k == 'emergency_message'],
+                             [self.data['emergency_message']])
+
+    def test_scalars_and_empty_arrays(self):
+        members = list(self.stream(u'{"a": 12345, "b": [], "c": [1, 2.5], "d": {"e": null}}', 2))
+        self.assertEqual(members, [('a', 12345), ('c', 1), ('c', 2.5), ('d', {'e': None})])
+
+    def test_numbers_split_between_chunks(self):
+        text = u'{"a": [123456789, 1.5e10, -0.25, 2E-3, 7], "b": 42, "c": -1.0}'
+        expected = list(json.loads(text)['a'])
+        for chunk_size in range(1, len(text) + 1):
+            members = list(self.stream(text, chunk_size))
+            self.assertEqual(members, [('a', v) for v in expected] + [('b', 42), ('c', -1.0)])
+
+    def test_truncated_file(self):
+        with self.assertRaises(ValueError):
+            list(self.stream(u'{"courts": [{"name": "Accrington"}, ', 4))
+
+    def test_peak_memory_flat_in_number_of_courts(self):
+        def peak(copies):
+            text = json.dumps({'courts': self.data['courts'] * copies,
+                               'emergency_message': self.data['emergency_message']}).decode('utf-8')
+            stream = self.stream(text)
+            count = len([k for k, v in stream if k == 'courts'])
+            self.assertEqual(count, len(self.data['courts']) * copies)
+            return stream.peak_buffer, len(text)
+
+        small, _ = peak(10)
+        large, size = peak(500)
+        self.assertEqual(small, large)
+        self.assertTrue(large < size / 100)
@@ -2,9 +2,11 @@ import json
 import re
 
 import mock
+import requests
 
 from django.test import TestCase, Client
 
+from search import mapit, postcode_cache
 from search.court_search import Postcode, CourtSearchInvalidPostcode, CourtSearchError
 
 
@@ -46,16 +48,20 @@ class PostcodeTestCase(TestCase):
     nowhere_postcode = 'GY1 1AJ'
 
     def setUp(self):
-        self.patcher = mock.patch('requests.get', mock.Mock(side_effect=self._get_from_mapit_mock))
+        postcode_cache.cache().clear()
+        postcode_cache.reset_stats()
+        mapit.breaker.reset()
+        self.mock_get = mock.Mock(side_effect=self._get_from_mapit_mock)
+        self.patcher = mock.patch('search.mapit.session.get', self.mock_get)
         self.patcher.start()
 
     def tearDown(self):
         self.patcher.stop()
 
-    def _get_from_mapit_mock( self, url, headers ):
+    def _get_from_mapit_mock( self, url, timeout ):
         mock_response = MockResponse()
 
-        if url.endswith('SE15'):
+        if url.endswith('SE15') or url.endswith('N19'):
             mock_response.text =  PostcodeTestCase.mock_mapit_partial
         elif url.endswith('SE15 4UH'):
             mock_response.text =  PostcodeTestCase.mock_mapit_full
@@ -94,3 +100,59 @@ class PostcodeTestCase(TestCase):
     def test_nowhere_postcode(self):
         with self.assertRaises(CourtSearchInvalidPostcode):
             p = Postcode(self.nowhere_postcode)
+
+    def test_lookup_is_cached(self):
+        Postcode(self.full_postcode)
+        p = Postcode(self.full_postcode)
+        self.assertEqual(self.mock_get.call_count, 1)
+        self.assertEqual(p.latitude, 51.468945906164286)
+
+    def test_outward_code_and_sector_cached_separately(self):
+        Postcode('N19')
+        self.assertRaises(CourtSearchInvalidPostcode, Postcode, 'N1 9')
+        self.assertEqual(self.mock_get.call_count, 2)
+        self.assertNotEqual(postcode_cache.cache_key('N19', False),
+                            postcode_cache.cache_key('n1  9', False))
+        self.assertEqual(postcode_cache.cache_key('SE1 5', False), 'postcode:partial:SE1_5')
+
+    def test_full_and_partial_cached_separately(self):
+        Postcode(self.full_postcode)
+        Postcode(self.partial_postcode)
+        self.assertEqual(self.mock_get.call_count, 2)
+
+    def test_unknown_postcode_is_cached(self):
+        self.assertRaises(CourtSearchInvalidPostcode, Postcode, self.broken_postcode)
+        self.assertRaises(CourtSearchInvalidPostcode, Postcode, self.broken_postcode)
+        self.assertEqual(self.mock_get.call_count, 1)
+
+    def test_service_error_is_not_cached(self):
+        self.assertRaises(CourtSearchError, Postcode, 'Service Down')
+        self.assertRaises(CourtSearchError, Postcode, 'Service Down')
+        self.assertEqual(self.mock_get.call_count, 2)
+
+    def test_cache_stats(self):
+        Postcode(self.full_postcode)
+        Postcode(self.full_postcode)
+        stats = postcode_cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+
+    def test_breaker_opens_after_consecutive_failures(self):
+        for i in range(mapit.breaker.threshold):
+            self.assertRaises(CourtSearchError, Postcode, 'Service Down')
+        calls = self.mock_get.call_count
+        self.assertRaises(CourtSearchError, Postcode, self.broken_postcode)
+        self.assertEqual(self.mock_get.call_count, calls)
+
+    def test_breaker_open_falls_back_to_cached_outcode(self):
+        Postcode(self.partial_postcode)
+        for i in range(mapit.breaker.threshold):
+            mapit.breaker.record_failure()
+        p = Postcode(self.full_postcode)
+        self.assertTrue(p.partial_postcode)
+        self.assertIsNone(p.local_authority)
+        self.assertEqual(p.latitude, 51.47263752259685)
+
+    def test_timeout_raises_search_error(self):
+        self.mock_get.side_effect = requests.Timeout('read timed out')
+        self.assertRaises(CourtSearchError, Postcode, self.full_postcode)
@@ -0,0 +1,23 @@
+from django.test import SimpleTestCase
+
+from search.prefixtrie import PrefixTrie
+
+
+class PrefixTrieTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.trie = PrefixTrie([('se1', 1), ('se15', 2), ('se154uh', 3),
+                                ('sw1', 4), ('se15', 5)])
+
+    def test_every_prefix_matches(self):
+        self.assertEqual(self.trie.prefixes_of('se154uh'), set([1, 2, 3, 5]))
+        self.assertEqual(self.trie.prefixes_of('se151aa'), set([1, 2, 5]))
+        self.assertEqual(self.trie.prefixes_of('se1'), set([1]))
+
+    def test_longer_keys_do_not_match(self):
+        self.assertEqual(self.trie.prefixes_of('se'), set())
+        self.assertEqual(self.trie.prefixes_of(''), set())
+
+    def test_empty_key_matches_everything(self):
+        self.trie.add('', 6)
+        self.assertEqual(self.trie.prefixes_of('n1'), set([6]))
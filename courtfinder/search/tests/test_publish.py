@@ -0,0 +1,46 @@
+import json
+
+from django.conf import settings
+from django.test import TransactionTestCase
+
+from search import publish
+from search.ingest import Ingest
+from search.models import Court, DataStatus
+
+
+class PublishTestCase(TransactionTestCase):
+
+    def setUp(self):
+        test_data_dir = settings.PROJECT_ROOT + '/data/test_data/'
+        self.courts = json.loads(open(test_data_dir + 'courts.json').read())['courts']
+        Ingest.courts(self.courts[:1])
+        DataStatus.objects.create(data_hash='old')
+
+    def tearDown(self):
+        for schema in publish.schemas():
+            publish.drop_schema(schema)
+
+    def load(self, courts):
+        def load():
+            Ingest.courts(courts)
+            DataStatus.objects.create(data_hash='new')
+        return load
+
+    def test_publish_swaps_data_in(self):
+        retired = publish.publish(self.load(self.courts), 'new')
+        self.assertEqual(Court.objects.count(), len(self.courts))
+        self.assertEqual(DataStatus.objects.get().data_hash, 'new')
+        self.assertEqual(publish.schemas(), [retired])
+
+    def test_failed_validation_leaves_live_data(self):
+        with self.assertRaises(publish.PublishError):
+            publish.publish(self.load([]), 'new')
+        self.assertEqual(Court.objects.count(), 1)
+        self.assertEqual(DataStatus.objects.get().data_hash, 'old')
+        self.assertEqual(publish.schemas(), [])
+
+    def test_rollback(self):
+        retired = publish.publish(self.load(self.courts), 'new')
+        publish.rollback(retired)
+        self.assertEqual(Court.objects.count(), 1)
+        self.assertEqual(DataStatus.objects.get().data_hash, 'old')
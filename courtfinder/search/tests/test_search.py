@@ -2,11 +2,14 @@ import requests
 import json
 import re
 from django.test import TestCase, Client
+from django.test.utils import override_settings
 from mock import Mock, patch
 from search.court_search import CourtSearch, CourtSearchError, CourtSearchClientError, CourtSearchInvalidPostcode
 from search.models import *
 from django.conf import settings
 from search.ingest import Ingest
+from search.catalogue import get_catalogue
+from search import views
 
 
 class SearchTestCase(TestCase):
@@ -42,6 +45,18 @@ class SearchTestCase(TestCase):
         response = c.get('/search/results?q=Accrington')
         self.assertIn("Blackburn", response.content)
 
+    @override_settings(CATALOGUE_CHECK_INTERVAL=3600)
+    def test_format_results_query_count(self):
+        format_results = getattr(views, '__format_results')
+        courts = list(Court.objects.all())
+        get_catalogue()
+        with self.assertNumQueries(0):
+            formatted = format_results(courts)
+        self.assertEqual(len(formatted), len(courts))
+        accrington = [c for c in formatted if c['slug'] == 'accrington-magistrates-court'][0]
+        self.assertEqual(accrington['address']['type'].name, 'Postal')
+        self.assertEqual(accrington['types'], sorted(accrington['types']))
+
     def test_search_space_in_name(self):
         c = Client()
         response = c.get('/search/results?q=Accrington+Magistrates')
@@ -246,6 +261,58 @@ class SearchTestCase(TestCase):
             self.assertEquals(500, response.status_code)
             self.assertIn("something went wrong", response.content)
 
+    def batch(self, searches):
+        response = Client().post('/search/results.json/batch', json.dumps(searches),
+                                 content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return [json.loads(line) for line in ''.join(response.streaming_content).splitlines()]
+
+    @override_settings(SEARCH_BATCH_LOOKUP_THREADS=1)
+    def test_batch_search(self):
+        lines = self.batch([
+            {'postcode': 'SE15 4UH', 'aol': 'Divorce'},
+            {'postcode': 'SE15 4PE'},
+            {'postcode': 'SE15 4UH', 'aol': 'Divorce'},
+            {'postcode': 'SE15 4UH', 'aol': 'doesntexist'},
+            {'aol': 'Divorce'},
+        ])
+        self.assertEqual([(l['postcode'], l['aol']) for l in lines],
+                         [('SE15 4UH', 'Divorce'), ('SE15 4PE', 'All'), ('SE15 4UH', 'Divorce'),
+                          ('SE15 4UH', 'doesntexist'), ('', 'Divorce')])
+        single = json.loads(Client().get('/search/results.json?postcode=SE15+4UH&aol=Divorce').content)
+        self.assertEqual(lines[0]['results'], single)
+        self.assertEqual(lines[2], lines[0])
+        self.assertEqual(lines[3]['error'], 'bad area of law')
+        self.assertEqual(lines[4]['error'], 'bad request')
+        # each postcode is looked up once
+        self.assertEqual(self.mock_mapit.call_count, 3)
+
+    @override_settings(CATALOGUE_CHECK_INTERVAL=3600)
+    def test_batch_lookup_does_not_query_database(self):
+        lookup_postcode = getattr(views, '__lookup_postcode')
+        self.mock_mapit.return_value = {
+            "shortcuts": {"council": 2491},
+            "areas": {"2491": {"name": "Southwark Borough Council"}},
+            "wgs84_lat": 51.46898208902647,
+            "wgs84_lon": -0.06624795134523233,
+        }
+        catalogue = get_catalogue()
+        with self.assertNumQueries(0):
+            found, error = lookup_postcode(catalogue, 'SE15 4UH')
+        self.assertIsNone(error)
+        self.assertEqual(found.local_authority,
+                         LocalAuthority.objects.filter(name='Southwark Borough Council').order_by('pk')[0])
+
+    def test_batch_search_rejects_bad_requests(self):
+        c = Client()
+        self.assertEqual(c.get('/search/results.json/batch').status_code, 405)
+        for body in ('not json', '{"postcode": "SE15"}', '[{"postcode": ["SE15"]}]'):
+            response = c.post('/search/results.json/batch', body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+        with self.settings(SEARCH_BATCH_MAX_SIZE=1):
+            response = c.post('/search/results.json/batch', '[{}, {}]', content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+
     def test_search_no_postcode_nor_q(self):
         c = Client()
         response = c.get('/search/results')
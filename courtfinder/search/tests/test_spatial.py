@@ -0,0 +1,58 @@
+import numpy
+
+from django.test import TestCase
+
+from search.spatial import SpatialIndex, distance_miles, distances_miles
+
+
+class FakeCourt(object):
+    def __init__(self, id, name, lat, lon):
+        self.id = id
+        self.name = name
+        self.lat = lat
+        self.lon = lon
+
+
+class SpatialIndexTestCase(TestCase):
+
+    courts = [
+        FakeCourt(1, 'Southwark', 51.501, -0.093),
+        FakeCourt(2, 'Manchester', 53.480, -2.249),
+        FakeCourt(3, 'Leeds', 53.797, -1.548),
+        FakeCourt(4, 'Cardiff', 51.481, -3.178),
+        FakeCourt(5, 'B Shared Building', 52.486, -1.890),
+        FakeCourt(6, 'A Shared Building', 52.486, -1.890),
+        FakeCourt(7, 'Nowhere', None, None),
+    ]
+
+    def test_distance_matches_earthdistance(self):
+        # SELECT point(-0.12, 51.5) <@> point(-2.24, 53.48)
+        self.assertAlmostEqual(distance_miles(51.5, -0.12, 53.48, -2.24), 163.294, places=3)
+        self.assertEqual(distance_miles(51.5, -0.12, 51.5, -0.12), 0)
+
+    def test_nearest_ordered_by_distance(self):
+        results = SpatialIndex(self.courts).nearest(51.47, -0.07, 3)
+        self.assertEqual([court.name for miles, court in results],
+                         ['Southwark', 'A Shared Building', 'B Shared Building'])
+        self.assertEqual([miles for miles, court in results],
+                         sorted(miles for miles, court in results))
+
+    def test_matches_brute_force(self):
+        index = SpatialIndex(self.courts)
+        located = [c for c in self.courts if c.lat is not None]
+        for lat, lon in [(50.7, -1.3), (54.5, -3.0), (52.486, -1.890), (56.0, -4.0)]:
+            expected = sorted(located, key=lambda c: (distance_miles(lat, lon, c.lat, c.lon), c.name))
+            self.assertEqual([court.id for miles, court in index.nearest(lat, lon, 4)],
+                             [court.id for court in expected[:4]])
+
+    def test_courts_without_position_are_not_indexed(self):
+        self.assertEqual(SpatialIndex(self.courts).size, 6)
+
+    def test_vectorised_distances_match(self):
+        located = [c for c in self.courts if c.lat is not None]
+        lats = numpy.radians(numpy.array([c.lat for c in located] + [numpy.nan]))
+        lons = numpy.radians(numpy.array([c.lon for c in located] + [numpy.nan]))
+        distances = distances_miles(51.47, -0.07, lats, lons)
+        for court, distance in zip(located, distances):
+            self.assertAlmostEqual(distance, distance_miles(51.47, -0.07, court.lat, court.lon), places=9)
+        self.assertTrue(numpy.isnan(distances[-1]))
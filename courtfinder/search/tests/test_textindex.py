@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from django.test import SimpleTestCase
+
+from search.textindex import TextIndex, BKTree, edit_distance, max_edit_distance, words
+
+
+class TextIndexTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.index = TextIndex([
+            (1, "Manchester Civil Justice Centre"),
+            (2, "Manchester Magistrates' Court"),
+            (3, "Accrington Magistrates' Court\nManchester Road"),
+            (4, None),
+        ])
+
+    def test_words_ignore_case_and_punctuation(self):
+        self.assertEqual(words(u"Magistrates' Court,\nEast-Lancs"),
+                         [u'magistrates', u'court', u'east', u'lancs'])
+        self.assertEqual(words(None), [])
+
+    def test_prefix_matches(self):
+        self.assertEqual(self.index.search('manch'), set([1, 2, 3]))
+        self.assertEqual(self.index.search('MAGIS'), set([2, 3]))
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.index.search('manchester court'), set([2, 3]))
+        self.assertEqual(self.index.search('court  manchester  magistrates'), set([2, 3]))
+        self.assertEqual(self.index.search('manchester civil'), set([1]))
+        self.assertEqual(self.index.search('manchester crown'), set())
+
+    def test_only_word_starts_match(self):
+        self.assertEqual(self.index.search('chester'), set())
+
+    def test_empty_query(self):
+        self.assertEqual(self.index.search(''), set())
+        self.assertEqual(self.index.search(' - '), set())
+
+
+class BKTreeTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.words = ['birmingham', 'westminster', 'manchester', 'court',
+                      'crown', 'county', 'accrington', 'coventry']
+        self.tree = BKTree(self.words)
+
+    def test_edit_distance(self):
+        self.assertEqual(edit_distance('kitten', 'sitting'), 3)
+        self.assertEqual(edit_distance('', 'court'), 5)
+        self.assertEqual(edit_distance('court', 'court'), 0)
+
+    def test_finds_close_words(self):
+        self.assertEqual(self.tree.search('birmingam', 2), [(1, 'birmingham')])
+        self.assertEqual(self.tree.search('westminister', 2), [(1, 'westminster')])
+        self.assertEqual(self.tree.search('xyzzy', 2), [])
+
+    def test_same_as_comparing_every_word(self):
+        for query in ('cour', 'crowd', 'countey', 'manchster', 'c'):
+            for distance in range(4):
+                self.assertEqual(
+                    self.tree.search(query, distance),
+                    sorted((edit_distance(query, word), word) for word in self.words
+                           if edit_distance(query, word) <= distance))
+
+    def test_short_words_need_to_be_exact(self):
+        self.assertEqual(max_edit_distance('bow'), 0)
+        self.assertEqual(max_edit_distance('court'), 1)
+        self.assertEqual(max_edit_distance('birmingam'), 2)
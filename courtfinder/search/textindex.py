@@ -0,0 +1,134 @@
+"""
+Inverted index for the name and address search.
+
+Text is split into lower case words on anything that isn't a word
+character, as the search splits queries, and each word maps to the keys
+whose text contains it. A query matches the keys whose text has, for every
+word of the query, a word starting with it, so "manch" finds Manchester.
+
+BKTree finds the words within an edit distance of a misspelt one without
+comparing it with every word: each node's children are keyed by their
+distance from it, and the triangle inequality rules out whole subtrees.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+import re
+
+
+WORD_SEPARATOR = re.compile(r'[^\w]+', re.UNICODE)
+
+
+def words(text):
+    return [word for word in WORD_SEPARATOR.split((text or '').lower()) if word]
+
+
+class TextIndex(object):
+
+    def __init__(self, texts):
+        """
+        texts: (key, text) pairs
+        """
+        postings = defaultdict(set)
+        for key, text in texts:
+            for word in words(text):
+                postings[word].add(key)
+        self._postings = dict(postings)
+        # sorted, so the words starting with a prefix are next to each other
+        self._words = sorted(self._postings)
+
+    def prefixed(self, prefix):
+        """
+        The keys whose text has a word starting with prefix
+        """
+        keys = set()
+        i = bisect_left(self._words, prefix)
+        while i < len(self._words) and self._words[i].startswith(prefix):
+            keys.update(self._postings[self._words[i]])
+            i += 1
+        return keys
+
+    def search(self, query):
+        """
+        The keys matching every word of the query
+        """
+        matches = sorted((self.prefixed(word) for word in set(words(query))), key=len)
+        if not matches:
+            return set()
+        # smallest first, so the intersection shrinks as fast as it can
+        keys = set(matches[0])
+        for match in matches[1:]:
+            if not keys:
+                break
+            keys &= match
+        return keys
+
+
+def edit_distance(a, b):
+    """
+    Levenshtein distance: the fewest insertions, deletions and
+    substitutions that turn a into b
+    """
+    if len(a) < len(b):
+        a, b = b, a
+    previous = range(len(b) + 1)
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1,
+                               current[j - 1] + 1,
+                               previous[j - 1] + (char_a != char_b)))
+        previous = current
+    return previous[-1]
+
+
+def max_edit_distance(word):
+    """
+    How many typos to allow in a word: none in short ones, where one edit
+    could make any other short word
+    """
+    if len(word) < 4:
+        return 0
+    if len(word) < 8:
+        return 1
+    return 2
+
+
+class BKTree(object):
+
+    def __init__(self, words):
+        # nodes are (word, {distance: child node})
+        self._root = None
+        for word in sorted(set(words)):
+            self.add(word)
+
+    def add(self, word):
+        if self._root is None:
+            self._root = (word, {})
+            return
+        node = self._root
+        while True:
+            distance = edit_distance(word, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = (word, {})
+                return
+            node = child
+
+    def search(self, word, max_distance):
+        """
+        (distance, word) for the words within max_distance of word, closest
+        first
+        """
+        results = []
+        nodes = [self._root] if self._root is not None else []
+        while nodes:
+            node_word, children = nodes.pop()
+            distance = edit_distance(word, node_word)
+            if distance <= max_distance:
+                results.append((distance, node_word))
+            for child_distance, child in children.items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    nodes.append(child)
+        return sorted(results)
@@ -14,5 +14,6 @@ urlpatterns = patterns('',
     url(r'^courtcode$', views.courtcode, name='courtcode'),
 
     url(r'^results.json$', views.results_json, name='api-results'),
+    url(r'^results.json/batch$', views.results_json_batch, name='api-results-batch'),
     url(r'^datastatus$', views.data_status, name='data-status'),
 )
@@ -1,16 +1,24 @@
+from collections import OrderedDict
+from functools import partial
+from itertools import imap
 import json
+from multiprocessing.pool import ThreadPool
 import re
 from urllib import urlencode
 
+from django.conf import settings
 from django.shortcuts import render, redirect
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseServerError, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseServerError, HttpResponseRedirect, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 from django.core.serializers.json import DjangoJSONEncoder
 from django.views.defaults import bad_request
 
 from search.models import Court, AreaOfLaw, DataStatus, EmergencyMessage
-from search.court_search import CourtSearch, CourtSearchError, CourtSearchClientError, CourtSearchInvalidPostcode
+from search.court_search import CourtSearch, CourtSearchError, CourtSearchClientError, CourtSearchInvalidPostcode, Postcode
 from search.rules import Rules
+from search.catalogue import get_catalogue
 from urlparse import urlparse
 
 
@@ -213,6 +221,40 @@ def results_json(request):
 
 
 
+@csrf_exempt
+@require_POST
+def results_json_batch(request):
+    """
+    Postcode searches in bulk. Takes a JSON list of up to
+    SEARCH_BATCH_MAX_SIZE {"postcode": ..., "aol": ..., "spoe": ...}
+    objects, aol and spoe defaulting as they do for results.json, and
+    streams back one line of JSON per search, in the same order: the
+    search with its "results", or with an "error".
+
+    Each postcode is looked up once, SEARCH_BATCH_LOOKUP_THREADS at a time,
+    and repeated searches are answered once.
+    """
+    try:
+        searches = json.loads(request.body)
+    except ValueError:
+        return HttpResponseBadRequest('{"error":"body is not JSON"}',
+                                      content_type="application/json")
+    if not isinstance(searches, list) or not all(isinstance(s, dict) for s in searches):
+        return HttpResponseBadRequest('{"error":"expected a list of searches"}',
+                                      content_type="application/json")
+    if len(searches) > settings.SEARCH_BATCH_MAX_SIZE:
+        return HttpResponseBadRequest('{"error":"at most %d searches per batch"}' % settings.SEARCH_BATCH_MAX_SIZE,
+                                      content_type="application/json")
+
+    searches = [(s.get('postcode') or '', s.get('aol', 'All'), s.get('spoe', 'start'))
+                for s in searches]
+    if not all(isinstance(value, basestring) for search in searches for value in search):
+        return HttpResponseBadRequest('{"error":"postcode, aol and spoe must be strings"}',
+                                      content_type="application/json")
+    return StreamingHttpResponse(__batch_results(searches),
+                                 content_type="application/x-ndjson")
+
+
 def data_status(request):
     last_change = DataStatus.objects.all().order_by('-last_ingestion_date')[0]
     last_change_object = {
@@ -224,22 +266,80 @@ def data_status(request):
 ################################################################################
 # Private
 
+def __lookup_postcode(catalogue, postcode):
+    """
+    (Postcode, None) or (None, error) for a batch search. Local authorities
+    come from the catalogue, so lookups don't use the database.
+    """
+    try:
+        return Postcode(postcode, catalogue), None
+    except (CourtSearchError, CourtSearchClientError) as e:
+        return None, unicode(e)
+
+
+def __batch_results(searches):
+    """
+    Lines of JSON answering (postcode, aol, spoe) searches in order
+    """
+    # in the order they are first needed, so the lookups finish in that order
+    postcodes = list(OrderedDict.fromkeys(postcode for postcode, aol, spoe in searches if postcode))
+    lookup = partial(__lookup_postcode, get_catalogue())
+    pool = None
+    if settings.SEARCH_BATCH_LOOKUP_THREADS > 1 and len(postcodes) > 1:
+        pool = ThreadPool(min(settings.SEARCH_BATCH_LOOKUP_THREADS, len(postcodes)))
+        lookups = pool.imap(lookup, postcodes)
+    else:
+        lookups = imap(lookup, postcodes)
+
+    try:
+        looked_up = {}
+        answers = {}
+        for search in searches:
+            postcode, aol, spoe = search
+            if search not in answers:
+                if not postcode:
+                    answers[search] = {'error': 'bad request'}
+                else:
+                    while postcode not in looked_up:
+                        looked_up[postcodes[len(looked_up)]] = next(lookups)
+                    found, error = looked_up[postcode]
+                    if error is not None:
+                        answers[search] = {'error': error}
+                    else:
+                        try:
+                            answers[search] = {'results': __format_results(
+                                CourtSearch(found, aol, spoe).get_courts())}
+                        except (CourtSearchError, CourtSearchClientError) as e:
+                            answers[search] = {'error': unicode(e)}
+            line = {'postcode': postcode, 'aol': aol, 'spoe': spoe}
+            line.update(answers[search])
+            yield json.dumps(line, default=str) + '\n'
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
 def __format_results(results):
     """
-    create a list of courts from search results that we can send to templates
+    create a list of courts from search results that we can send to templates.
+    Related data comes from the court catalogue, so formatting a page of
+    results doesn't query the database per court.
     """
+    catalogue = get_catalogue()
     courts=[]
     for result in results:
 
-        addresses = result.courtaddress_set.all().order_by("-pk")
+        # the postal address with the highest pk, otherwise the highest pk
+        addresses = sorted(catalogue.addresses.get(result.id, ()),
+                           key=lambda a: a.pk, reverse=True)
         address = False
-        if addresses != []:
-            for a in addresses:
-                if a.address_type.name == 'Postal':
-                    address = a
-                    break
-                else:
-                    address = addresses[0]
+        for a in addresses:
+            if a.address_type.name == 'Postal':
+                address = a
+                break
+        else:
+            if addresses:
+                address = addresses[0]
 
         if address:
             visible_address = {
@@ -252,22 +352,22 @@ def __format_results(results):
         else:
             visible_address = {}
 
-        areas_of_law = [aol for aol in result.areas_of_law.all()]
+        areas_of_law = list(catalogue.areas_of_law_for(result.id))
 
         court = { 'name': result.name,
                   'lat': result.lat,
                   'lon': result.lon,
                   'number': result.number,
                   'slug': result.slug,
-                  'types': sorted([court_type.court_type.name for court_type in result.courtcourttype_set.all()]),
+                  'types': sorted(catalogue.court_types.get(result.id, ())),
                   'address': visible_address,
                   'areas_of_law': areas_of_law,
                   'displayed' : result.displayed,
                   'hide_aols': result.hide_aols}
                   
-        dx_contacts = result.courtcontact_set.filter(contact__name='DX')
-        if dx_contacts.count() > 0:
-            court['dx_number'] = dx_contacts.first().contact.number
+        dx_contacts = [c for c in catalogue.contacts.get(result.id, ()) if c.name == 'DX']
+        if dx_contacts:
+            court['dx_number'] = dx_contacts[0].number
 
         if hasattr(result, 'distance') and result.distance:
             court['distance'] = round(result.distance, 2)
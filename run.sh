@@ -20,5 +20,10 @@ create)
     echo "Docker state set to ${DOCKER_STATE}... no commands found."
 esac
 
+if [ -z "${POSTCODE_CACHE_LOCATION}" ]; then
+    echo "Starting memcached for the postcode cache..."
+    memcached -d -l 127.0.0.1 -p 11211 -m ${POSTCODE_CACHE_MEMCACHED_MB:-64}
+fi
+
 echo "Starting server..."
-/usr/local/bin/uwsgi --ini /srv/search/uwsgi.conf
+/usr/local/bin/uwsgi --ini /srv/search/${UWSGI_CONF:-uwsgi.conf}